@@ -4,3 +4,26 @@ from django.apps import AppConfig
 class FsimConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'fsim'
+
+    model_name = 'VGG-Face'
+    detector_backend = 'opencv'
+    distance_metric = 'cosine'
+    model_version = f'{model_name}-{detector_backend}'
+
+    def ready(self):
+        from image_project.libraries.registry import registry
+        from image_project.libraries.warmup import warmup
+
+        # DeepFace builds and caches its model on first use, or at server start if preloaded
+        registry.register('fsim', self.load_model)
+        warmup.register('fsim', self.warm_up)
+
+    def load_model(self):
+        from deepface import DeepFace
+
+        return DeepFace.build_model(self.model_name)
+
+    def warm_up(self):
+        from .function import feature
+
+        feature.warmup()
@@ -7,7 +7,9 @@ It also imports utility functions from the 'utils' module.
 
 Imports:
     - `cv2`: OpenCV library for computer vision tasks.
-    - `DeepFace`: A deep learning-based face recognition library.
+    - `DeepFace`: A deep learning-based face recognition library, imported on first use
+    so that importing this module does not load TensorFlow.
+    - `registry` from `image_project.libraries.registry`: The lazily loaded models.
     - `utils` from `..libraries`: Utility functions for face-related tasks.
 
 Example:
@@ -24,8 +26,13 @@ See Also:
     - 'utils' module for utility functions related to face tasks.
 """
 import cv2
-from deepface import DeepFace
+import numpy as np
+from django.db import transaction
+from image_project.libraries import coalescing, images, inference_service, timing
+from image_project.libraries.registry import registry
 from ..libraries import utils
+from ..libraries.gallery import face_gallery
+from ..apps import FsimConfig
 
 
 
@@ -38,8 +45,8 @@ def predict_similarity(serializer):
     and uses the DeepFace library to verify the similarity between the images.
 
     Parameters:
-        serializer: The serializer containing face data, 
-        including the National Identity Number (NIK).
+        serializer: The validated, unsaved serializer containing face data,
+        including the National Identity Number (NIK) and the test image.
 
     Returns:
         tuple: A tuple containing the predicted similarity percentage and 
@@ -49,26 +56,265 @@ def predict_similarity(serializer):
         >>> from ..serializers import FaceSerializer
         >>> from ..function import predict_similarity
         >>> serializer = FaceSerializer(data={'nik': '1234567890', ...})
+        >>> serializer.is_valid()
         >>> similarity, is_similar = predict_similarity(serializer)
 
     Note:
         - The function relies on the 'utils' module for retrieving and deleting signature data.
         - The similarity is calculated as a percentage based on the distance returned by DeepFace.
         - If the faces are verified as similar, the corresponding signature data is deleted.
+        - The representation of an enrolled anchor is read from the database, so only
+        the test image goes through face detection and the model.
+        - The test image is decoded from the uploaded bytes and never written to disk.
     """
-    nik = serializer.data.get('nik')
-    anchor_path, test_path = utils.find_saved_signatures_by_nik(nik)
-    image1 = cv2.imread(anchor_path)
-    image2 = cv2.imread(test_path)
-    result = DeepFace.verify(image1, image2)
-    verified = result['verified']
+    nik = serializer.validated_data['nik']
+    data = images.read_upload(serializer.validated_data['img'])
+    with timing.stage('db'):
+        anchor_face = utils.find_anchor_by_nik(nik)
+    # Identical requests in flight (retries, double submits) share one verification. The
+    # anchor id is part of the key, so a verification against a replaced anchor is not shared
+    key = coalescing.key('fsim:verify', nik, anchor_face.id, FsimConfig.model_version, data)
+    kemiripan, verified = coalescing.run('fsim', key, lambda: verify_face(anchor_face, data))
+    with timing.stage('delete'):
+        utils.delete_signature_data_by_nik(nik)
+    return kemiripan, verified
+
+def verify_face(anchor_face, data):
+    """
+    Verify an uploaded face against an anchor face.
+
+    Parameters:
+        anchor_face: The anchor Face object.
+        data (bytes): The encoded test image.
+
+    Returns:
+        tuple: The similarity percentage, and whether the faces are similar.
+    """
+    from deepface.commons import distance as dst
+
+    with timing.stage('db'):
+        anchor_embedding = get_anchor_embedding(anchor_face)
+    test_image = images.decode_bgr(data)
+    test_faces = represent_face(test_image)
+    threshold = dst.findThreshold(FsimConfig.model_name, FsimConfig.distance_metric)
+    jarak = float(min(
+        dst.findCosineDistance(anchor_embedding, test_embedding)
+        for test_embedding, _ in test_faces
+    ))
+    verified = bool(jarak <= threshold)
 
-    if result['verified'] == True:
-        jarak = result['distance']
+    if verified == True:
         kemiripan = (((4 - jarak) / 4) * 100)
-        utils.delete_signature_data_by_nik(nik)
-        return kemiripan, verified
     else:
         kemiripan = 0
-        utils.delete_signature_data_by_nik(nik)
-        return kemiripan, verified
+    return kemiripan, verified
+
+def identify_face(image, top_k=5):
+    """
+    Identify a probe face against every enrolled anchor face.
+
+    Parameters:
+        image: The BGR probe image as decoded by OpenCV.
+        top_k (int): The number of closest enrolled NIKs to return.
+
+    Returns:
+        list: A list of dictionaries with the NIK, the cosine distance, the
+        similarity percentage and whether the distance is within the verification threshold,
+        sorted from the closest match.
+
+    Example:
+        >>> image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        >>> matches = identify_face(image, top_k=3)
+
+    Note:
+        - Only the first detected face of the probe image is searched.
+        - Only anchors enrolled with the current model version are searched.
+    """
+    from deepface.commons import distance as dst
+
+    embedding, _ = represent_face(image)[0]
+    threshold = dst.findThreshold(FsimConfig.model_name, FsimConfig.distance_metric)
+
+    matches = []
+    for nik, jarak in face_gallery.search(embedding, top_k):
+        matches.append({
+            'nik': nik,
+            'distance': jarak,
+            'similarity': ((4 - jarak) / 4) * 100,
+            'is_similar': jarak <= threshold,
+        })
+
+    return matches
+
+
+def enroll_anchor(serializer):
+    """
+    Enroll an anchor face by precomputing its DeepFace representation.
+
+    This function detects and aligns the face of the uploaded anchor image first,
+    then saves the Face record with the representation and the aligned face crop
+    tagged with the model version, and removes any previous anchor of the same NIK,
+    in one transaction.
+
+    Parameters:
+        serializer: The validated, unsaved serializer of the anchor face.
+
+    Returns:
+        Face: The enrolled Face object.
+
+    Example:
+        >>> serializer = FaceSerializer(data={'nik': '1234567890', ...})
+        >>> serializer.is_valid()
+        >>> anchor_face = enroll_anchor(serializer)
+
+    Note:
+        - Later predictions for the NIK only run inference on the test image.
+        - Only the first detected face of the anchor image is enrolled.
+        - When no face is detected, nothing is saved and the previous anchor is kept.
+    """
+    data = images.read_upload(serializer.validated_data['img'])
+    embedding, face_crop = represent_face(images.decode_bgr(data))[0]
+
+    with timing.stage('save'), transaction.atomic():
+        anchor_face = serializer.save()
+        store_anchor_representation(anchor_face, embedding, face_crop)
+        utils.delete_previous_anchors_by_nik(anchor_face.nik, keep_id=anchor_face.id)
+
+    return anchor_face
+
+
+def get_anchor_embedding(anchor_face):
+    """
+    Get the representation of an anchor face, computing it only when needed.
+
+    Parameters:
+        anchor_face: The anchor Face object.
+
+    Returns:
+        numpy.ndarray: The DeepFace representation of the anchor face.
+
+    Note:
+        - A stored representation is reused when its model version matches.
+        - A stale representation of an enrolled anchor is recomputed from the stored
+        aligned face crop, skipping face detection, and saved again.
+    """
+    if anchor_face.embedding and anchor_face.model_version == FsimConfig.model_version:
+        return utils.array_from_bytes(anchor_face.embedding)
+
+    if anchor_face.face_crop:
+        face_crop = utils.array_from_bytes(anchor_face.face_crop)
+        embedding = represent_aligned_face(face_crop.astype(np.float32) / 255)
+    else:
+        embedding, face_crop = represent_face(cv2.imread(anchor_face.img.path))[0]
+
+    if anchor_face.is_enrolled:
+        store_anchor_representation(anchor_face, embedding, face_crop)
+
+    return embedding
+
+
+def store_anchor_representation(anchor_face, embedding, face_crop):
+    """
+    Store an anchor representation and aligned face crop tagged with the model version.
+
+    Parameters:
+        anchor_face: The anchor Face object.
+        embedding: The DeepFace representation of the anchor face.
+        face_crop: The aligned face crop as a uint8 array.
+    """
+    anchor_face.embedding = utils.array_to_bytes(embedding)
+    anchor_face.face_crop = utils.array_to_bytes(face_crop)
+    anchor_face.model_version = FsimConfig.model_version
+    anchor_face.save(update_fields=['embedding', 'face_crop', 'model_version'])
+
+
+def represent_face(image):
+    """
+    Detect, align and represent every face in an image.
+
+    Parameters:
+        image: The BGR image as read by ``cv2.imread``.
+
+    Returns:
+        list: A list of ``(embedding, face_crop)`` tuples, one per detected face,
+        where ``face_crop`` is the aligned face as a uint8 array.
+
+    Note:
+        - Detection and alignment use the same settings as ``DeepFace.verify``,
+        so distances match the ones it would report.
+        - A ValueError is raised by DeepFace when no face is detected.
+        - Runs in the inference server when the fsim engine is remote.
+    """
+    if inference_service.is_remote('fsim'):
+        return inference_service.call('fsim', 'represent_face', image)
+
+    from deepface.commons import functions
+
+    target_size = functions.find_target_size(model_name=FsimConfig.model_name)
+    with timing.stage('detect'):
+        face_objs = functions.extract_faces(
+            img=image,
+            target_size=target_size,
+            detector_backend=FsimConfig.detector_backend,
+            grayscale=False,
+            enforce_detection=True,
+            align=True,
+        )
+
+    faces = []
+    for face_img, _, _ in face_objs:
+        face_crop = np.round(face_img * 255).astype(np.uint8)
+        faces.append((represent_aligned_face(face_img), face_crop))
+
+    return faces
+
+
+def warmup():
+    """
+    Run face detection and representation on a synthetic image.
+
+    DeepFace builds its detector and traces its model on first use; running them
+    at boot keeps that cost out of the first request.
+
+    Note:
+        - Detection does not enforce a face, so the whole synthetic image is represented.
+    """
+    from deepface.commons import functions
+
+    image = np.random.default_rng(0).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    face_objs = functions.extract_faces(
+        img=image,
+        target_size=functions.find_target_size(model_name=FsimConfig.model_name),
+        detector_backend=FsimConfig.detector_backend,
+        grayscale=False,
+        enforce_detection=False,
+        align=True,
+    )
+    represent_aligned_face(face_objs[0][0])
+
+
+def represent_aligned_face(face_img):
+    """
+    Represent an already detected and aligned face.
+
+    Parameters:
+        face_img: The aligned face with pixel values in [0, 1].
+
+    Returns:
+        numpy.ndarray: The DeepFace representation of the face.
+    """
+    if inference_service.is_remote('fsim'):
+        return inference_service.call('fsim', 'represent_aligned_face', face_img)
+
+    from deepface import DeepFace
+
+    # Builds DeepFace's cached model through the registry, which records its load time
+    registry.get('fsim')
+
+    with timing.stage('inference', model='fsim'):
+        result = DeepFace.represent(
+            img_path=face_img,
+            model_name=FsimConfig.model_name,
+            detector_backend='skip',
+        )
+    return np.array(result[0]['embedding'], dtype=np.float32)
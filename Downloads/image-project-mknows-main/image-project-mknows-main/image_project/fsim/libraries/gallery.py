@@ -0,0 +1,217 @@
+"""
+Module for 1:N search over the enrolled anchor faces.
+
+This module keeps the representations of every enrolled anchor face in one
+contiguous, L2-normalized NumPy matrix, so scoring a probe face against the
+whole gallery is a single matrix-vector product. Above a configurable gallery
+size, a coarse IVF (inverted file) index built with spherical k-means limits
+the scoring to the rows of the clusters closest to the probe.
+
+Settings:
+    - `FSIM_GALLERY_IVF_MIN_SIZE`: Gallery size from which the IVF index is used.
+    - `FSIM_GALLERY_IVF_NPROBE`: Number of clusters scored per search.
+
+Example:
+    >>> from ..libraries.gallery import face_gallery
+    >>> matches = face_gallery.search(embedding, top_k=5)
+
+Note:
+    - The gallery is refreshed lazily: each search checks the count and the latest
+    id of the enrolled anchors, appends new enrollments and reloads on deletions
+    and re-enrollments.
+"""
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from ..apps import FsimConfig
+from ..models import Face
+from . import utils
+
+
+class FaceGallery:
+    """
+    In-memory gallery of enrolled anchor face representations.
+
+    Methods:
+        - search(embedding, top_k): Returns the closest enrolled NIKs by cosine distance.
+
+    Note:
+        - Rows are stored in a capacity-doubling buffer, so enrollments are appended
+        without copying the whole matrix.
+        - Searches score an immutable snapshot of the matrix, the NIKs and the IVF
+        index taken under the lock, so a concurrent refresh never mixes them.
+        - The gallery is reloaded when its version, the count and the latest id of
+        the enrolled anchors, shows rows were replaced: re-enrolling a NIK deletes
+        its anchor and saves a new one, so the count stays the same but the latest
+        id changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._niks = []
+        self._size = 0
+        self._last_id = 0
+        self._version = None
+        self._ivf = None
+        self._snapshot = (self._matrix, (), None)
+
+    def search(self, embedding, top_k=5):
+        """
+        Search a probe representation against every enrolled anchor.
+
+        Parameters:
+            embedding: The DeepFace representation of the probe face.
+            top_k (int): The number of matches to return.
+
+        Returns:
+            list: A list of ``(nik, distance)`` tuples sorted by increasing cosine distance.
+        """
+        with self._lock:
+            self._refresh()
+            matrix, niks, ivf = self._snapshot
+
+        if not len(matrix):
+            return []
+
+        query = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        query = query / np.linalg.norm(query)
+
+        if ivf is not None:
+            candidates = ivf.candidates(query)
+            scores = matrix[candidates] @ query
+        else:
+            candidates = None
+            scores = matrix @ query
+
+        if not len(scores):
+            return []
+
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        rows = candidates[best] if candidates is not None else best
+
+        return [(niks[row], float(1 - scores[i])) for row, i in zip(rows, best)]
+
+    def _refresh(self):
+        enrolled = Face.objects.filter(
+            is_anchor=True,
+            is_enrolled=True,
+            model_version=FsimConfig.model_version,
+        ).exclude(embedding=None)
+        version = (enrolled.count(), enrolled.aggregate(last_id=Max('id'))['last_id'])
+
+        if version == self._version:
+            return
+
+        new_rows = enrolled.filter(id__gt=self._last_id)
+        if version[0] - self._size != new_rows.count():
+            # Anchors were deleted or replaced, so rows cannot simply be appended
+            self._reset()
+            new_rows = enrolled
+
+        start = self._size
+        for face_id, nik, embedding in new_rows.order_by('id').values_list(
+                'id', 'nik', 'embedding').iterator():
+            vector = utils.array_from_bytes(embedding).astype(np.float32)
+            self._append(nik, vector.reshape(-1))
+            self._last_id = face_id
+
+        self._update_ivf(start)
+        self._version = version
+        # Appends only write rows past the snapshot, and the IVF index is never mutated
+        self._snapshot = (self._matrix[:self._size], tuple(self._niks), self._ivf)
+
+    def _append(self, nik, vector):
+        if self._matrix.shape[1] != vector.shape[0]:
+            self._matrix = np.empty((1024, vector.shape[0]), dtype=np.float32)
+        elif self._size == len(self._matrix):
+            grown = np.empty((2 * len(self._matrix), self._matrix.shape[1]), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+
+        self._matrix[self._size] = vector / np.linalg.norm(vector)
+        self._niks.append(nik)
+        self._size += 1
+
+    def _update_ivf(self, start):
+        min_size = getattr(settings, 'FSIM_GALLERY_IVF_MIN_SIZE', 50000)
+        nprobe = getattr(settings, 'FSIM_GALLERY_IVF_NPROBE', 8)
+
+        if self._size < min_size:
+            self._ivf = None
+        elif self._ivf is None or self._size > 2 * self._ivf.trained_size:
+            self._ivf = IVFIndex.train(self._matrix[:self._size], nprobe)
+        else:
+            self._ivf = self._ivf.extended(self._matrix[start:self._size], start)
+
+
+class IVFIndex:
+    """
+    Coarse inverted file index over normalized representations.
+
+    Methods:
+        - train(matrix, nprobe): Builds the index with spherical k-means.
+        - add(rows, start): Assigns appended rows to their closest cluster, in place.
+        - extended(rows, start): Returns a copy of the index with appended rows assigned.
+        - candidates(query): Returns the row indices of the clusters closest to the query.
+
+    Note:
+        - The index is retrained when the gallery doubles since the last training.
+    """
+
+    def __init__(self, centroids, lists, nprobe, trained_size):
+        self.centroids = centroids
+        self.lists = lists
+        self.nprobe = nprobe
+        self.trained_size = trained_size
+
+    @classmethod
+    def train(cls, matrix, nprobe, iterations=10, sample_per_cluster=64, seed=0):
+        n_clusters = max(1, int(np.sqrt(len(matrix))))
+        rng = np.random.default_rng(seed)
+        sample_size = min(len(matrix), n_clusters * sample_per_cluster)
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        centroids = sample[rng.choice(sample_size, n_clusters, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = np.argmax(sample @ centroids.T, axis=1)
+            for cluster in range(n_clusters):
+                members = sample[assignments == cluster]
+                if len(members):
+                    centroid = members.sum(axis=0)
+                    centroids[cluster] = centroid / np.linalg.norm(centroid)
+
+        index = cls(centroids, [np.empty(0, dtype=np.int64)] * n_clusters,
+                    nprobe, len(matrix))
+        index.add(matrix, 0)
+        return index
+
+    def add(self, rows, start, chunk_size=65536):
+        for offset in range(0, len(rows), chunk_size):
+            chunk = rows[offset:offset + chunk_size]
+            assignments = np.argmax(chunk @ self.centroids.T, axis=1)
+            row_ids = np.arange(start + offset, start + offset + len(chunk))
+            for cluster in np.unique(assignments):
+                self.lists[cluster] = np.concatenate(
+                    [self.lists[cluster], row_ids[assignments == cluster]])
+
+    def extended(self, rows, start):
+        index = IVFIndex(self.centroids, list(self.lists), self.nprobe, self.trained_size)
+        index.add(rows, start)
+        return index
+
+    def candidates(self, query):
+        nprobe = min(self.nprobe, len(self.centroids))
+        closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[cluster] for cluster in closest])
+
+
+face_gallery = FaceGallery()
@@ -1,34 +1,28 @@
+import io
+
+import numpy as np
 from ..models import Face
 
-def find_saved_signatures_by_nik(nik):
+def find_anchor_by_nik(nik):
     """
-    Find the saved signature images for a given National Identity Number (NIK).
-
-    This function retrieves the paths of the anchor and 
-    test signature images associated with the specified NIK.
+    Find the anchor Face record for a given National Identity Number (NIK).
 
     Parameters:
-        nik (str): The National Identity Number (NIK) for 
-        which signature images are to be retrieved.
+        nik (str): The National Identity Number (NIK) for
+        which the anchor is to be retrieved.
 
     Returns:
-        tuple: A tuple containing the paths of the anchor and test signature images.
+        Face: The anchor Face object.
 
     Example:
-        >>> from ..function import find_saved_signatures_by_nik
-        >>> anchor_path, test_path = find_saved_signatures_by_nik('1234567890')
+        >>> from ..libraries import utils
+        >>> anchor_face = utils.find_anchor_by_nik('1234567890')
 
     Note:
-        - The function assumes there is one anchor and one 
-        test signature image for the specified NIK.
-        - The paths are obtained from the 'img' attribute of Face objects in the database.
+        - When several anchors exist for the NIK, the most recently saved one is used.
+        - Test images are decoded from the request and never saved, so only anchors are stored.
     """
-    anchor_sign = Face.objects.get(nik=nik, is_anchor=True)
-    test_sign = Face.objects.get(nik=nik, is_anchor=False)
-    anchor_path = anchor_sign.img.path
-    test_path = test_sign.img.path
-
-    return anchor_path, test_path
+    return Face.objects.filter(nik=nik, is_anchor=True).latest('id')
 
 
 def delete_signature_data_by_nik(nik):
@@ -45,7 +39,57 @@ def delete_signature_data_by_nik(nik):
         >>> delete_signature_data_by_nik('1234567890')
 
     Note:
-        - All Face objects in the database with the specified NIK are deleted.
+        - All Face objects in the database with the specified NIK are deleted,
+        except enrolled anchors, which are kept for later predictions.
         - Use with caution, as it permanently removes signature data.
     """
-    Face.objects.filter(nik=nik).delete()
+    Face.objects.filter(nik=nik, is_enrolled=False).delete()
+
+
+def delete_previous_anchors_by_nik(nik, keep_id=None):
+    """
+    Delete every anchor of a given National Identity Number (NIK) except one.
+
+    Parameters:
+        nik (str): The National Identity Number (NIK) whose anchors are to be deleted.
+        keep_id (int): The primary key of the anchor that must be kept.
+
+    Example:
+        >>> from ..libraries import utils
+        >>> utils.delete_previous_anchors_by_nik('1234567890', keep_id=42)
+    """
+    Face.objects.filter(nik=nik, is_anchor=True).exclude(id=keep_id).delete()
+
+
+def array_to_bytes(array):
+    """
+    Serialize a NumPy array into bytes for storage in a BinaryField.
+
+    Parameters:
+        array: The array to serialize.
+
+    Returns:
+        bytes: The array in NumPy ``.npy`` format, keeping its dtype and shape.
+
+    Example:
+        >>> data = array_to_bytes(np.zeros((1, 2622), dtype=np.float32))
+    """
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def array_from_bytes(data):
+    """
+    Deserialize a NumPy array stored by ``array_to_bytes``.
+
+    Parameters:
+        data: The bytes (or memoryview) read from a BinaryField.
+
+    Returns:
+        numpy.ndarray: The stored array.
+
+    Example:
+        >>> array = array_from_bytes(face.embedding)
+    """
+    return np.load(io.BytesIO(bytes(data)), allow_pickle=False)
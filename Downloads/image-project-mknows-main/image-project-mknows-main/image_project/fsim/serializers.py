@@ -4,5 +4,8 @@ from .models import Face
 class FaceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Face
-        fields = ('id', 'nik', 'img', 'is_anchor')
-    
\ No newline at end of file
+        fields = ('id', 'nik', 'img', 'is_anchor', 'is_enrolled')
+
+class IdentifyFaceSerializer(serializers.Serializer):
+    img = serializers.ImageField()
+    top_k = serializers.IntegerField(default=5, min_value=1, max_value=100)
@@ -1,3 +1,105 @@
-from django.test import TestCase
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .apps import FsimConfig
+from .function import feature
+from .libraries import utils
+from .libraries.gallery import FaceGallery, IVFIndex
+from .models import Face
+
+
+def enroll(nik, embedding):
+    return Face.objects.create(
+        nik=nik,
+        img=f'images/{nik}.png',
+        is_anchor=True,
+        is_enrolled=True,
+        embedding=utils.array_to_bytes(np.asarray(embedding, dtype=np.float32)),
+        model_version=FsimConfig.model_version,
+    )
+
+
+class FaceGalleryTest(TestCase):
+    def test_refresh_after_re_enroll(self):
+        gallery = FaceGallery()
+        enroll('1', [1, 0, 0])
+        enroll('2', [0, 1, 0])
+        self.assertEqual(gallery.search([1, 0, 0], top_k=1)[0][0], '1')
+
+        # Re-enrolling replaces the anchor, so the number of rows stays the same
+        Face.objects.filter(nik='1').delete()
+        enroll('1', [0, 0, 1])
+        nik, distance = gallery.search([0, 0, 1], top_k=1)[0]
+        self.assertEqual(nik, '1')
+        self.assertAlmostEqual(distance, 0.0, places=5)
+
+    def test_appends_new_enrollments(self):
+        gallery = FaceGallery()
+        enroll('1', [1, 0, 0])
+        gallery.search([1, 0, 0])
+        enroll('2', [0, 1, 0])
+        self.assertEqual([nik for nik, _ in gallery.search([0, 1, 0])], ['2', '1'])
+
+    @override_settings(FSIM_GALLERY_IVF_MIN_SIZE=16, FSIM_GALLERY_IVF_NPROBE=64)
+    def test_ivf_search(self):
+        gallery = FaceGallery()
+        embeddings = np.random.default_rng(0).normal(size=(40, 8))
+        for nik, embedding in enumerate(embeddings[:20]):
+            enroll(str(nik), embedding)
+        # Trained on the first 20 rows, then extended with the next 10
+        gallery.search(embeddings[0])
+        for nik, embedding in enumerate(embeddings[20:30], start=20):
+            enroll(str(nik), embedding)
+
+        for nik in (3, 25):
+            matches = gallery.search(embeddings[nik], top_k=3)
+            self.assertEqual(matches[0][0], str(nik))
+            self.assertAlmostEqual(matches[0][1], 0.0, places=5)
+            self.assertEqual(len(matches), 3)
+
+
+class IVFIndexTest(SimpleTestCase):
+    def test_candidates_cover_rows(self):
+        matrix = np.random.default_rng(0).normal(size=(100, 8)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        index = IVFIndex.train(matrix, nprobe=len(matrix))
+        self.assertEqual(sorted(index.candidates(matrix[0])), list(range(100)))
+
+    def test_extended_keeps_the_original(self):
+        matrix = np.random.default_rng(0).normal(size=(20, 8)).astype(np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+        index = IVFIndex.train(matrix[:16], nprobe=16)
+        extended = index.extended(matrix[16:], 16)
+        self.assertEqual(sorted(index.candidates(matrix[0])), list(range(16)))
+        self.assertEqual(sorted(extended.candidates(matrix[0])), list(range(20)))
+
+
+class PredictSimilarityCoalescingTest(TestCase):
+    def predict(self, nik):
+        serializer = SimpleNamespace(validated_data={'nik': nik, 'img': SimpleUploadedFile('probe.jpg', b'probe')})
+        return feature.predict_similarity(serializer)
+
+    def test_key_includes_the_anchor(self):
+        calls = []
+
+        def run(name, key, compute):
+            calls.append(key)
+            return compute()
+
+        enroll('1', [1, 0, 0])
+        with mock.patch.object(feature.coalescing, 'run', run), \
+                mock.patch.object(feature, 'verify_face', lambda anchor_face, data: (anchor_face.id, True)):
+            first = self.predict('1')
+            self.assertEqual(self.predict('1'), first)
+
+            # A re-enrolled anchor is verified on its own, not coalesced with the previous one
+            Face.objects.filter(nik='1').delete()
+            anchor = enroll('1', [0, 1, 0])
+            self.assertEqual(self.predict('1'), (anchor.id, True))
+
+        self.assertEqual(calls[0], calls[1])
+        self.assertNotEqual(calls[1], calls[2])
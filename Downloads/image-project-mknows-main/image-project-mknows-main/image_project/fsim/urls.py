@@ -1,11 +1,16 @@
 from django.urls import path
 
-from .views import Template, AnchorFaceUpload, PredictFaceSimilarity
+from .views import Template, AnchorFaceUpload, EnrollFaceUpload, PredictFaceSimilarity, IdentifyFace
+from .views import AsyncPredictFaceSimilarity, AsyncIdentifyFace
 
 urlpatterns = [
     path('template/', Template.as_view(), name='template_fsim'),
     path('upload-anchor/', AnchorFaceUpload.as_view(), name='upload_anchor'),
-    path('predict-similarity/', PredictFaceSimilarity.as_view(), name='predict_similarity')
+    path('enroll-anchor/', EnrollFaceUpload.as_view(), name='enroll_anchor'),
+    path('predict-similarity/', PredictFaceSimilarity.as_view(), name='predict_similarity'),
+    path('identify/', IdentifyFace.as_view(), name='identify'),
+    path('async/predict-similarity/', AsyncPredictFaceSimilarity.as_view(), name='async_predict_similarity'),
+    path('async/identify/', AsyncIdentifyFace.as_view(), name='async_identify'),
 
 
 ]
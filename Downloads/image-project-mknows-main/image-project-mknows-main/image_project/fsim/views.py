@@ -35,7 +35,9 @@ from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import FaceSerializer
+from image_project.libraries import executors, images, timing
+from image_project.views import AsyncAPIView
+from .serializers import FaceSerializer, IdentifyFaceSerializer
 from .function import feature
 
 
@@ -122,10 +124,68 @@ class AnchorFaceUpload(APIView):
         """
         try:
             request.data['is_anchor'] = True
+            request.data['is_enrolled'] = False
             serializer = FaceSerializer(data=request.data)
 
             if serializer.is_valid():
-                serializer.save()
+                with timing.stage('save'):
+                    serializer.save()
+                return Response(build_result(serializer.data), status=status.HTTP_200_OK)
+            else:
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class EnrollFaceUpload(APIView):
+    """
+    API endpoint for enrolling a persistent anchor face.
+
+    This class defines an API endpoint for handling HTTP POST requests to enroll an anchor face.
+    The anchor is saved once together with its precomputed face representation,
+    so later predictions for the same NIK only need the test image.
+
+    Methods:
+        - post(request, format=None): Handles POST requests to the endpoint.
+
+    Example:
+        >>> # Make a POST request to enroll an anchor face
+        >>> response = EnrollFaceUpload().post(request_data)
+
+    Note:
+        - The 'FaceSerializer' is used for validation and saving face data.
+        - The 'feature.enroll_anchor' function is used to compute and store the representation.
+        - Enrolling replaces any previous anchor of the same NIK.
+    """
+
+    def post(self, request, format=None):
+        """
+        Handles HTTP POST requests to enroll an anchor face.
+
+        Parameters:
+            request: The HTTP request object.
+            format: The requested format for the response.
+
+        Returns:
+            Response: The HTTP response indicating the result of the face enrollment.
+
+        Example:
+            >>> response = EnrollFaceUpload().post(request_data)
+
+        Note:
+            - The request data is updated to indicate that it is an enrolled anchor face.
+            - If successful, the response includes a status code,
+            a success message, and the saved data.
+            - If there are validation errors, the response includes a status code and error details.
+        """
+        try:
+            request.data['is_anchor'] = True
+            request.data['is_enrolled'] = True
+            serializer = FaceSerializer(data=request.data)
+
+            if serializer.is_valid():
+                feature.enroll_anchor(serializer)
                 return Response(build_result(serializer.data), status=status.HTTP_200_OK)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -140,7 +200,7 @@ class PredictFaceSimilarity(APIView):
 
     This class defines an API endpoint for handling HTTP POST requests to predict face similarity.
     It updates the request data to indicate that it is not an anchor face, 
-    uses a serializer to validate and save the data,
+    uses a serializer to validate the data without saving the test image,
     and returns a response with the predicted similarity result.
 
     Methods:
@@ -151,7 +211,7 @@ class PredictFaceSimilarity(APIView):
         >>> response = PredictFaceSimilarity().post(request_data)
 
     Note:
-        - The 'FaceSerializer' is used for validation and saving face data.
+        - The 'FaceSerializer' is used for validating face data.
         - The 'feature.predict_similarity' function is used to predict face similarity.
         - If successful, the response includes a status code, 
         a success message, and the predicted similarity result.
@@ -180,10 +240,10 @@ class PredictFaceSimilarity(APIView):
         """
         try:
             request.data['is_anchor'] = False
+            request.data['is_enrolled'] = False
             serializer = FaceSerializer(data=request.data)
 
             if serializer.is_valid():
-                serializer.save()
                 result = feature.predict_similarity(serializer)
                 result_final = {'Similarity': result[0], 'Is Similar?': result[1]}
                 return Response(build_result(result_final), status=status.HTTP_200_OK)
@@ -194,6 +254,137 @@ class PredictFaceSimilarity(APIView):
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
 
+class IdentifyFace(APIView):
+    """
+    API endpoint for 1:N face identification.
+
+    This class defines an API endpoint for handling HTTP POST requests to search a probe face
+    against every enrolled anchor face, for example to detect duplicate identities during onboarding.
+
+    Methods:
+        - post(request, format=None): Handles POST requests to the endpoint.
+
+    Example:
+        >>> # Make a POST request to identify a face
+        >>> response = IdentifyFace().post(request_data)
+
+    Note:
+        - The 'IdentifyFaceSerializer' is used for validating the probe image and 'top_k'.
+        - The probe image is decoded in memory and is not saved.
+        - If successful, the response includes the top-k enrolled NIKs sorted by distance.
+    """
+
+    def post(self, request, format=None):
+        """
+        Handles HTTP POST requests to identify a face.
+
+        Parameters:
+            request: The HTTP request object.
+            format: The requested format for the response.
+
+        Returns:
+            Response: The HTTP response with the closest enrolled NIKs.
+
+        Example:
+            >>> response = IdentifyFace().post(request_data)
+        """
+        try:
+            serializer = IdentifyFaceSerializer(data=request.data)
+
+            if serializer.is_valid():
+                result = identify_upload(serializer.validated_data)
+                return Response(build_result(result), status=status.HTTP_200_OK)
+            else:
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncPredictFaceSimilarity(AsyncAPIView):
+    """
+    Native async variant of the face similarity endpoint.
+
+    The upload is validated on the event loop and the prediction runs in the
+    'fsim' inference executor, so slow clients do not hold a worker thread.
+
+    Methods:
+        - post(request): Handles POST requests to the endpoint.
+
+    Note:
+        - The request and the response are the same as PredictFaceSimilarity.
+    """
+
+    async def post(self, request):
+        """
+        Handles HTTP POST requests to predict face similarity.
+
+        Parameters:
+            request: The HTTP request object.
+
+        Returns:
+            JsonResponse: The HTTP response indicating the predicted face similarity result.
+        """
+        try:
+            data = self.request_data(request)
+            data['is_anchor'] = False
+            data['is_enrolled'] = False
+            serializer = FaceSerializer(data=data)
+            if serializer.is_valid():
+                result = await executors.run('fsim', feature.predict_similarity, serializer)
+                result_final = {'Similarity': result[0], 'Is Similar?': result[1]}
+                return self.respond(build_result(result_final))
+            return self.respond(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.respond(str(e), status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncIdentifyFace(AsyncAPIView):
+    """
+    Native async variant of the 1:N face identification endpoint.
+
+    Methods:
+        - post(request): Handles POST requests to the endpoint.
+
+    Note:
+        - The request and the response are the same as IdentifyFace.
+    """
+
+    async def post(self, request):
+        """
+        Handles HTTP POST requests to identify a face.
+
+        Parameters:
+            request: The HTTP request object.
+
+        Returns:
+            JsonResponse: The HTTP response with the closest enrolled NIKs.
+        """
+        try:
+            serializer = IdentifyFaceSerializer(data=self.request_data(request))
+            if serializer.is_valid():
+                # Decoding is CPU work too, so it runs in the executor with the model
+                result = await executors.run('fsim', identify_upload, serializer.validated_data)
+                return self.respond(build_result(result))
+            return self.respond(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.respond(str(e), status.HTTP_400_BAD_REQUEST)
+
+
+def identify_upload(validated_data):
+    """
+    Decode an uploaded probe face in memory and identify it.
+
+    Parameters:
+        validated_data (dict): The validated data of an IdentifyFaceSerializer.
+
+    Returns:
+        list: The closest enrolled NIKs, see feature.identify_face.
+    """
+    image = images.decode_bgr(images.read_upload(validated_data['img']))
+    return feature.identify_face(image, validated_data['top_k'])
+
+
 def build_result(result):
     """
     Build a standardized result structure for API responses.
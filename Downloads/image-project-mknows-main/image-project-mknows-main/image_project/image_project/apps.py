@@ -0,0 +1,12 @@
+from django.apps import AppConfig
+
+
+class ImageProjectConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'image_project'
+
+    def ready(self):
+        from .libraries import thread_budget
+
+        # Before the engine apps are ready, and so before any model is loaded
+        thread_budget.apply()
@@ -14,3 +14,10 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_project.settings')
 
 application = get_asgi_application()
+
+# Only server processes preload and warm up models; management commands load them
+# lazily. The gunicorn config loads them in each worker after forking instead
+if os.environ.get('SERVER_PREFORK') != '1':
+    from image_project.libraries.warmup import boot
+
+    boot()
@@ -0,0 +1,73 @@
+"""
+Gunicorn config for image_project project.
+
+Production entry point. The master imports Django and the application code, then
+forks the workers, and each worker loads and warms up its own models:
+
+    gunicorn -c image_project/gunicorn.conf.py
+
+TensorFlow and PaddlePaddle start intra-op thread pools and take internal locks
+when a model is loaded, and neither survives a fork: a worker forked from a master
+holding a loaded model can deadlock on its first inference. So no model is loaded
+in the master, at the cost of one copy of the weights per worker. To keep a single
+copy per node, serve the engines from the inference server (INFERENCE_MODE=remote,
+see libraries/inference_service.py) instead.
+
+The engines loaded by each worker are read from PRELOAD_MODELS (see settings.py).
+Engines that are not preloaded are loaded lazily on first use.
+
+Settings can be overridden with the usual environment variables:
+GUNICORN_BIND, GUNICORN_WORKERS, GUNICORN_THREADS, GUNICORN_TIMEOUT.
+"""
+
+import gc
+import json
+import os
+
+wsgi_app = 'image_project.wsgi:application'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('GUNICORN_WORKERS', '4'))
+threads = int(os.environ.get('GUNICORN_THREADS', '4'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '120'))
+
+# The workers share the CPUs of the node (see THREAD_BUDGET in settings.py)
+os.environ.setdefault('THREAD_BUDGET_WORKERS', str(workers))
+
+# Import the application in the master before forking, but leave the models to the
+# workers (see post_worker_init)
+os.environ['SERVER_PREFORK'] = '1'
+preload_app = True
+
+
+def on_starting(server):
+    # Collections in the master would touch object headers and unshare their pages
+    gc.disable()
+
+
+def when_ready(server):
+    from image_project.libraries import thread_budget
+    from image_project.libraries.memory import process_memory
+
+    server.log.info('master memory: %s', json.dumps(process_memory()))
+    server.log.info('thread budget: %s', json.dumps(thread_budget.effective()))
+
+
+def pre_fork(server, worker):
+    # Move every object created while importing the application to the permanent
+    # generation, so the workers' garbage collections never write to their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    gc.enable()
+
+
+def post_worker_init(worker):
+    from image_project.libraries.memory import process_memory
+    from image_project.libraries.warmup import boot
+
+    # Heartbeats between engines, so the master does not kill a worker that is still
+    # loading; with WARMUP_BACKGROUND, the worker serves (not ready) while warming up
+    boot(notify=worker.notify)
+    worker.log.info('worker memory: %s', json.dumps(process_memory()))
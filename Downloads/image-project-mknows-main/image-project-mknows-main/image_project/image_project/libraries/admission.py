@@ -0,0 +1,386 @@
+"""
+Module: admission.py
+
+This module contains the admission control in front of the inference endpoints.
+
+Each engine admits a limited number of concurrent requests, and a bounded number of
+requests wait for a free slot in arrival order. When the wait queue is full, a request
+is shed at once with a Retry-After estimate instead of piling up. A request carrying
+a deadline that passes while it waits is dropped before its inference starts, since
+its client has already given up on it. Once admitted, the deadline of the request is
+checked again before its inference runs, after any wait in a micro-batcher or an
+inference executor (see check_deadline).
+
+Settings (ADMISSION_CONTROL):
+- ENDPOINTS: The engine of each controlled endpoint, keyed by URL name ('app:name').
+- LIMITS: Per engine, MAX_CONCURRENCY (requests running at once) and MAX_QUEUE
+  (requests waiting for a slot).
+- SHED_STATUS: Status code of shed requests, 503 or 429.
+"""
+import asyncio
+import collections
+import contextlib
+import contextvars
+import math
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_LIMITS = {'MAX_CONCURRENCY': 2, 'MAX_QUEUE': 16}
+
+# Deadlines further than this from the arrival of a request are brought back to it,
+# so a huge header value cannot overflow the timeout of a wait
+MAX_DEADLINE_SECONDS = 24 * 3600
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+# The deadline of the admitted request being handled, copied into its executor calls
+_deadline = contextvars.ContextVar('admission_deadline', default=None)
+
+
+class Overloaded(Exception):
+    """
+    Raised when the wait queue of an engine is full.
+
+    Args:
+        retry_after (int): Seconds after which the client may retry.
+    """
+
+    def __init__(self, retry_after):
+        super().__init__(f'Server overloaded, retry after {retry_after} seconds')
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    """
+    Raised when the deadline of a request passes before it is admitted.
+    """
+
+    def __init__(self):
+        super().__init__('Request deadline exceeded before inference started')
+
+
+class Deadline:
+    """
+    The deadline of an admitted request.
+
+    Args:
+        at (float): The Unix time after which the request is dropped, or None.
+
+    Attributes:
+        exceeded (bool): Whether a check found the deadline passed, so the request
+        is answered with 504 whatever its view returned.
+    """
+
+    def __init__(self, at):
+        self.at = at
+        self.exceeded = False
+
+    def passed(self):
+        """
+        Tell whether the deadline has passed, recording it when it has.
+
+        Returns:
+            bool: True once the deadline has passed.
+        """
+        if self.at is not None and time.time() >= self.at:
+            self.exceeded = True
+        return self.exceeded
+
+    def check(self):
+        """
+        Raise when the deadline has passed.
+
+        Raises:
+            DeadlineExceeded: The deadline has passed.
+        """
+        if self.passed():
+            raise DeadlineExceeded()
+
+
+class _Waiter:
+    def __init__(self, notify):
+        self.notify = notify
+        self.granted = False
+        self.enqueued = time.monotonic()
+
+
+class AdmissionController:
+    """
+    A concurrency limit with a bounded FIFO wait queue, shared by sync and async requests.
+
+    A released slot is handed over directly to the oldest waiter, so waiting requests
+    are never overtaken by new ones.
+
+    Args:
+        name (str): The engine name, used for settings and stats.
+        max_concurrency (int): Maximum number of requests running at once.
+        max_queue (int): Maximum number of requests waiting for a slot.
+    """
+
+    def __init__(self, name, max_concurrency=2, max_queue=16):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.active = 0
+        self.admitted = 0
+        self.shed = 0
+        self.expired = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.service_seconds = None
+        self._waiters = collections.deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """
+        Wait for a slot in a sync request.
+
+        Args:
+            deadline (float): The Unix time after which the request is dropped, or None.
+
+        Raises:
+            Overloaded: The wait queue is full.
+            DeadlineExceeded: The deadline passed before a slot was free.
+        """
+        event = threading.Event()
+        waiter = self._enter(deadline, event.set)
+        if waiter is None:
+            return
+        try:
+            event.wait(None if deadline is None else max(deadline - time.time(), 0))
+        finally:
+            self._resolve(waiter)
+
+    async def acquire_async(self, deadline=None):
+        """
+        Wait for a slot in an async request, without blocking the event loop.
+
+        Args:
+            deadline (float): The Unix time after which the request is dropped, or None.
+
+        Raises:
+            Overloaded: The wait queue is full.
+            DeadlineExceeded: The deadline passed before a slot was free.
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._enter(deadline, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is None:
+            return
+        try:
+            await asyncio.wait_for(event.wait(), None if deadline is None else max(deadline - time.time(), 0))
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # The client disconnected: leave the queue, or give back a slot just handed over
+            try:
+                self._resolve(waiter)
+            except DeadlineExceeded:
+                pass
+            else:
+                self.release()
+            raise
+        self._resolve(waiter)
+
+    def release(self, service_seconds=None):
+        """
+        Free the slot of a finished request, handing it over to the oldest waiter.
+
+        Args:
+            service_seconds (float): How long the request held its slot, or None
+            when it did not run.
+        """
+        with self._lock:
+            if service_seconds is not None:
+                # Moving average, used by the Retry-After estimate
+                previous = service_seconds if self.service_seconds is None else self.service_seconds
+                self.service_seconds = 0.8 * previous + 0.2 * service_seconds
+            if self._waiters:
+                waiter = self._waiters.popleft()
+                waiter.granted = True
+                waiter.notify()
+            else:
+                self.active -= 1
+
+    def retry_after(self):
+        """
+        Estimate when a shed request could be admitted.
+
+        Returns:
+            int: Seconds for the queued requests to drain, at least 1.
+        """
+        service_seconds = self.service_seconds or 1.0
+        return max(1, math.ceil(service_seconds * (len(self._waiters) + 1) / self.max_concurrency))
+
+    def stats(self):
+        """
+        Return the load and the admission counters of this engine.
+
+        Returns:
+            dict: The running and waiting requests, admitted, shed and expired
+            requests, and the wait times in milliseconds.
+        """
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'max_queue': self.max_queue,
+                'active': self.active,
+                'queue_depth': len(self._waiters),
+                'admitted': self.admitted,
+                'shed': self.shed,
+                'expired': self.expired,
+                'wait_ms_avg': 1000 * self.wait_seconds_total / self.admitted if self.admitted else 0.0,
+                'wait_ms_max': 1000 * self.wait_seconds_max,
+                'service_ms_avg': 1000 * self.service_seconds if self.service_seconds else None,
+            }
+
+    def _enter(self, deadline, notify):
+        with self._lock:
+            if deadline is not None and deadline <= time.time():
+                self.expired += 1
+                raise DeadlineExceeded()
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+                self.admitted += 1
+                return None
+            if len(self._waiters) >= self.max_queue:
+                self.shed += 1
+                raise Overloaded(self.retry_after())
+            waiter = _Waiter(notify)
+            self._waiters.append(waiter)
+            return waiter
+
+    def _resolve(self, waiter):
+        with self._lock:
+            if waiter.granted:
+                wait_seconds = time.monotonic() - waiter.enqueued
+                self.admitted += 1
+                self.wait_seconds_total += wait_seconds
+                self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+                return
+            self._waiters.remove(waiter)
+            self.expired += 1
+        raise DeadlineExceeded()
+
+
+@contextlib.contextmanager
+def deadline_scope(at):
+    """
+    Make a deadline the deadline of the current request while it runs.
+
+    Args:
+        at (float): The Unix time after which the request is dropped, or None.
+
+    Yields:
+        Deadline: The deadline, whose exceeded flag is read once the view returns.
+    """
+    deadline = Deadline(at)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+
+def current_deadline():
+    """
+    Return the deadline of the current request.
+
+    Returns:
+        Deadline: The deadline, or None outside an admitted request.
+    """
+    return _deadline.get()
+
+
+def check_deadline():
+    """
+    Drop the current request if its deadline passed while it waited for inference.
+
+    Raises:
+        DeadlineExceeded: The deadline of the current request has passed.
+    """
+    deadline = _deadline.get()
+    if deadline is not None:
+        deadline.check()
+
+
+def options():
+    """
+    Return the admission control settings merged with their defaults.
+
+    Returns:
+        dict: The ADMISSION_CONTROL settings.
+    """
+    return {
+        'ENDPOINTS': {},
+        'LIMITS': {},
+        'SHED_STATUS': 503,
+        **getattr(settings, 'ADMISSION_CONTROL', {}),
+    }
+
+
+def get_controller(name):
+    """
+    Return the admission controller of an engine, created from the settings on first use.
+
+    Args:
+        name (str): The engine name.
+
+    Returns:
+        AdmissionController: The controller of this process.
+    """
+    controller = _controllers.get(name)
+    if controller is None:
+        with _controllers_lock:
+            controller = _controllers.get(name)
+            if controller is None:
+                limits = {**DEFAULT_LIMITS, **options()['LIMITS'].get(name, {})}
+                controller = AdmissionController(
+                    name,
+                    max_concurrency=limits['MAX_CONCURRENCY'],
+                    max_queue=limits['MAX_QUEUE'],
+                )
+                _controllers[name] = controller
+    return controller
+
+
+def parse_deadline(headers, received_at):
+    """
+    Read the deadline of a request from its headers.
+
+    'X-Request-Deadline' is an absolute Unix time in seconds. 'X-Request-Timeout' is a
+    number of seconds counted from the arrival of the request, which does not depend
+    on the client clock. The earlier of the two applies. Values that are not finite
+    numbers are ignored, and the deadline is at most MAX_DEADLINE_SECONDS away.
+
+    Args:
+        headers: The request headers.
+        received_at (float): The Unix time the request arrived.
+
+    Returns:
+        float: The deadline as a Unix time, or None when there is none.
+    """
+    deadlines = []
+    for header, offset in (('X-Request-Deadline', 0), ('X-Request-Timeout', received_at)):
+        try:
+            value = float(headers[header])
+        except (KeyError, ValueError):
+            continue
+        if math.isfinite(value):
+            deadlines.append(offset + value)
+    if not deadlines:
+        return None
+    return min(deadlines + [received_at + MAX_DEADLINE_SECONDS])
+
+
+def stats():
+    """
+    Return the admission statistics of every engine.
+
+    Returns:
+        dict: The statistics keyed by engine name.
+    """
+    return {name: controller.stats() for name, controller in sorted(_controllers.items())}
@@ -0,0 +1,189 @@
+"""
+Module: batching.py
+
+This module contains an in-process micro-batching scheduler for the Keras models.
+
+Concurrent requests each submit a batch of one image. The scheduler collects them
+until the maximum batch size is reached or the maximum wait has elapsed, runs one
+forward pass over the stacked inputs and scatters the outputs back to the callers.
+Every request carries the function running the model, and only requests for the
+same function are stacked, so a reloaded model or another backend is used as soon
+as its callers pass it. Requests whose admission deadline passed while they were
+queued are dropped from the batch instead of being run.
+
+Settings (INFERENCE_BATCHING, per model name):
+- ENABLED: Whether requests are batched, otherwise the model is called directly.
+- MAX_BATCH_SIZE: Maximum number of rows per forward pass.
+- MAX_WAIT_MS: Maximum time the first request of a batch waits for others.
+"""
+import collections
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+from django.conf import settings
+
+from image_project.libraries import admission
+
+DEFAULT_OPTIONS = {'ENABLED': True, 'MAX_BATCH_SIZE': 16, 'MAX_WAIT_MS': 5}
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+class MicroBatcher:
+    """
+    Batches concurrent predictions for one model.
+
+    Args:
+        name (str): The model name, used for settings and stats.
+        max_batch_size (int): Maximum number of rows per forward pass.
+        max_wait_ms (float): Maximum wait, in milliseconds, for a batch to fill.
+    """
+
+    def __init__(self, name, max_batch_size=16, max_wait_ms=5):
+        self.name = name
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batch_size_histogram = collections.Counter()
+        self.batches = 0
+        self.items = 0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def predict(self, predict_fn, inputs):
+        """
+        Run the model on the inputs as part of a shared batch.
+
+        Args:
+            predict_fn (callable): Runs the model on a stacked batch and returns an
+            array. Requests are only stacked with requests passing an equal function,
+            so it must be the same object (or bound method) across calls.
+            inputs: An array (or tensor) whose first axis is the batch axis.
+
+        Returns:
+            numpy.ndarray: The model outputs for these inputs only.
+
+        Raises:
+            DeadlineExceeded: The deadline of the request passed while it was queued.
+        """
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((np.asarray(inputs), predict_fn, future, admission.current_deadline()))
+        return future.result()
+
+    def stats(self):
+        """
+        Return the queue depth and the batch size histogram.
+
+        Returns:
+            dict: The batching statistics of this model.
+        """
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': self.batches,
+            'items': self.items,
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'batch_size_histogram': dict(sorted(self.batch_size_histogram.items())),
+        }
+
+    def _ensure_worker(self):
+        # Started lazily, so forked workers each get their own thread
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._run, name=f'batcher-{self.name}', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+
+            while size < self.max_batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request[0])
+
+            # Inputs of different shapes or for different functions cannot be stacked,
+            # so they run as separate passes
+            groups = collections.defaultdict(list)
+            for request in batch:
+                deadline = request[3]
+                if deadline is not None and deadline.passed():
+                    request[2].set_exception(admission.DeadlineExceeded())
+                    continue
+                groups[request[1], request[0].shape[1:]].append(request)
+            for (predict_fn, _), requests in groups.items():
+                self._execute(predict_fn, requests)
+
+    def _execute(self, predict_fn, requests):
+        sizes = [len(request[0]) for request in requests]
+        try:
+            if len(requests) == 1:
+                outputs = predict_fn(requests[0][0])
+            else:
+                outputs = predict_fn(np.concatenate([request[0] for request in requests]))
+            outputs = np.asarray(outputs)
+        except Exception as e:
+            for request in requests:
+                request[2].set_exception(e)
+            return
+
+        self.batches += 1
+        self.items += sum(sizes)
+        self.batch_size_histogram[sum(sizes)] += 1
+        for request, output in zip(requests, np.split(outputs, np.cumsum(sizes)[:-1])):
+            request[2].set_result(output)
+
+
+def predict(name, predict_fn, inputs):
+    """
+    Run a model through its micro-batcher, or directly when batching is disabled.
+
+    Args:
+        name (str): The model name, e.g. 'ssim' or 'sfd'.
+        predict_fn (callable): Runs the model on a stacked batch. Pass the same
+        function (or bound method) on every call, so that requests can share a batch.
+        inputs: An array (or tensor) whose first axis is the batch axis.
+
+    Returns:
+        numpy.ndarray: The model outputs.
+    """
+    options = {**DEFAULT_OPTIONS, **getattr(settings, 'INFERENCE_BATCHING', {}).get(name, {})}
+    if not options['ENABLED']:
+        return np.asarray(predict_fn(inputs))
+
+    batcher = _batchers.get(name)
+    if batcher is None:
+        with _batchers_lock:
+            if name not in _batchers:
+                _batchers[name] = MicroBatcher(
+                    name,
+                    max_batch_size=options['MAX_BATCH_SIZE'],
+                    max_wait_ms=options['MAX_WAIT_MS'],
+                )
+            batcher = _batchers[name]
+    return batcher.predict(predict_fn, inputs)
+
+
+def stats():
+    """
+    Return the batching statistics of every model.
+
+    Returns:
+        dict: The statistics keyed by model name.
+    """
+    return {name: batcher.stats() for name, batcher in _batchers.items()}
@@ -0,0 +1,268 @@
+"""
+Module: benchmark.py
+
+This module contains the synthetic inputs and the measurement loop of ``manage.py bench``.
+
+Inputs are generated locally from a seed, so a run needs no data and two builds are
+measured on exactly the same images. Every iteration gets its own image, so the
+result and embedding caches and the request coalescing do not turn the benchmark
+into a cache benchmark.
+
+Memory is reported per benchmark from the current RSS, sampled while it runs: the
+process peak (ru_maxrss) only grows, so every benchmark after the heaviest one would
+report that peak.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+KTP_LINES = [
+    ('NIK', '{nik}'),
+    ('Nama', 'BUDI SANTOSO'),
+    ('Tempat/Tgl Lahir', 'JAKARTA, 17-08-1990'),
+    ('Alamat', 'JL MERDEKA NO {number}'),
+    ('RT/RW', '001/002'),
+    ('Kel/Desa', 'GAMBIR'),
+    ('Kecamatan', 'GAMBIR'),
+    ('Agama', 'ISLAM'),
+    ('Pekerjaan', 'KARYAWAN SWASTA'),
+]
+
+
+def synthetic_signature(seed, height=300, width=600):
+    """
+    Draw a signature-like image: a few smooth dark strokes on white paper.
+
+    Args:
+        seed (int): The random seed, one image per seed.
+        height (int): The image height.
+        width (int): The image width.
+
+    Returns:
+        numpy.ndarray: The uint8 RGB image.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 255, dtype=np.uint8)
+    for _ in range(rng.integers(2, 5)):
+        x = np.linspace(rng.uniform(0.05, 0.3) * width, rng.uniform(0.7, 0.95) * width, 200)
+        phase, frequency = rng.uniform(0, 2 * np.pi), rng.uniform(2, 8)
+        y = height / 2 + rng.uniform(0.1, 0.3) * height * np.sin(frequency * x / width * np.pi + phase)
+        points = np.stack([x, y], axis=1).astype(np.int32)
+        cv2.polylines(image, [points], False, (20, 20, 60), int(rng.integers(2, 5)), cv2.LINE_AA)
+    return image
+
+
+def synthetic_face(seed, size=480):
+    """
+    Draw a frontal face-like image: a skin-toned oval with eyes, brows, nose and mouth.
+
+    Face detectors are not guaranteed to find it; ``manage.py bench --face-image``
+    uses a real photo instead.
+
+    Args:
+        seed (int): The random seed, one image per seed.
+        size (int): The side of the square image.
+
+    Returns:
+        numpy.ndarray: The uint8 BGR image.
+    """
+    rng = np.random.default_rng(seed)
+    image = np.full((size, size, 3), (200, 210, 220), dtype=np.uint8)
+    center_x, center_y = size // 2 + int(rng.integers(-10, 10)), size // 2 + 10
+    skin = tuple(int(value) for value in rng.integers(0, 60, 3) + (80, 120, 170))
+    shade = tuple(value - 50 for value in skin)
+    cv2.ellipse(image, (center_x, center_y), (110, 145), 0, 0, 360, skin, -1)
+    for offset in (-45, 45):
+        cv2.ellipse(image, (center_x + offset, center_y - 35), (22, 11), 0, 0, 360, (250, 250, 250), -1)
+        cv2.circle(image, (center_x + offset, center_y - 35), 9, (40, 30, 20), -1)
+        brow = ((center_x + offset - 25, center_y - 62), (center_x + offset + 25, center_y - 66))
+        cv2.line(image, *brow, (40, 30, 30), 6)
+    cv2.line(image, (center_x, center_y - 20), (center_x - 8, center_y + 30), shade, 4)
+    cv2.ellipse(image, (center_x, center_y + 70), (40, 14), 0, 0, 180, (60, 60, 150), -1)
+    return cv2.GaussianBlur(image, (5, 5), 0)
+
+
+def synthetic_ktp(seed, height=540, width=856):
+    """
+    Draw a KTP-like card: a light card with labelled fields in dark text.
+
+    Args:
+        seed (int): The random seed, one card (and NIK) per seed.
+        height (int): The card height.
+        width (int): The card width.
+
+    Returns:
+        numpy.ndarray: The uint8 BGR image.
+    """
+    rng = np.random.default_rng(seed)
+    card = np.full((height, width, 3), (235, 215, 190), dtype=np.uint8)
+    cv2.putText(card, 'PROVINSI DKI JAKARTA', (width // 4, 50), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (20, 20, 20), 2)
+    values = {'nik': ''.join(str(digit) for digit in rng.integers(0, 10, 16)), 'number': int(rng.integers(1, 200))}
+    for row, (label, value) in enumerate(KTP_LINES):
+        y = 100 + 45 * row
+        cv2.putText(card, label, (30, y), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (20, 20, 20), 2)
+        cv2.putText(card, ': ' + value.format(**values), (250, y), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (20, 20, 20), 2)
+    cv2.rectangle(card, (width - 220, 90), (width - 40, 330), (180, 180, 180), -1)
+    return card
+
+
+def encode(image, extension='.png'):
+    """
+    Encode a BGR image.
+
+    Args:
+        image (numpy.ndarray): The BGR image.
+        extension (str): The file format, e.g. '.png' or '.jpg'.
+
+    Returns:
+        bytes: The encoded image.
+    """
+    ok, buffer = cv2.imencode(extension, np.ascontiguousarray(image))
+    if not ok:
+        raise ValueError(f'Could not encode the image as {extension}')
+    return buffer.tobytes()
+
+
+# Seconds between two samples of the RSS while a benchmark runs
+RSS_SAMPLE_INTERVAL = 0.01
+
+
+def current_rss_mb():
+    """
+    Return the current resident memory of this process.
+
+    Returns:
+        float: The RSS in MiB, or None when /proc is not available.
+    """
+    try:
+        with open('/proc/self/statm') as statm_file:
+            pages = int(statm_file.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+
+
+class RssSampler:
+    """
+    Samples the current RSS in a background thread, to find the peak of one benchmark.
+
+    Attributes:
+        before (float): The RSS when sampling started, in MiB.
+        peak (float): The highest RSS sampled, in MiB.
+    """
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.before = None
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.before = self.peak = current_rss_mb()
+        if self.before is not None:
+            self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._sample()
+
+    def report(self):
+        """
+        Return the RSS of the sampled benchmark.
+
+        Returns:
+            dict: The RSS before the benchmark, its peak while it ran, and the
+            difference, in MiB (None when /proc is not available).
+        """
+        return {
+            'rss_before_mb': self.before,
+            'rss_peak_mb': self.peak,
+            'rss_delta_mb': self.peak - self.before if self.before is not None else None,
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        rss = current_rss_mb()
+        if rss is not None:
+            self.peak = max(self.peak, rss)
+
+
+def measure(call, iterations, concurrency=1, warmup=0):
+    """
+    Run a call repeatedly from concurrent threads and summarize its latencies.
+
+    Args:
+        call (callable): Takes the iteration index; raising counts as an error.
+        iterations (int): The number of timed calls.
+        concurrency (int): The number of threads calling at once.
+        warmup (int): The number of untimed calls made first, with indexes after
+        the timed ones.
+
+    Returns:
+        dict: The latency percentiles and mean in milliseconds, the throughput in
+        calls per second, the error count and first error, and the RSS before and at
+        the peak of this benchmark, warmup included (see RssSampler).
+    """
+    with RssSampler() as rss:
+        result = _measure(call, iterations, concurrency, warmup)
+    result.update(rss.report())
+    return result
+
+
+def _measure(call, iterations, concurrency, warmup):
+    for index in range(warmup):
+        try:
+            call(iterations + index)
+        except Exception:
+            pass
+
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def timed(index):
+        start = time.perf_counter()
+        try:
+            call(index)
+        except Exception as e:
+            with lock:
+                errors.append(f'{type(e).__name__}: {e}')
+            return
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(iterations)))
+    wall = time.perf_counter() - start
+
+    latencies_ms = 1000 * np.asarray(latencies)
+    result = {
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'errors': len(errors),
+        'throughput_per_s': len(latencies) / wall if wall else 0.0,
+    }
+    if len(latencies_ms):
+        result.update({
+            'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p95_ms': float(np.percentile(latencies_ms, 95)),
+            'p99_ms': float(np.percentile(latencies_ms, 99)),
+            'mean_ms': float(latencies_ms.mean()),
+        })
+    if errors:
+        result['first_error'] = errors[0]
+    return result
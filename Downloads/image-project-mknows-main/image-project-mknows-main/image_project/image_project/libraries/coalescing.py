@@ -0,0 +1,350 @@
+"""
+Module: coalescing.py
+
+This module contains the coalescing of identical in-flight inference requests.
+
+Client retries and double submits often send the same image to the same endpoint
+while the first request is still running. The first request with a given key (the
+endpoint, a hash of the uploaded content and the parameters) runs the inference;
+the duplicates arriving before it finishes wait for it and share its result, or
+its exception, instead of running their own.
+
+Within a worker, duplicates wait on the thread running the inference. With a
+DIRECTORY, the workers of a host also coalesce with each other: the running request
+holds an exclusive lock on a file named after the key, and writes its result next
+to it as JSON before releasing the lock. Results that are not JSON-serializable, and
+errors other than the built-in exceptions, are not shared across workers: the
+duplicates run the inference themselves. The duplicates read a result as soon as
+its lock is released, so the lock, result and temporary files are swept from the
+directory once they are RESULT_LIFETIME seconds old.
+
+Settings (REQUEST_COALESCING, per engine name):
+- ENABLED: Whether identical requests are coalesced.
+- DIRECTORY: Directory of the lock and result files shared by the workers of the
+  host, or None to coalesce within each worker only.
+- TIMEOUT: Seconds a duplicate waits for the running request before running the
+  inference itself.
+"""
+import builtins
+import contextlib
+import copy
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from image_project.libraries import images
+
+DEFAULT_OPTIONS = {'ENABLED': True, 'DIRECTORY': None, 'TIMEOUT': 60}
+
+# Files older than this are removed; results are only read by waiting duplicates,
+# right after the lock is released
+RESULT_LIFETIME = 60
+# Seconds between two sweeps of the directory by a worker
+CLEANUP_INTERVAL = 30
+POLL_INTERVAL = 0.01
+
+_coalescers = {}
+_coalescers_lock = threading.Lock()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    """
+    Runs one inference per key at a time and shares its outcome with the duplicates.
+
+    Args:
+        name (str): The engine name, used for settings and stats.
+        directory (str): Directory shared by the workers of the host, or None.
+        timeout (float): Seconds a duplicate waits before running the inference itself.
+        enabled (bool): Whether requests are coalesced at all.
+    """
+
+    def __init__(self, name, directory=None, timeout=60, enabled=True):
+        self.name = name
+        self.directory = directory
+        self.timeout = timeout
+        self.enabled = enabled
+        self.leaders = 0
+        self.coalesced = 0
+        self.shared_coalesced = 0
+        self.timeouts = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+        # The first leader sweeps the files left by a previous run
+        self._cleaned_at = None
+
+    def run(self, key, compute):
+        """
+        Run compute, unless an identical request is already running it.
+
+        Args:
+            key (str): The request key, see key().
+            compute (callable): Runs the inference.
+
+        Returns:
+            The result of compute, possibly computed by another request. Duplicates
+            get a copy, so the requests never share mutable results. A result read
+            from another worker is decoded from JSON, so tuples come back as lists.
+        """
+        if not self.enabled:
+            return compute()
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if not flight.done.wait(self.timeout):
+                with self._lock:
+                    self.timeouts += 1
+                return compute()
+            with self._lock:
+                self.coalesced += 1
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+
+        try:
+            flight.result = self._run_shared(key, compute)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def stats(self):
+        """
+        Return the coalescing counters of this engine.
+
+        Returns:
+            dict: The requests that ran the inference, the duplicates served by a
+            request of this worker or of another one, and the duplicates that gave up waiting.
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'shared_coalesced': self.shared_coalesced,
+                'timeouts': self.timeouts,
+                'shared': self.directory is not None,
+            }
+
+    def _run_shared(self, key, compute):
+        if self.directory is None:
+            self._count_leader()
+            return compute()
+
+        os.makedirs(self.directory, exist_ok=True)
+        arrived = time.time()
+        lock_path = os.path.join(self.directory, f'{key}.lock')
+        result_path = os.path.join(self.directory, f'{key}.json')
+        with open(lock_path, 'a') as lock_file:
+            if not self._lock_file(lock_file):
+                # Another worker is running it: its result is written before the lock is released
+                outcome = self._read_result(result_path, arrived) if self._wait_lock(lock_file) else None
+                if outcome is not None:
+                    with self._lock:
+                        self.shared_coalesced += 1
+                    error, result = outcome
+                    if error is not None:
+                        raise error
+                    return result
+                if not self._lock_file(lock_file):
+                    with self._lock:
+                        self.timeouts += 1
+                    return compute()
+
+            try:
+                self._count_leader()
+                try:
+                    result = compute()
+                except Exception as e:
+                    self._write_result(result_path, {'error': [type(e).__name__, str(e)]})
+                    raise
+                self._write_result(result_path, {'result': result})
+                return result
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _count_leader(self):
+        with self._lock:
+            self.leaders += 1
+            now = time.monotonic()
+            cleanup = self.directory is not None and (
+                self._cleaned_at is None or now - self._cleaned_at >= CLEANUP_INTERVAL)
+            if cleanup:
+                self._cleaned_at = now
+        if cleanup:
+            self._cleanup()
+
+    def _lock_file(self, lock_file):
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        return True
+
+    def _wait_lock(self, lock_file):
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return True
+        return False
+
+    def _read_result(self, result_path, arrived):
+        try:
+            # Only a result written after this request arrived belongs to its flight
+            if os.path.getmtime(result_path) < arrived:
+                return None
+            with open(result_path, encoding='utf-8') as file:
+                outcome = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if 'error' not in outcome:
+            return None, outcome['result']
+        name, message = outcome['error']
+        error_class = getattr(builtins, name, None)
+        if not (isinstance(error_class, type) and issubclass(error_class, Exception)):
+            return None
+        return error_class(message), None
+
+    def _write_result(self, result_path, outcome):
+        temporary_path = None
+        try:
+            # Written to a temporary file then renamed, so readers never see a partial result
+            descriptor, temporary_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+                json.dump(outcome, file, default=_to_json)
+            os.replace(temporary_path, result_path)
+        except Exception:
+            # Results that cannot be encoded or written are not shared: the duplicates run
+            # the inference themselves
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary_path)
+
+    def _cleanup(self):
+        expired = time.time() - RESULT_LIFETIME
+        for entry in os.scandir(self.directory):
+            try:
+                if not entry.name.endswith(('.json', '.tmp', '.lock')) or entry.stat().st_mtime >= expired:
+                    continue
+                if entry.name.endswith('.lock'):
+                    self._unlink_lock(entry.path)
+                else:
+                    os.unlink(entry.path)
+            except OSError:
+                continue
+
+    def _unlink_lock(self, lock_path):
+        # A lock file is never written to, so it can be old and still held by a running
+        # request. One opened but not locked yet when it is unlinked only lets that
+        # request run the inference alongside a new leader
+        with open(lock_path, 'a') as lock_file:
+            if self._lock_file(lock_file):
+                os.unlink(lock_path)
+
+
+def _to_json(value):
+    # NumPy scores, e.g. the similarity of sfd, are encoded as Python numbers
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def key(endpoint, *parts):
+    """
+    Build the coalescing key of a request.
+
+    Args:
+        endpoint (str): The endpoint or operation, e.g. 'fsim:verify'.
+        *parts: The uploads (files, paths or bytes) and the parameters the result
+        depends on. Uploads are hashed by content, without being decoded.
+
+    Returns:
+        str: The hexadecimal key.
+    """
+    digest = hashlib.sha256(endpoint.encode())
+    for part in parts:
+        digest.update(b'\0')
+        if isinstance(part, (bytes, bytearray, memoryview)) or hasattr(part, 'chunks'):
+            images.hash_upload(digest, part)
+        else:
+            digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+
+def get_coalescer(name):
+    """
+    Return the coalescer of an engine, created from the REQUEST_COALESCING settings on first use.
+
+    Args:
+        name (str): The engine name, e.g. 'fsim' or 'ocr'.
+
+    Returns:
+        Coalescer: The coalescer of this process.
+    """
+    coalescer = _coalescers.get(name)
+    if coalescer is None:
+        with _coalescers_lock:
+            coalescer = _coalescers.get(name)
+            if coalescer is None:
+                options = {**DEFAULT_OPTIONS, **getattr(settings, 'REQUEST_COALESCING', {}).get(name, {})}
+                coalescer = Coalescer(
+                    name,
+                    directory=options['DIRECTORY'],
+                    timeout=options['TIMEOUT'],
+                    enabled=options['ENABLED'],
+                )
+                _coalescers[name] = coalescer
+    return coalescer
+
+
+def run(name, key, compute):
+    """
+    Run an inference of an engine, coalesced with the identical requests in flight.
+
+    Args:
+        name (str): The engine name.
+        key (str): The request key, see key().
+        compute (callable): Runs the inference.
+
+    Returns:
+        The result of the inference.
+    """
+    return get_coalescer(name).run(key, compute)
+
+
+def stats():
+    """
+    Return the coalescing statistics of every engine.
+
+    Returns:
+        dict: The statistics keyed by engine name.
+    """
+    return {name: coalescer.stats() for name, coalescer in sorted(_coalescers.items())}
@@ -0,0 +1,292 @@
+"""
+Module: embedding_cache.py
+
+This module contains a content-hash cache for the embeddings of probe images.
+
+The same signature is often verified several times: client retries, one document
+checked against several NIKs, QA replays. Embeddings are keyed by a hash of the
+uploaded bytes and the model version, so a hit is served before the image is even
+decoded, and skips preprocessing and inference entirely. Each worker keeps an LRU
+bounded in bytes; an optional shared directory (e.g. on /dev/shm) lets every worker
+of a node reuse the embeddings computed by the others. Writes to the shared directory
+are best-effort: a full or unwritable directory is counted in the stats, and the
+request that computed the embedding still succeeds.
+
+Settings (EMBEDDING_CACHE, per cache name):
+- ENABLED: Whether embeddings are cached, otherwise every lookup misses.
+- MAX_BYTES: Maximum size of the embeddings kept in the memory of each worker.
+- SHARED_DIRECTORY: Directory shared by the workers, or None to keep embeddings in
+  memory only.
+- SHARED_MAX_BYTES: Maximum size of the shared directory, oldest entries going first.
+"""
+import collections
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from image_project.libraries import images
+
+DEFAULT_OPTIONS = {
+    'ENABLED': True,
+    'MAX_BYTES': 64 * 2 ** 20,
+    'SHARED_DIRECTORY': None,
+    'SHARED_MAX_BYTES': 256 * 2 ** 20,
+}
+
+# The shared directory is trimmed every that many writes, not on each one
+TRIM_INTERVAL = 64
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class EmbeddingCache:
+    """
+    An LRU cache of embeddings bounded in bytes, with an optional shared directory.
+
+    Args:
+        name (str): The cache name, used for settings and stats.
+        max_bytes (int): Maximum size of the embeddings kept in memory.
+        shared_directory (str): Directory shared by the workers of the node, or None.
+        shared_max_bytes (int): Maximum size of the shared directory.
+        enabled (bool): Whether embeddings are cached at all.
+    """
+
+    def __init__(self, name, max_bytes=64 * 2 ** 20, shared_directory=None, shared_max_bytes=256 * 2 ** 20,
+                 enabled=True):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.shared_directory = shared_directory
+        self.shared_max_bytes = shared_max_bytes
+        self.enabled = enabled
+        self.bytes = 0
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.write_errors = 0
+        self._entries = collections.OrderedDict()
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def key(self, upload, *parts):
+        """
+        Build the cache key of an uploaded image from its bytes, without decoding it.
+
+        Args:
+            upload: An uploaded file, a path, or the image bytes.
+            *parts: The model version and anything else the embedding depends on.
+
+        Returns:
+            str: The hexadecimal key.
+        """
+        digest = hashlib.sha256()
+        images.hash_upload(digest, upload)
+        for part in parts:
+            digest.update(b'\0' + repr(part).encode())
+        return digest.hexdigest()
+
+    def get_or_compute(self, key, compute):
+        """
+        Return the cached embedding of a key, computing and storing it on a miss.
+
+        Args:
+            key (str): The cache key, see key().
+            compute (callable): Decodes the image and computes its embedding.
+
+        Returns:
+            numpy.ndarray: The embedding.
+        """
+        embedding = self.get(key)
+        if embedding is None:
+            embedding = compute()
+            self.set(key, embedding)
+        return embedding
+
+    def get(self, key):
+        """
+        Look a key up in memory, then in the shared directory.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            numpy.ndarray: The embedding, or None when it is not cached.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        embedding = self._read(key)
+        with self._lock:
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.shared_hits += 1
+            self._remember(key, embedding)
+        return embedding
+
+    def set(self, key, embedding):
+        """
+        Store the embedding of a key in memory and in the shared directory.
+
+        Args:
+            key (str): The cache key.
+            embedding (numpy.ndarray): The embedding.
+        """
+        if not self.enabled:
+            return
+        embedding = np.array(embedding)
+        # Cached arrays are shared by every request hitting them
+        embedding.flags.writeable = False
+        with self._lock:
+            self._remember(key, embedding)
+        self._write(key, embedding)
+
+    def stats(self):
+        """
+        Return the size and the hit and miss counters of this cache.
+
+        Returns:
+            dict: The cache statistics, shared hits being counted apart from memory hits.
+        """
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'write_errors': self.write_errors,
+                'hit_rate': (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                'shared': self.shared_directory is not None,
+            }
+
+    def _remember(self, key, embedding):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= previous.nbytes
+        if embedding.nbytes > self.max_bytes:
+            return
+        self._entries[key] = embedding
+        self.bytes += embedding.nbytes
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _path(self, key):
+        return os.path.join(self.shared_directory, f'{key}.npy')
+
+    def _read(self, key):
+        if self.shared_directory is None:
+            return None
+        path = self._path(key)
+        try:
+            embedding = np.load(path, allow_pickle=False)
+            # Refresh the mtime, which orders the entries when the directory is trimmed
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        embedding.flags.writeable = False
+        return embedding
+
+    def _write(self, key, embedding):
+        if self.shared_directory is None:
+            return
+        temporary_path = None
+        try:
+            os.makedirs(self.shared_directory, exist_ok=True)
+            # Written to a temporary file then renamed, so readers never see a partial entry
+            descriptor, temporary_path = tempfile.mkstemp(dir=self.shared_directory, suffix='.tmp')
+            with os.fdopen(descriptor, 'wb') as file:
+                np.save(file, embedding, allow_pickle=False)
+            os.replace(temporary_path, self._path(key))
+        except BaseException as e:
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary_path)
+            if not isinstance(e, OSError):
+                raise
+            # The embedding is already cached in memory, only the other workers miss it
+            with self._lock:
+                self.write_errors += 1
+            return
+
+        with self._lock:
+            self._writes += 1
+            trim = self._writes % TRIM_INTERVAL == 0
+        if trim:
+            self._trim()
+
+    def _trim(self):
+        entries = []
+        for entry in os.scandir(self.shared_directory):
+            if not entry.name.endswith('.npy'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        # Least recently used first; other workers may be trimming at the same time
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.shared_max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+
+def get_cache(name):
+    """
+    Return the embedding cache of a name, created from the EMBEDDING_CACHE settings on first use.
+
+    Args:
+        name (str): The cache name, e.g. 'ssim' or 'sfd'.
+
+    Returns:
+        EmbeddingCache: The cache of this process.
+    """
+    cache = _caches.get(name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                options = {**DEFAULT_OPTIONS, **getattr(settings, 'EMBEDDING_CACHE', {}).get(name, {})}
+                cache = EmbeddingCache(
+                    name,
+                    max_bytes=options['MAX_BYTES'],
+                    shared_directory=options['SHARED_DIRECTORY'],
+                    shared_max_bytes=options['SHARED_MAX_BYTES'],
+                    enabled=options['ENABLED'],
+                )
+                _caches[name] = cache
+    return cache
+
+
+def stats():
+    """
+    Return the statistics of every embedding cache used by this process.
+
+    Returns:
+        dict: The statistics keyed by cache name.
+    """
+    return {name: cache.stats() for name, cache in sorted(_caches.items())}
@@ -0,0 +1,141 @@
+"""
+Module: executors.py
+
+This module contains the bounded inference executors used by the async views.
+
+Each engine gets its own thread pool, so the event loop only parses uploads and
+waits, and a burst on one engine (e.g. OCR) queues behind its own workers without
+taking the threads another engine (e.g. signature verification) needs.
+
+Settings (INFERENCE_EXECUTORS, per engine name):
+- MAX_WORKERS: Maximum number of concurrent inference calls of the engine.
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from image_project.libraries import admission
+
+DEFAULT_OPTIONS = {'MAX_WORKERS': 2}
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class InferenceExecutor:
+    """
+    A fixed-size thread pool running the inference calls of one engine.
+
+    Args:
+        name (str): The engine name, used for settings and stats.
+        max_workers (int): Maximum number of concurrent calls.
+    """
+
+    def __init__(self, name, max_workers=2):
+        self.name = name
+        self.max_workers = max_workers
+        self.pending = 0
+        self.completed = 0
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'inference-{name}')
+        self._lock = threading.Lock()
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run a blocking call in the pool and wait for it without blocking the event loop.
+
+        Args:
+            fn (callable): The blocking call, e.g. a feature function.
+            *args: The positional arguments of the call.
+            **kwargs: The keyword arguments of the call.
+
+        Returns:
+            The result of the call.
+        """
+        with self._lock:
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # The call runs in the context of the request, e.g. to record its Server-Timing stages
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._pool, functools.partial(context.run, _call, fn, *args, **kwargs))
+        finally:
+            with self._lock:
+                self.pending -= 1
+                self.completed += 1
+
+    def stats(self):
+        """
+        Return the size and load of the pool.
+
+        Returns:
+            dict: The pool size, the calls running or waiting, and the completed calls.
+        """
+        return {
+            'max_workers': self.max_workers,
+            'pending': self.pending,
+            'completed': self.completed,
+        }
+
+
+def _call(fn, *args, **kwargs):
+    # A request whose deadline passed while it waited for a pool thread is dropped
+    admission.check_deadline()
+    # Feature functions read anchors from the database: keep the connection of
+    # this pool thread healthy, as Django does around each sync request
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def get_executor(name):
+    """
+    Return the executor of an engine, created from the INFERENCE_EXECUTORS settings on first use.
+
+    Args:
+        name (str): The engine name, e.g. 'fsim' or 'ocr'.
+
+    Returns:
+        InferenceExecutor: The executor of this process.
+    """
+    executor = _executors.get(name)
+    if executor is None:
+        with _executors_lock:
+            executor = _executors.get(name)
+            if executor is None:
+                options = {**DEFAULT_OPTIONS, **getattr(settings, 'INFERENCE_EXECUTORS', {}).get(name, {})}
+                executor = InferenceExecutor(name, max_workers=options['MAX_WORKERS'])
+                _executors[name] = executor
+    return executor
+
+
+async def run(name, fn, *args, **kwargs):
+    """
+    Run a blocking inference call in the executor of an engine.
+
+    Args:
+        name (str): The engine name.
+        fn (callable): The blocking call.
+        *args: The positional arguments of the call.
+        **kwargs: The keyword arguments of the call.
+
+    Returns:
+        The result of the call.
+    """
+    return await get_executor(name).run(fn, *args, **kwargs)
+
+
+def stats():
+    """
+    Return the statistics of every executor.
+
+    Returns:
+        dict: The statistics keyed by engine name.
+    """
+    return {name: executor.stats() for name, executor in sorted(_executors.items())}
@@ -0,0 +1,67 @@
+"""
+Module: images.py
+
+This module contains helpers for decoding uploaded images in memory.
+
+Uploads are decoded straight from the request bytes into NumPy arrays, so images
+that are only used for one inference never touch the media volume.
+"""
+import os
+
+import cv2
+import numpy as np
+
+from image_project.libraries import timing
+
+
+def read_upload(uploaded_file):
+    """
+    Read the bytes of an uploaded file.
+
+    Args:
+        uploaded_file: The Django UploadedFile.
+
+    Returns:
+        bytes: The file content.
+    """
+    uploaded_file.seek(0)
+    return uploaded_file.read()
+
+
+def hash_upload(digest, upload):
+    """
+    Feed the content of an upload to a hash, without decoding it.
+
+    Args:
+        digest: The hashlib object, e.g. hashlib.sha256().
+        upload: An uploaded file, a path, or the encoded bytes. An uploaded file
+        is rewound, so that it can be decoded afterwards.
+    """
+    if isinstance(upload, (bytes, bytearray, memoryview)):
+        digest.update(upload)
+    elif isinstance(upload, (str, os.PathLike)):
+        with open(upload, 'rb') as file:
+            for chunk in iter(lambda: file.read(2 ** 20), b''):
+                digest.update(chunk)
+    else:
+        upload.seek(0)
+        for chunk in upload.chunks():
+            digest.update(chunk)
+        upload.seek(0)
+
+
+def decode_bgr(data):
+    """
+    Decode image bytes into a BGR array, the same way cv2.imread decodes a file.
+
+    Args:
+        data (bytes): The encoded image.
+
+    Returns:
+        numpy.ndarray: The uint8 BGR image of shape (height, width, 3).
+    """
+    with timing.stage('decode'):
+        image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError('Uploaded file is not a valid image')
+    return image
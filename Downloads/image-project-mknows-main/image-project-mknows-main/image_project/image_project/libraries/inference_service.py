@@ -0,0 +1,231 @@
+"""
+Module: inference_service.py
+
+This module contains an optional out-of-process inference service.
+
+In 'remote' mode the model calls of the configured engines are sent to a local
+inference server (``manage.py inference_server``) over a Unix socket, so web workers
+never load TensorFlow, Paddle or DeepFace and slow inference does not block them.
+NumPy arrays are handed over through ``multiprocessing.shared_memory``: only their
+name, shape and dtype travel over the socket, never the pixel data.
+
+Call sites stay the same in both modes. Each engine exposes a small set of functions
+taking and returning arrays (REMOTE_FUNCTIONS); they check ``is_remote(engine)`` and
+forward themselves with ``call`` when it is True.
+
+Settings (INFERENCE_SERVICE):
+- MODE: 'local' (default) or 'remote'.
+- SOCKET: Path of the Unix socket of the inference server.
+- ENGINES: Engines served remotely in 'remote' mode.
+"""
+import pickle
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+from django.conf import settings
+
+from image_project.libraries import timing
+
+REMOTE_FUNCTIONS = {
+    'ssim': ('embed_images', 'predict_embeddings', 'embedding_dim'),
+    'sfd': ('get_image_embeddings',),
+    'fsim': ('represent_face', 'represent_aligned_face'),
+    'ocr': ('run_ocr', 'run_ocr_batch', 'classify_orientation'),
+}
+
+# Set by the inference server, which always runs the engines in-process
+serving = False
+
+_local = threading.local()
+
+
+class InferenceServiceError(Exception):
+    """
+    Raised when the inference server cannot be reached or a remote call fails.
+    """
+
+
+def options():
+    """
+    Return the inference service settings merged with their defaults.
+
+    Returns:
+        dict: The MODE, SOCKET and ENGINES settings.
+    """
+    return {
+        'MODE': 'local',
+        'SOCKET': '/tmp/image_project_inference.sock',
+        'ENGINES': list(REMOTE_FUNCTIONS),
+        **getattr(settings, 'INFERENCE_SERVICE', {}),
+    }
+
+
+def is_remote(engine):
+    """
+    Tell whether the calls of an engine go to the inference server.
+
+    Args:
+        engine (str): The engine name.
+
+    Returns:
+        bool: True in 'remote' mode for a configured engine, outside the server itself.
+    """
+    service_options = options()
+    return (not serving and service_options['MODE'] == 'remote' and
+            engine in service_options['ENGINES'])
+
+
+def authkey():
+    return settings.SECRET_KEY.encode()
+
+
+def call(engine, function, *args):
+    """
+    Call an engine function on the inference server.
+
+    Args:
+        engine (str): The engine name.
+        function (str): The function name, one of REMOTE_FUNCTIONS[engine].
+        *args: The arguments; arrays and lists of arrays go through shared memory.
+
+    Returns:
+        The function result.
+    """
+    # Timed as one stage in the web process: the model runs in the server
+    with timing.stage('remote', model=engine):
+        return _call(engine, function, *args)
+
+
+def _call(engine, function, *args):
+    segments = []
+    try:
+        message = (engine, function, [_share(arg, segments) for arg in args])
+        connection = _connection()
+        try:
+            connection.send(message)
+            status, result = connection.recv()
+        except (OSError, EOFError):
+            # The server restarted since the last call; reconnect once
+            _local.connection = None
+            connection = _connection()
+            connection.send(message)
+            status, result = connection.recv()
+    finally:
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+
+    if status == 'error':
+        raise InferenceServiceError(result)
+    return result
+
+
+class RemoteEngine:
+    """
+    Proxy forwarding method calls of an engine object to the inference server.
+
+    Args:
+        engine (str): The engine name.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def __getattr__(self, function):
+        if function not in REMOTE_FUNCTIONS.get(self.engine, ()):
+            raise AttributeError(function)
+        return lambda *args: call(self.engine, function, *args)
+
+
+def serve(socket_path, targets):
+    """
+    Serve engine calls on a Unix socket until interrupted.
+
+    Every client connection is handled by its own thread, so concurrent requests
+    from the web workers still meet in the micro-batchers.
+
+    Args:
+        socket_path (str): The path of the Unix socket.
+        targets (dict): The callable returning the object of each engine.
+    """
+    global serving
+    serving = True
+
+    with Listener(socket_path, family='AF_UNIX', authkey=authkey()) as listener:
+        while True:
+            connection = listener.accept()
+            threading.Thread(target=_handle, args=(connection, targets), daemon=True).start()
+
+
+def _connection():
+    if getattr(_local, 'connection', None) is None:
+        try:
+            _local.connection = Client(options()['SOCKET'], family='AF_UNIX', authkey=authkey())
+        except OSError as e:
+            raise InferenceServiceError(f'Inference server unavailable: {e}') from e
+    return _local.connection
+
+
+def _handle(connection, targets):
+    with connection:
+        while True:
+            try:
+                engine, function, args = connection.recv()
+            except (OSError, EOFError):
+                return
+
+            segments = []
+            try:
+                if function not in REMOTE_FUNCTIONS.get(engine, ()):
+                    raise InferenceServiceError(f'{engine}.{function} cannot be called remotely')
+                args = [_attach(arg, segments) for arg in args]
+                result = getattr(targets[engine](), function)(*args)
+                # Serialize before closing the segments, in case the result is a view of them
+                payload = pickle.dumps(('ok', result))
+            except Exception as e:
+                payload = pickle.dumps(('error', f'{type(e).__name__}: {e}'))
+            finally:
+                args = result = None
+                for segment in segments:
+                    try:
+                        segment.close()
+                    except BufferError:
+                        # Still referenced; released when the array is garbage collected
+                        pass
+            connection.send_bytes(payload)
+
+
+def _share(arg, segments):
+    if isinstance(arg, (list, tuple)):
+        return type(arg)(_share(item, segments) for item in arg)
+    if not isinstance(arg, np.ndarray):
+        return arg
+
+    segment = shared_memory.SharedMemory(create=True, size=max(arg.nbytes, 1))
+    segments.append(segment)
+    np.ndarray(arg.shape, dtype=arg.dtype, buffer=segment.buf)[...] = arg
+    return _SharedArray(segment.name, arg.shape, arg.dtype.str)
+
+
+def _attach(arg, segments):
+    if isinstance(arg, (list, tuple)):
+        return type(arg)(_attach(item, segments) for item in arg)
+    if not isinstance(arg, _SharedArray):
+        return arg
+
+    segment = shared_memory.SharedMemory(name=arg.name)
+    # The client owns the segment and unlinks it; stop the tracker from unlinking it too
+    resource_tracker.unregister(segment._name, 'shared_memory')
+    segments.append(segment)
+    return np.ndarray(arg.shape, dtype=np.dtype(arg.dtype), buffer=segment.buf)
+
+
+class _SharedArray:
+    """Descriptor of an array placed in shared memory."""
+
+    def __init__(self, name, shape, dtype):
+        self.name = name
+        self.shape = shape
+        self.dtype = dtype
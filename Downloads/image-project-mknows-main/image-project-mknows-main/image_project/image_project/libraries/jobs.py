@@ -0,0 +1,320 @@
+"""
+Module: jobs.py
+
+This module contains the asynchronous job mode of the inference endpoints.
+
+A client opts in per request with the 'async' query parameter or a
+'Prefer: respond-async' header. The request is then stored as a Job row in the
+database and answered at once with 202 and the job id. A local pool of job workers
+(``manage.py job_worker``) claims queued jobs, replays the stored request against
+the same view, and stores its response. Clients poll ``/jobs/<id>/`` for the result,
+and can be notified with a callback. No broker is needed beyond the existing database.
+
+Settings (ASYNC_JOBS):
+- ENDPOINTS: URL names ('app:name') of the endpoints accepting async requests.
+- MAX_BODY_SIZE: Largest request body accepted for a job, in bytes.
+- CALLBACK_URL: URL notified with the job status and result when a job ends, or None.
+- CALLBACK_ALLOWED_PREFIXES: Prefixes a per-request 'callback_url' must start with.
+- CALLBACK_TIMEOUT: Timeout of a callback, in seconds.
+- POLL_INTERVAL: Seconds an idle worker waits before looking for jobs again.
+- JOB_TIMEOUT: Seconds after which a running job is considered lost and requeued.
+- MAX_ATTEMPTS: Number of times a job is started before it is marked as failed.
+- RETENTION: Seconds a finished job and its response are kept before they are deleted.
+
+A job requeued after JOB_TIMEOUT may still be running in its first worker. Each claim
+starts a new attempt, and a worker only stores the outcome of the attempt it claimed,
+so the result of a lost attempt never overwrites the result of the next one.
+"""
+import io
+import json
+import logging
+import os
+import socket
+import urllib.request
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.urls import resolve
+from django.utils import timezone
+
+from image_project.models import Job
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OPTIONS = {
+    'ENDPOINTS': [],
+    'MAX_BODY_SIZE': 20 * 1024 * 1024,
+    'CALLBACK_URL': None,
+    'CALLBACK_ALLOWED_PREFIXES': [],
+    'CALLBACK_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.5,
+    'JOB_TIMEOUT': 600,
+    'MAX_ATTEMPTS': 3,
+    'RETENTION': 24 * 3600,
+}
+
+
+def options():
+    """
+    Return the async job settings merged with their defaults.
+
+    Returns:
+        dict: The ASYNC_JOBS settings.
+    """
+    return {**DEFAULT_OPTIONS, **getattr(settings, 'ASYNC_JOBS', {})}
+
+
+def submit(endpoint, path, host, content_type, body, callback_url='', query_string=''):
+    """
+    Queue a request for a job worker.
+
+    Args:
+        endpoint (str): The URL name of the endpoint.
+        path (str): The request path, resolved again by the worker.
+        host (str): The Host header, used to build absolute URLs in the response.
+        content_type (str): The request content type, with its multipart boundary.
+        body (bytes): The raw request body.
+        callback_url (str): URL notified when the job ends, empty for the default.
+        query_string (str): The query string of the request.
+
+    Returns:
+        Job: The queued job.
+    """
+    return Job.objects.create(
+        endpoint=endpoint,
+        path=path,
+        query_string=query_string,
+        host=host,
+        content_type=content_type,
+        body=body,
+        callback_url=callback_url or options()['CALLBACK_URL'] or '',
+    )
+
+
+def callback_allowed(url):
+    """
+    Tell whether a per-request callback URL may be called.
+
+    Args:
+        url (str): The callback URL given by the client.
+
+    Returns:
+        bool: True when it starts with one of CALLBACK_ALLOWED_PREFIXES.
+    """
+    return any(url.startswith(prefix) for prefix in options()['CALLBACK_ALLOWED_PREFIXES'])
+
+
+def claim(worker):
+    """
+    Claim the oldest queued job.
+
+    The claim is a conditional update on the status and the attempt, so two workers
+    never claim the same attempt whatever the database backend.
+
+    Args:
+        worker (str): The name of the claiming worker.
+
+    Returns:
+        Job: The claimed job, its attempts being the attempt of this worker, or None
+        when the queue is empty.
+    """
+    while True:
+        job = Job.objects.filter(status=Job.QUEUED).order_by('created_at').first()
+        if job is None:
+            return None
+        started_at = timezone.now()
+        claimed = Job.objects.filter(id=job.id, status=Job.QUEUED, attempts=job.attempts).update(
+            status=Job.RUNNING, worker=worker, started_at=started_at, attempts=job.attempts + 1)
+        if claimed:
+            job.status, job.worker, job.started_at = Job.RUNNING, worker, started_at
+            job.attempts += 1
+            return job
+
+
+def run(job):
+    """
+    Replay the request of a job against its view and store the response.
+
+    Args:
+        job (Job): The claimed job.
+    """
+    try:
+        response_status, response = replay(job)
+    except Exception as e:
+        logger.exception('Job %s failed', job.id)
+        finish(job, Job.FAILED, error=str(e))
+    else:
+        finish(job, Job.DONE, response_status=response_status, response=response)
+
+
+def replay(job):
+    """
+    Call the view of a job with its stored request, outside the middleware stack.
+
+    Args:
+        job (Job): The job.
+
+    Returns:
+        tuple: The response status code and the response body.
+    """
+    body = bytes(job.body)
+    request = WSGIRequest({
+        'REQUEST_METHOD': 'POST',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': job.path,
+        'QUERY_STRING': job.query_string,
+        'CONTENT_TYPE': job.content_type,
+        'CONTENT_LENGTH': str(len(body)),
+        'HTTP_HOST': job.host or 'localhost',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '80',
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.url_scheme': 'http',
+    })
+    match = resolve(job.path)
+    response = match.func(request, *match.args, **match.kwargs)
+    if hasattr(response, 'render'):
+        response.render()
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    return response.status_code, content.decode()
+
+
+def finish(job, status, response_status=None, response='', error=''):
+    """
+    Store the outcome of a job, drop its request body and send its callback.
+
+    The outcome is only stored while the job is still at the attempt of the caller,
+    so a worker whose job was requeued and claimed again does not overwrite it.
+
+    Args:
+        job (Job): The job, as claimed by the caller.
+        status (str): Job.DONE or Job.FAILED.
+        response_status (int): The status code returned by the view.
+        response (str): The response body returned by the view.
+        error (str): The error that stopped the job.
+
+    Returns:
+        bool: Whether the outcome was stored.
+    """
+    finished_at = timezone.now()
+    stored = Job.objects.filter(
+        id=job.id, attempts=job.attempts, status__in=[Job.QUEUED, Job.RUNNING],
+    ).update(status=status, response_status=response_status, response=response, error=error,
+             body=b'', finished_at=finished_at)
+    if not stored:
+        logger.warning('Dropped the outcome of attempt %s of job %s, which was claimed again',
+                       job.attempts, job.id)
+        return False
+
+    job.status = status
+    job.response_status = response_status
+    job.response = response
+    job.error = error
+    job.body = b''
+    job.finished_at = finished_at
+    if job.callback_url:
+        send_callback(job)
+    return True
+
+
+def send_callback(job):
+    """
+    POST the job status and result to the callback URL of a job.
+
+    Failures are logged and never retried: the result stays available for polling.
+
+    Args:
+        job (Job): The finished job.
+    """
+    request = urllib.request.Request(
+        job.callback_url,
+        data=json.dumps(describe(job)).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST',
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=options()['CALLBACK_TIMEOUT']):
+            pass
+    except OSError as e:
+        logger.warning('Callback of job %s to %s failed: %s', job.id, job.callback_url, e)
+
+
+def requeue_stale():
+    """
+    Requeue the jobs whose worker died, or fail them after MAX_ATTEMPTS.
+
+    Returns:
+        int: The number of jobs requeued or failed.
+    """
+    job_options = options()
+    deadline = timezone.now() - timedelta(seconds=job_options['JOB_TIMEOUT'])
+    stale = Job.objects.filter(status=Job.RUNNING, started_at__lt=deadline)
+    failed = stale.filter(attempts__gte=job_options['MAX_ATTEMPTS'])
+    count = 0
+    for job in failed:
+        count += finish(job, Job.FAILED, error='The job did not finish in time')
+    count += stale.filter(attempts__lt=job_options['MAX_ATTEMPTS']).update(
+        status=Job.QUEUED, worker='', started_at=None)
+    return count
+
+
+def purge_finished():
+    """
+    Delete the jobs that finished more than RETENTION seconds ago, with their response.
+
+    Responses hold the results of the endpoints, such as the fields of a KTP, so they
+    are not kept once clients had time to poll them.
+
+    Returns:
+        int: The number of deleted jobs.
+    """
+    deadline = timezone.now() - timedelta(seconds=options()['RETENTION'])
+    deleted, _ = Job.objects.filter(status__in=[Job.DONE, Job.FAILED], finished_at__lt=deadline).delete()
+    return deleted
+
+
+def describe(job):
+    """
+    Describe a job for the status endpoint and the callbacks.
+
+    Args:
+        job (Job): The job.
+
+    Returns:
+        dict: The job status, timestamps and, once done, the response of the endpoint.
+    """
+    result = None
+    if job.status == Job.DONE:
+        try:
+            result = json.loads(job.response)
+        except ValueError:
+            result = job.response
+    return {
+        'id': str(job.id),
+        'endpoint': job.endpoint,
+        'status': job.status,
+        'attempts': job.attempts,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'response_status': job.response_status,
+        'result': result,
+        'error': job.error or None,
+    }
+
+
+def worker_name(index):
+    """
+    Return the name of a job worker, unique across hosts.
+
+    Args:
+        index (int): The index of the worker in its pool.
+
+    Returns:
+        str: The host name, pid and index.
+    """
+    return f'{socket.gethostname()}:{os.getpid()}:{index}'
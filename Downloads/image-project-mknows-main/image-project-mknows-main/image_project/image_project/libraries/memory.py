@@ -0,0 +1,94 @@
+"""
+Module: memory.py
+
+This module contains helpers for reporting the memory use of server processes.
+
+Values come from /proc/<pid>/smaps_rollup (Linux). PSS (proportional set size)
+splits shared pages between the processes mapping them, so comparing the RSS and
+PSS of pre-forked workers shows how much memory is shared copy-on-write, and how
+much each worker's own copy of the models costs.
+
+Usage:
+    python -m image_project.libraries.memory <master pid>
+"""
+import json
+import os
+import sys
+
+SMAPS_FIELDS = {
+    'Rss': 'rss_kb',
+    'Pss': 'pss_kb',
+    'Shared_Clean': 'shared_clean_kb',
+    'Shared_Dirty': 'shared_dirty_kb',
+    'Private_Clean': 'private_clean_kb',
+    'Private_Dirty': 'private_dirty_kb',
+}
+
+
+def process_memory(pid='self'):
+    """
+    Read the memory use of a process.
+
+    Args:
+        pid: The process id, or 'self' for the current process.
+
+    Returns:
+        dict: The pid and the RSS, PSS, shared and private sizes in kB,
+        or only the pid when /proc is not available.
+    """
+    report = {'pid': os.getpid() if pid == 'self' else int(pid)}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as smaps_file:
+            for line in smaps_file:
+                field, _, value = line.partition(':')
+                if field in SMAPS_FIELDS:
+                    report[SMAPS_FIELDS[field]] = int(value.split()[0])
+    except OSError:
+        pass
+    return report
+
+
+def child_pids(pid):
+    """
+    List the direct children of a process.
+
+    Args:
+        pid: The parent process id.
+
+    Returns:
+        list: The child process ids.
+    """
+    children = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as children_file:
+                children.extend(int(child) for child in children_file.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def worker_memory_report(master_pid):
+    """
+    Report the memory of a pre-fork master and of each of its workers.
+
+    Args:
+        master_pid: The master process id.
+
+    Returns:
+        dict: The master and worker reports, plus the summed RSS and PSS of all of them.
+        The summed PSS is the real footprint; the gap to the summed RSS is the shared memory.
+    """
+    master = process_memory(master_pid)
+    workers = [process_memory(pid) for pid in child_pids(master_pid)]
+    processes = [master] + workers
+    return {
+        'master': master,
+        'workers': workers,
+        'total_rss_kb': sum(process.get('rss_kb', 0) for process in processes),
+        'total_pss_kb': sum(process.get('pss_kb', 0) for process in processes),
+    }
+
+
+if __name__ == '__main__':
+    print(json.dumps(worker_memory_report(sys.argv[1]), indent=2))
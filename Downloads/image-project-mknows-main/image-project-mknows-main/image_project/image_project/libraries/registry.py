@@ -0,0 +1,94 @@
+"""
+Module: registry.py
+
+This module contains the model registry shared by the inference apps.
+
+Each app registers a loader for its engine in AppConfig.ready(). Nothing is loaded
+at import time: a model is loaded on first use, or at server start when its name is
+listed in the PRELOAD_MODELS setting. Management commands never preload, so they
+only pay for the models they actually call.
+"""
+import threading
+import time
+
+
+class ModelRegistry:
+    """
+    Registry of lazily loaded models, keyed by engine name.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._load_seconds = {}
+        self._locks = {}
+
+    def register(self, name, loader):
+        """
+        Register the loader of an engine.
+
+        Args:
+            name (str): The engine name, e.g. 'ssim' or 'ocr'.
+            loader (callable): Loads and returns the model, called at most once.
+        """
+        self._loaders[name] = loader
+        self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        """
+        Return the model of an engine, loading it on first use.
+
+        Args:
+            name (str): The engine name.
+
+        Returns:
+            The loaded model.
+        """
+        if name in self._models:
+            return self._models[name]
+        if name not in self._loaders:
+            raise KeyError(f'No model registered under {name!r}')
+
+        with self._locks[name]:
+            if name not in self._models:
+                start = time.perf_counter()
+                self._models[name] = self._loaders[name]()
+                self._load_seconds[name] = time.perf_counter() - start
+        return self._models[name]
+
+    def preload(self, names):
+        """
+        Load the models of the given engines.
+
+        Args:
+            names (list): The engine names to load.
+        """
+        for name in names:
+            self.get(name)
+
+    def is_loaded(self, name):
+        """
+        Tell whether the model of an engine is loaded.
+
+        Args:
+            name (str): The engine name.
+
+        Returns:
+            bool: True if the model is loaded.
+        """
+        return name in self._models
+
+    def stats(self):
+        """
+        Return the load state and load time of every registered engine.
+
+        Returns:
+            dict: The state keyed by engine name.
+        """
+        return {
+            name: {'loaded': name in self._models, 'load_seconds': self._load_seconds.get(name)}
+            for name in self._loaders
+        }
+
+
+registry = ModelRegistry()
@@ -0,0 +1,312 @@
+"""
+Module: result_cache.py
+
+This module contains a content-addressed cache for inference results.
+
+Results are keyed by a hash of the decoded pixels together with everything else that
+determines the output (model version, profile, options), so a resubmitted image is
+served without running the model again. Each cache has a bounded in-memory LRU tier
+and an opt-in on-disk tier that is shared by the workers and survives restarts. Results
+may hold personal data (e.g. the fields of a KTP), so entries expire after TTL seconds
+in both tiers, and the disk tier stores JSON, never pickles, since its files can be
+written by any process with access to the directory. Writes to the disk tier are
+best-effort: a full or unwritable directory is counted in the stats, and the request
+that computed the result still succeeds.
+
+Settings (RESULT_CACHE, per cache name):
+- ENABLED: Whether results are cached, otherwise every lookup misses.
+- MAX_ENTRIES: Maximum number of results kept in memory.
+- DIRECTORY: Directory of the on-disk tier, or None to keep results in memory only.
+- TTL: Seconds a result is served for, or None to keep it until it is evicted.
+
+Keys hash the exact pixels: KTP cards share one template, so a perceptual hash that
+lets re-encoded uploads hit would also let different cards collide.
+"""
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+DEFAULT_OPTIONS = {'ENABLED': True, 'MAX_ENTRIES': 1024, 'DIRECTORY': None, 'TTL': 3600}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of results with an optional on-disk tier.
+
+    Args:
+        name (str): The cache name, used for settings and stats.
+        max_entries (int): Maximum number of results kept in memory.
+        directory (str): Directory of the on-disk tier, or None.
+        ttl (float): Seconds a result is served for, or None for no expiry.
+        enabled (bool): Whether results are cached at all.
+    """
+
+    def __init__(self, name, max_entries=1024, directory=None, ttl=3600, enabled=True):
+        self.name = name
+        self.max_entries = max_entries
+        self.directory = directory
+        self.ttl = ttl
+        self.enabled = enabled
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.write_errors = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._purged_at = time.monotonic()
+
+    def key(self, image, *parts):
+        """
+        Build the cache key of an image and the parameters its result depends on.
+
+        Args:
+            image (numpy.ndarray): The decoded image.
+            *parts: The model version, profile and any option that changes the result.
+
+        Returns:
+            str: The hexadecimal key.
+        """
+        digest = hashlib.sha256()
+        image = np.ascontiguousarray(image)
+        digest.update(f'{image.dtype}{image.shape}'.encode())
+        digest.update(image.data)
+        for part in parts:
+            digest.update(b'\0' + repr(part).encode())
+        return digest.hexdigest()
+
+    def get_or_compute(self, key, compute, bypass=False):
+        """
+        Return the cached result of a key, computing and storing it on a miss.
+
+        Args:
+            key (str): The cache key, see key().
+            compute (callable): Computes the result when it is not cached.
+            bypass (bool): Whether to skip the lookup and recompute. The fresh
+            result still replaces the cached one.
+
+        Returns:
+            The result.
+        """
+        found, value = self.lookup(key, bypass)
+        if found:
+            return value
+
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def lookup(self, key, bypass=False):
+        """
+        Look a key up unless the cache is disabled or bypassed.
+
+        Args:
+            key (str): The cache key.
+            bypass (bool): Whether the caller asked to recompute the result.
+
+        Returns:
+            tuple: (found, value), see get().
+        """
+        if not self.enabled:
+            return False, None
+        if bypass:
+            with self._lock:
+                self.bypasses += 1
+            return False, None
+        return self.get(key)
+
+    def get(self, key):
+        """
+        Look a key up in memory, then on disk.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            tuple: (found, value), value being None when the key is not cached.
+        """
+        with self._lock:
+            if key in self._entries:
+                stored_at, value = self._entries[key]
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+
+        entry = self._read(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return False, None
+            self.disk_hits += 1
+            # Keeps the time it was written at, so it expires in memory when it does on disk
+            self._remember(key, entry[1], stored_at=entry[0])
+        return True, entry[1]
+
+    def set(self, key, value):
+        """
+        Store the result of a key in memory and on disk.
+
+        Args:
+            key (str): The cache key.
+            value: The result, which must be JSON-serializable when the disk tier is used.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._remember(key, value)
+        self._write(key, value)
+        self._purge_if_due()
+
+    def purge(self):
+        """
+        Delete the expired entries of the on-disk tier.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        if self.directory is None or self.ttl is None:
+            return 0
+        deleted = 0
+        for root, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    if self._expired(os.stat(path).st_mtime):
+                        os.unlink(path)
+                        deleted += 1
+                except OSError:
+                    # Deleted by another worker in the meantime
+                    continue
+        return deleted
+
+    def stats(self):
+        """
+        Return the hit and miss counters of this cache.
+
+        Returns:
+            dict: The cache statistics, disk hits being counted apart from memory hits.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'write_errors': self.write_errors,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'disk': self.directory is not None,
+                'ttl': self.ttl,
+            }
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and time.time() - stored_at > self.ttl
+
+    def _remember(self, key, value, stored_at=None):
+        self._entries[key] = (time.time() if stored_at is None else stored_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.json')
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        path = self._path(key)
+        try:
+            # The file is renamed into place once written, so its mtime is the write time
+            stored_at = os.stat(path).st_mtime
+            if self._expired(stored_at):
+                os.unlink(path)
+                return None
+            with open(path, encoding='utf-8') as file:
+                return stored_at, json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key, value):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        temporary_path = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Written to a temporary file then renamed, so readers never see a partial entry
+            descriptor, temporary_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(descriptor, 'w', encoding='utf-8') as file:
+                json.dump(value, file)
+            os.replace(temporary_path, path)
+        except BaseException as e:
+            if temporary_path is not None:
+                with contextlib.suppress(OSError):
+                    os.unlink(temporary_path)
+            if not isinstance(e, OSError):
+                raise
+            # The result is already cached in memory, only the other workers miss it
+            with self._lock:
+                self.write_errors += 1
+
+    def _purge_if_due(self):
+        # Expired entries that are never looked up again are deleted by a periodic sweep
+        if self.directory is None or self.ttl is None:
+            return
+        with self._lock:
+            if time.monotonic() - self._purged_at < self.ttl / 4:
+                return
+            self._purged_at = time.monotonic()
+        self.purge()
+
+
+def get_cache(name):
+    """
+    Return the cache of a name, created from the RESULT_CACHE settings on first use.
+
+    Args:
+        name (str): The cache name.
+
+    Returns:
+        ResultCache: The cache of this process.
+    """
+    cache = _caches.get(name)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(name)
+            if cache is None:
+                options = {**DEFAULT_OPTIONS, **getattr(settings, 'RESULT_CACHE', {}).get(name, {})}
+                cache = ResultCache(
+                    name,
+                    max_entries=options['MAX_ENTRIES'],
+                    directory=options['DIRECTORY'],
+                    ttl=options['TTL'],
+                    enabled=options['ENABLED'],
+                )
+                _caches[name] = cache
+    return cache
+
+
+def stats():
+    """
+    Return the statistics of every cache used by this process.
+
+    Returns:
+        dict: The statistics keyed by cache name.
+    """
+    return {name: cache.stats() for name, cache in sorted(_caches.items())}
@@ -0,0 +1,198 @@
+"""
+Module: thread_budget.py
+
+This module contains the CPU thread budget of the inference libraries.
+
+A worker hosts TensorFlow (fsim, ssim, sfd), PaddlePaddle (ocr), OpenCV and the BLAS
+behind NumPy and scikit-learn, and each of them sizes its thread pools to every core
+of the node by default. With several workers per node, that oversubscribes the CPUs
+many times over. The budget gives each worker its share of the CPUs and assigns the
+intra-op and inter-op threads of every library from it. It is applied when Django
+starts, before any model is loaded, and the effective values are logged and reported
+by /health/.
+
+The engines sharing a library share its threads: TensorFlow has one set of thread
+pools per process, used by the fsim, ssim and sfd models alike.
+
+Settings (THREAD_BUDGET):
+- CPUS: CPUs of the node given to the workers, None for the CPUs this process may run on.
+- WORKERS: Number of worker processes on the node, sharing the CPUs.
+- LIBRARIES: Per library ('tensorflow', 'paddle', 'opencv', 'blas'), INTRA_OP and
+  INTER_OP thread counts. None uses the default: the worker's share of the CPUs for the
+  intra-op threads of TensorFlow and Paddle, and a single thread otherwise.
+"""
+import logging
+import os
+import sys
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+LIBRARIES = ('tensorflow', 'paddle', 'opencv', 'blas')
+
+# Library running the models of each engine
+ENGINE_LIBRARIES = {'fsim': 'tensorflow', 'ssim': 'tensorflow', 'sfd': 'tensorflow', 'ocr': 'paddle'}
+
+# Environment variables read by the libraries when they start their thread pools
+TENSORFLOW_VARIABLES = {'intra_op': 'TF_NUM_INTRAOP_THREADS', 'inter_op': 'TF_NUM_INTEROP_THREADS'}
+BLAS_VARIABLES = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+_applied = None
+
+
+def options():
+    """
+    Return the thread budget settings merged with their defaults.
+
+    Returns:
+        dict: The THREAD_BUDGET settings.
+    """
+    return {'CPUS': None, 'WORKERS': 1, 'LIBRARIES': {}, **getattr(settings, 'THREAD_BUDGET', {})}
+
+
+def available_cpus():
+    """
+    Return the number of CPUs this process may run on.
+
+    Returns:
+        int: The CPUs of the affinity mask (e.g. a cpuset), or of the node.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def budget():
+    """
+    Compute the threads of every library for one worker.
+
+    Returns:
+        dict: The CPUs, workers and per-worker share, and the intra-op and inter-op
+        threads of each library.
+    """
+    budget_options = options()
+    cpus = int(budget_options['CPUS'] or available_cpus())
+    workers = max(1, int(budget_options['WORKERS']))
+    share = max(1, cpus // workers)
+    defaults = {
+        'tensorflow': {'intra_op': share, 'inter_op': min(2, share)},
+        'paddle': {'intra_op': share, 'inter_op': 1},
+        'opencv': {'intra_op': 1, 'inter_op': 1},
+        'blas': {'intra_op': 1, 'inter_op': 1},
+    }
+
+    result = {'cpus': cpus, 'workers': workers, 'share': share}
+    for library in LIBRARIES:
+        configured = budget_options['LIBRARIES'].get(library, {})
+        result[library] = {
+            'intra_op': _threads(configured.get('INTRA_OP'), defaults[library]['intra_op']),
+            'inter_op': _threads(configured.get('INTER_OP'), defaults[library]['inter_op']),
+            'configured': configured.get('INTRA_OP') is not None,
+        }
+    return result
+
+
+def _threads(value, default):
+    return default if value in (None, '') else max(1, int(value))
+
+
+def apply():
+    """
+    Apply the budget to the libraries of this process, and log it.
+
+    TensorFlow reads its thread counts when its runtime starts, so this must run before
+    the first model is loaded; OpenCV and the BLAS are limited at once.
+
+    Returns:
+        dict: The effective thread counts, see effective().
+    """
+    global _applied
+    threads = budget()
+
+    for key, variable in TENSORFLOW_VARIABLES.items():
+        os.environ[variable] = str(threads['tensorflow'][key])
+    if 'tensorflow' in sys.modules:
+        _configure_tensorflow(threads['tensorflow'])
+
+    # Libraries loaded later read the variables; NumPy's BLAS is already loaded
+    for variable in BLAS_VARIABLES:
+        os.environ[variable] = str(threads['blas']['intra_op'])
+    try:
+        from threadpoolctl import threadpool_limits
+
+        threadpool_limits(limits=threads['blas']['intra_op'], user_api='blas')
+    except ImportError:
+        pass
+
+    import cv2
+
+    cv2.setNumThreads(threads['opencv']['intra_op'])
+
+    _applied = threads
+    report = effective()
+    logger.info('Thread budget: %s', report)
+    return report
+
+
+def _configure_tensorflow(threads):
+    import tensorflow as tf
+
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(threads['intra_op'])
+        tf.config.threading.set_inter_op_parallelism_threads(threads['inter_op'])
+    except RuntimeError:
+        # The runtime already started: its pools keep their size
+        logger.warning('TensorFlow was initialized before the thread budget was applied')
+
+
+def paddle_threads(requested):
+    """
+    Return the CPU threads of a PaddleOCR predictor.
+
+    Args:
+        requested (int): The CPU_THREADS of the OCR profile.
+
+    Returns:
+        int: The configured Paddle threads, or the profile value capped by the
+        worker's share of the CPUs.
+    """
+    threads = budget()['paddle']
+    if threads['configured']:
+        return threads['intra_op']
+    return min(requested, threads['intra_op'])
+
+
+def effective():
+    """
+    Report the thread counts in effect in this process.
+
+    Returns:
+        dict: The budget, and the threads actually used by each library that is loaded.
+    """
+    report = {'budget': _applied or budget()}
+
+    report['tensorflow'] = {key: int(os.environ[variable]) for key, variable in TENSORFLOW_VARIABLES.items()
+                            if os.environ.get(variable)}
+    if 'tensorflow' in sys.modules:
+        import tensorflow as tf
+
+        report['tensorflow'] = {
+            'intra_op': tf.config.threading.get_intra_op_parallelism_threads(),
+            'inter_op': tf.config.threading.get_inter_op_parallelism_threads(),
+        }
+
+    if 'cv2' in sys.modules:
+        report['opencv'] = {'intra_op': sys.modules['cv2'].getNumThreads()}
+
+    try:
+        from threadpoolctl import threadpool_info
+
+        report['blas'] = [
+            {'library': pool['internal_api'], 'intra_op': pool['num_threads']}
+            for pool in threadpool_info() if pool['user_api'] == 'blas'
+        ]
+    except ImportError:
+        pass
+    return report
@@ -0,0 +1,232 @@
+"""
+Module: timing.py
+
+This module contains the per-stage latency instrumentation of the endpoints.
+
+Code on the request path wraps its stages (multipart parsing, admission queue,
+database lookups, file writes, decoding, preprocessing, inference, deletions) in
+``stage(name)``. The durations are collected for the current request, returned in
+its ``Server-Timing`` header, and aggregated per endpoint and stage into histograms
+exposed in the Prometheus text format by ``/metrics``. Stages given a ``model`` also
+count the inference calls and errors of that model, also outside of requests.
+
+A stage costs two perf_counter() calls and a context variable lookup, and the
+histograms are only updated once per request, so the instrumentation can stay on.
+Metrics are kept per process, like the other statistics endpoints.
+
+Settings (SERVER_TIMING):
+- ENABLED: Whether stages are timed and reported.
+- HEADER: Whether the stage durations are sent in the Server-Timing header.
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+def options():
+    """
+    Return the Server-Timing settings merged with their defaults.
+
+    Returns:
+        dict: The SERVER_TIMING settings.
+    """
+    return {'ENABLED': True, 'HEADER': True, **getattr(settings, 'SERVER_TIMING', {})}
+
+
+class RequestTimings:
+    """
+    The stage durations of one request, in the order the stages first ran.
+
+    A stage running several times (e.g. decoding two images) is reported once with
+    its total duration.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, seconds):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def header(self, total):
+        """
+        Build the Server-Timing header value.
+
+        Args:
+            total (float): The duration of the whole request in seconds.
+
+        Returns:
+            str: The stages and the total, in milliseconds.
+        """
+        metrics = [f'{name};dur={1000 * seconds:.1f}' for name, seconds in self.stages.items()]
+        metrics.append(f'total;dur={1000 * total:.1f}')
+        return ', '.join(metrics)
+
+
+class stage:
+    """
+    Context manager timing a stage of the current request.
+
+    Args:
+        name (str): The stage name, e.g. 'decode' or 'inference'.
+        model (str): The model run by the stage, counted in the inference metrics.
+    """
+
+    __slots__ = ('name', 'model', 'start')
+
+    def __init__(self, name, model=None):
+        self.name = name
+        self.model = model
+        self.start = None
+
+    def __enter__(self):
+        if self.model is not None or _current.get() is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.start is None:
+            return
+        seconds = time.perf_counter() - self.start
+        timings = _current.get()
+        if timings is not None:
+            timings.add(self.name, seconds)
+        if self.model is not None and options()['ENABLED']:
+            INFERENCE_SECONDS.observe((self.model,), seconds)
+            INFERENCE_TOTAL.inc((self.model,))
+            if exc_type is not None:
+                INFERENCE_ERRORS.inc((self.model,))
+
+
+def start_request():
+    """
+    Start collecting the stages of a request in the current context.
+
+    Returns:
+        tuple: The context token for end_request(), and the RequestTimings.
+    """
+    timings = RequestTimings()
+    return _current.set(timings), timings
+
+
+def end_request(token, endpoint, timings, total):
+    """
+    Stop collecting the stages of a request and record its durations.
+
+    Args:
+        token: The token returned by start_request().
+        endpoint (str): The URL name of the endpoint.
+        timings (RequestTimings): The stages of the request.
+        total (float): The duration of the whole request in seconds.
+    """
+    _current.reset(token)
+    REQUEST_SECONDS.observe((endpoint,), total)
+    for name, seconds in timings.stages.items():
+        STAGE_SECONDS.observe((endpoint, name), seconds)
+
+
+class Counter:
+    """
+    A Prometheus counter with labels.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labels (tuple): The label names.
+    """
+
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    A Prometheus histogram with labels and fixed buckets.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labels (tuple): The label names.
+        buckets (tuple): The upper bounds of the buckets, in seconds.
+    """
+
+    def __init__(self, name, documentation, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for label_values, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    labels = _labels(self.labels + ('le',), label_values + (str(bound),))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _labels(self.labels, label_values)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def _labels(names, values):
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}' if pairs else ''
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('image_project_request_seconds', 'Duration of the requests.', ('endpoint',))
+STAGE_SECONDS = Histogram('image_project_stage_seconds', 'Duration of the stages of the requests.',
+                          ('endpoint', 'stage'))
+INFERENCE_SECONDS = Histogram('image_project_inference_seconds', 'Duration of the inference calls.', ('model',))
+INFERENCE_TOTAL = Counter('image_project_inference_total', 'Inference calls.', ('model',))
+INFERENCE_ERRORS = Counter('image_project_inference_errors_total', 'Inference calls that raised.', ('model',))
+
+METRICS = [REQUEST_SECONDS, STAGE_SECONDS, INFERENCE_SECONDS, INFERENCE_TOTAL, INFERENCE_ERRORS]
+
+
+def render():
+    """
+    Render the metrics of this process in the Prometheus text format.
+
+    Returns:
+        str: The exposition text.
+    """
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
@@ -0,0 +1,164 @@
+"""
+Module: warmup.py
+
+This module contains the startup warmup of the inference engines.
+
+Loading a model is not enough for the first request to be fast: TensorFlow traces
+and allocates on the first call, DeepFace builds its detector, and PaddleOCR creates
+its predictors on the first ``ocr()`` call. Each app registers a warmup function
+that runs its engine on synthetic inputs of production shapes. The server entry
+points run them at boot, and ``/ready`` only reports ready once they are done.
+
+The state is per process: under gunicorn every worker warms up its own models after
+forking, and reports its own readiness. A child forked while a warmup thread was
+running starts over as pending, since the thread and its lock do not follow it.
+
+Settings (WARMUP):
+- ENABLED: Whether the entry points warm the preloaded engines up.
+- BACKGROUND: Whether warmup runs in a background thread, so the server starts
+  answering (and reporting not ready) at once.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+class Warmup:
+    """
+    Registry of the warmup functions and state of the warmup of this process.
+    """
+
+    def __init__(self):
+        self._functions = {}
+        self.state = PENDING
+        self.engines = {}
+        self.seconds = None
+        self._lock = threading.Lock()
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        # The lock may have been held by a thread that does not exist in the child
+        self._lock = threading.Lock()
+        if self.state == RUNNING:
+            self.state = PENDING
+            self.engines = {}
+            self.seconds = None
+
+    def register(self, name, function):
+        """
+        Register the warmup function of an engine.
+
+        Args:
+            name (str): The engine name, e.g. 'ssim' or 'ocr'.
+            function (callable): Runs the engine on synthetic inputs.
+        """
+        self._functions[name] = function
+
+    def run(self, names, notify=None):
+        """
+        Warm the given engines up, one after the other.
+
+        A failing engine is logged and recorded, and the process does not become ready.
+
+        Args:
+            names (list): The engine names.
+            notify (callable): Called after each engine, e.g. a worker heartbeat.
+        """
+        with self._lock:
+            self.state = RUNNING
+            start = time.perf_counter()
+            failed = False
+            for name in names:
+                if name not in self._functions:
+                    continue
+                engine_start = time.perf_counter()
+                try:
+                    self._functions[name]()
+                except Exception as e:
+                    logger.exception('Warmup of %s failed', name)
+                    self.engines[name] = {'state': FAILED, 'error': str(e)}
+                    failed = True
+                else:
+                    self.engines[name] = {'state': DONE, 'seconds': time.perf_counter() - engine_start}
+                if notify is not None:
+                    notify()
+            self.seconds = time.perf_counter() - start
+            self.state = FAILED if failed else DONE
+
+    def start(self, names, notify=None):
+        """
+        Run the warmup of the entry points, according to the WARMUP settings.
+
+        Args:
+            names (list): The engine names, usually the preloaded ones.
+            notify (callable): Called after each engine warmed up in the foreground.
+        """
+        options = {'ENABLED': True, 'BACKGROUND': False, **getattr(settings, 'WARMUP', {})}
+        if not options['ENABLED']:
+            self.state = SKIPPED
+            return
+        if options['BACKGROUND']:
+            threading.Thread(target=self.run, args=(list(names),), name='warmup', daemon=True).start()
+        else:
+            self.run(names, notify)
+
+    def is_ready(self):
+        """
+        Tell whether the process can take traffic.
+
+        Returns:
+            bool: True once warmup is done, or when it is disabled.
+        """
+        return self.state in (DONE, SKIPPED)
+
+    def stats(self):
+        """
+        Return the warmup state and the warmup time of every engine.
+
+        Returns:
+            dict: The overall state and duration, and the state per engine.
+        """
+        return {
+            'pid': os.getpid(),
+            'state': self.state,
+            'seconds': self.seconds,
+            'engines': dict(self.engines),
+        }
+
+
+warmup = Warmup()
+
+
+def boot(notify=None):
+    """
+    Preload and warm up the engines of PRELOAD_MODELS served by this process.
+
+    Engines served by the inference server are never loaded here. TensorFlow and
+    Paddle start thread pools that do not survive a fork, so a pre-fork server must
+    call this in every worker after forking, never in its master.
+
+    Args:
+        notify (callable): Called after each engine is loaded and warmed up, so a
+        worker can keep sending heartbeats to its master while it boots.
+    """
+    from image_project.libraries import inference_service
+    from image_project.libraries.registry import registry
+
+    local_models = [name for name in settings.PRELOAD_MODELS if not inference_service.is_remote(name)]
+    for name in local_models:
+        registry.preload([name])
+        if notify is not None:
+            notify()
+    warmup.start(local_models, notify)
@@ -0,0 +1,335 @@
+"""
+Management command benchmarking the hot functions and the HTTP endpoints.
+
+Signatures, faces and KTP cards are generated from a seed (see libraries/benchmark.py),
+and anchors and references are enrolled in a throwaway test database and media
+directory, so a run needs no data and leaves nothing behind. The HTTP benchmarks go
+through the whole Django stack (middleware, DRF, serialization) with the test client.
+
+Each benchmark reports p50/p95/p99 latency, throughput and the RSS it peaked at for
+every concurrency, as JSON. Passing the JSON of a previous build with --baseline fails the
+command when a benchmark got slower than the tolerance allows:
+
+    python manage.py bench --output main.json
+    python manage.py bench --baseline main.json --only ssim,http:ssim
+"""
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from image_project.libraries import benchmark, thread_budget
+
+NIK = '3171000000000001'
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the hot functions and the HTTP endpoints on synthetic images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', default='',
+                            help="Comma-separated benchmark names or prefixes, e.g. 'ssim,http:ocr'.")
+        parser.add_argument('--list', action='store_true', help='List the benchmarks and exit.')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--concurrency', default='1,4', help='Comma-separated numbers of concurrent callers.')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed calls before each benchmark.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--face-image', help='A face photo used instead of the synthetic faces.')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout.')
+        parser.add_argument('--baseline', help='JSON report of a previous run to compare with.')
+        parser.add_argument('--tolerance', type=float, default=0.15,
+                            help='Allowed relative p95 increase or throughput decrease against the baseline.')
+
+    def handle(self, *args, **options):
+        benchmarks = {**self.micro_benchmarks(), **self.http_benchmarks()}
+        prefixes = [prefix for prefix in options['only'].split(',') if prefix]
+        selected = [name for name in benchmarks if not prefixes or name.startswith(tuple(prefixes))]
+        if options['list']:
+            self.stdout.write('\n'.join(selected))
+            return
+        if not selected:
+            raise CommandError(f"No benchmark matches {options['only']!r}")
+
+        self.seed = options['seed']
+        self.count = options['iterations'] + options['warmup']
+        self.face_image = options['face_image']
+        concurrencies = [int(value) for value in options['concurrency'].split(',') if value]
+
+        results = []
+        with _Sandbox():
+            for name in selected:
+                try:
+                    call = benchmarks[name]()
+                except Exception as e:
+                    results.append({'name': name, 'error': f'{type(e).__name__}: {e}'})
+                    self.stderr.write(f'{name}: setup failed: {e}')
+                    continue
+                for concurrency in concurrencies:
+                    result = {'name': name, **benchmark.measure(
+                        call, options['iterations'], concurrency, options['warmup'])}
+                    results.append(result)
+                    self.stderr.write(json.dumps(result))
+
+        report = {'meta': self.meta(options), 'results': results}
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                regressions = compare(json.load(file)['results'], results, options['tolerance'])
+            for regression in regressions:
+                self.stderr.write(self.style.ERROR(regression))
+            if regressions:
+                raise CommandError(f'{len(regressions)} benchmark regressions against {options["baseline"]}')
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                    cwd=settings.BASE_DIR, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'cpus': thread_budget.available_cpus(),
+            'threads': thread_budget.budget(),
+            'iterations': options['iterations'],
+            'warmup': options['warmup'],
+            'seed': options['seed'],
+            'synthetic_faces': not options['face_image'],
+        }
+
+    # Inputs: one distinct image per call, generated before timing
+
+    def signatures(self):
+        return [benchmark.synthetic_signature(self.seed + index) for index in range(self.count)]
+
+    def signature_files(self):
+        paths = []
+        for index, image in enumerate(self.signatures()):
+            path = os.path.join(settings.MEDIA_ROOT, 'bench', f'signature-{index}.png')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(benchmark.encode(image[:, :, ::-1]))
+            paths.append(path)
+        return paths
+
+    def faces(self):
+        if self.face_image:
+            import cv2
+
+            image = cv2.imread(self.face_image)
+            if image is None:
+                raise CommandError(f'Could not read {self.face_image}')
+            # One pixel differs per call, so that no two uploads are identical
+            faces = []
+            for index in range(self.count):
+                variant = image.copy()
+                variant[0, 0] = (index % 256, index // 256 % 256, 0)
+                faces.append(benchmark.encode(variant, '.jpg'))
+            return faces
+        return [benchmark.encode(benchmark.synthetic_face(self.seed + index)) for index in range(self.count)]
+
+    def cards(self):
+        return [benchmark.synthetic_ktp(self.seed + index) for index in range(self.count)]
+
+    # Function benchmarks
+
+    def micro_benchmarks(self):
+        return {
+            'ssim.preprocess_image': self.bench_ssim_preprocess_image,
+            'sfd.load_image': self.bench_sfd_load_image,
+            'sfd.get_image_embeddings': self.bench_sfd_get_image_embeddings,
+            'fsim.predict_similarity': self.bench_fsim_predict_similarity,
+            'ocr.ktp_ocr': self.bench_ocr_ktp_ocr,
+        }
+
+    def bench_ssim_preprocess_image(self):
+        from ssim.function import feature
+
+        paths = self.signature_files()
+        return lambda index: feature.preprocess_image(paths[index])
+
+    def bench_sfd_load_image(self):
+        from sfd.function import features
+
+        paths = self.signature_files()
+        return lambda index: features.load_image(paths[index])
+
+    def bench_sfd_get_image_embeddings(self):
+        from sfd.function import features
+
+        images = [features.load_image(path) for path in self.signature_files()]
+        return lambda index: features.get_image_embeddings(images[index])
+
+    def bench_fsim_predict_similarity(self):
+        from fsim.function import feature
+        from fsim.serializers import FaceSerializer
+
+        faces = self.faces()
+        self.enroll('fsim:enroll_anchor', 'img', faces[0])
+
+        def call(index):
+            serializer = FaceSerializer(data={'nik': NIK, 'img': _upload(faces[index]), 'is_anchor': False})
+            serializer.is_valid(raise_exception=True)
+            return feature.predict_similarity(serializer)
+        return call
+
+    def bench_ocr_ktp_ocr(self):
+        from ocr.function import feature
+
+        cards = self.cards()
+        return lambda index: feature.ktp_ocr(cards[index], bypass_cache=True)
+
+    # HTTP benchmarks
+
+    def http_benchmarks(self):
+        return {
+            'http:fsim:predict_similarity': lambda: self.bench_face_endpoint('fsim:predict_similarity'),
+            'http:fsim:async_predict_similarity': lambda: self.bench_face_endpoint('fsim:async_predict_similarity'),
+            'http:fsim:identify': lambda: self.bench_face_endpoint('fsim:identify'),
+            'http:fsim:async_identify': lambda: self.bench_face_endpoint('fsim:async_identify'),
+            'http:ssim:predict_similarity': lambda: self.bench_signature_endpoint('ssim:predict_similarity'),
+            'http:ssim:async_predict_similarity': lambda: self.bench_signature_endpoint('ssim:async_predict_similarity'),
+            'http:sfd:image_similarity': lambda: self.bench_sfd_endpoint('sfd:image_similarity'),
+            'http:sfd:async_image_similarity': lambda: self.bench_sfd_endpoint('sfd:async_image_similarity'),
+            'http:ocr:KTPOCR': lambda: self.bench_ktp_endpoint('ocr:KTPOCR'),
+            'http:ocr:AsyncKTPOCR': lambda: self.bench_ktp_endpoint('ocr:AsyncKTPOCR'),
+            'http:ocr:KTPOCRBatch': self.bench_ktp_batch_endpoint,
+        }
+
+    def bench_face_endpoint(self, url_name):
+        faces = self.faces()
+        self.enroll('fsim:enroll_anchor', 'img', faces[0])
+        return self.post(url_name, lambda index: {'nik': NIK, 'img': _upload(faces[index])})
+
+    def bench_signature_endpoint(self, url_name):
+        signatures = [benchmark.encode(image[:, :, ::-1]) for image in self.signatures()]
+        self.enroll('ssim:enroll_anchor', 'img', signatures[0])
+        return self.post(url_name, lambda index: {'nik': NIK, 'img': _upload(signatures[index])})
+
+    def bench_sfd_endpoint(self, url_name):
+        signatures = [benchmark.encode(image[:, :, ::-1]) for image in self.signatures()]
+        reference_index = apps.get_app_config('sfd').reference_index
+        with open(os.path.join(reference_index.reference_dir, f'{NIK}.png'), 'wb') as file:
+            file.write(signatures[0])
+        return self.post(url_name, lambda index: {'nik': NIK, 'image_1': _upload(signatures[index])})
+
+    def bench_ktp_endpoint(self, url_name):
+        cards = [benchmark.encode(card) for card in self.cards()]
+        return self.post(url_name, lambda index: {'img': _upload(cards[index]), 'bypass_cache': True})
+
+    def bench_ktp_batch_endpoint(self):
+        cards = [benchmark.encode(card) for card in self.cards()]
+        batch_size = settings.OCR_BATCH_SIZE
+
+        def data(index):
+            chunk = [cards[(index * batch_size + offset) % len(cards)] for offset in range(batch_size)]
+            return {'images': [_upload(card) for card in chunk], 'bypass_cache': True}
+        return self.post('ocr:KTPOCRBatch', data)
+
+    def enroll(self, url_name, field, content):
+        response = Client().post(reverse(url_name), {'nik': NIK, field: _upload(content)})
+        if response.status_code != 200:
+            raise CommandError(f'Enrolling the anchor with {url_name} failed: {response.content[:200]!r}')
+
+    def post(self, url_name, data):
+        path = reverse(url_name)
+
+        def call(index):
+            response = Client().post(path, data(index))
+            if response.streaming:
+                # Batch OCR streams one NDJSON line per card, each with its own status
+                content = b''.join(response.streaming_content)
+                for line in content.splitlines():
+                    if json.loads(line)['status'] != 200:
+                        raise RuntimeError(f'Card failed: {line[:200]!r}')
+            else:
+                content = response.content
+            if response.status_code != 200:
+                raise RuntimeError(f'HTTP {response.status_code}: {content[:200]!r}')
+            return content
+        return call
+
+
+class _Sandbox:
+    """
+    Test database, media directory and sfd reference directory of a benchmark run.
+    """
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp(prefix='bench-')
+        setup_test_environment()
+        self.database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        self.settings = override_settings(MEDIA_ROOT=os.path.join(self.directory, 'media'))
+        self.settings.enable()
+        # Failed requests are counted in the results, not logged with their traceback
+        self.request_logger = logging.getLogger('django.request')
+        self.request_level = self.request_logger.level
+        self.request_logger.setLevel(logging.CRITICAL)
+
+        reference_index = apps.get_app_config('sfd').reference_index
+        self.reference_dirs = reference_index.reference_dir, reference_index.index_dir
+        reference_index.reference_dir = os.path.join(self.directory, 'main_signature')
+        reference_index.index_dir = os.path.join(self.directory, 'reference_embeddings')
+        os.makedirs(reference_index.reference_dir)
+        return self
+
+    def __exit__(self, *exc_info):
+        reference_index = apps.get_app_config('sfd').reference_index
+        reference_index.reference_dir, reference_index.index_dir = self.reference_dirs
+        self.request_logger.setLevel(self.request_level)
+        self.settings.disable()
+        connection.creation.destroy_test_db(self.database_name, verbosity=0)
+        teardown_test_environment()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _upload(content, name='image.png'):
+    return SimpleUploadedFile(name, content)
+
+
+def compare(baseline, results, tolerance):
+    """
+    Compare the results of two runs.
+
+    Args:
+        baseline (list): The results of the previous run.
+        results (list): The results of this run.
+        tolerance (float): The allowed relative p95 increase or throughput decrease.
+
+    Returns:
+        list: A message for every benchmark and concurrency that regressed.
+    """
+    previous = {(result['name'], result.get('concurrency')): result for result in baseline}
+    regressions = []
+    for result in results:
+        reference = previous.get((result['name'], result.get('concurrency')))
+        if reference is None or 'p95_ms' not in reference or 'p95_ms' not in result:
+            continue
+        label = f"{result['name']} (concurrency {result['concurrency']})"
+        if result['p95_ms'] > reference['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{label}: p95 {reference['p95_ms']:.1f} -> {result['p95_ms']:.1f} ms")
+        if result['throughput_per_s'] < reference['throughput_per_s'] * (1 - tolerance):
+            regressions.append(
+                f"{label}: throughput {reference['throughput_per_s']:.2f} -> {result['throughput_per_s']:.2f}/s")
+    return regressions
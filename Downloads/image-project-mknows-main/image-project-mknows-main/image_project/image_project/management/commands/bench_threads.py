@@ -0,0 +1,121 @@
+"""
+Management command measuring the throughput of an engine across thread budgets.
+
+For every combination of worker count and intra-op threads, that many worker
+processes are started with the matching THREAD_BUDGET environment, so each of them
+applies the budget before loading the model, exactly as a server worker does. They
+warm the engine up, then all run its synthetic inference at the same time for the
+given duration. The report gives the throughput of the node and the mean latency of
+a call, so oversubscribed choices show up as a throughput drop.
+
+    python manage.py bench_threads --engine ssim --workers 1,2,4 --intra-op 1,2,4
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from image_project.libraries import thread_budget
+
+
+class Command(BaseCommand):
+    help = 'Measure the throughput of an engine for several worker counts and thread budgets.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--engine', choices=sorted(thread_budget.ENGINE_LIBRARIES), default='ssim')
+        parser.add_argument('--workers', default='1,2,4', help='Comma-separated worker counts.')
+        parser.add_argument('--intra-op', default='1,2,4',
+                            help="Comma-separated intra-op threads of the engine's library, per worker.")
+        parser.add_argument('--inter-op', type=int, default=None)
+        parser.add_argument('--seconds', type=float, default=20)
+        parser.add_argument('--child', action='store_true', help='Run as one benchmark worker (internal).')
+
+    def handle(self, *args, **options):
+        if options['child']:
+            return self.run_child(options['engine'], options['seconds'])
+
+        library = thread_budget.ENGINE_LIBRARIES[options['engine']]
+        rows = []
+        for workers in _integers(options['workers']):
+            for intra_op in _integers(options['intra_op']):
+                environment = {
+                    **os.environ,
+                    # The engine runs in the benchmark workers, not in an inference server
+                    'INFERENCE_MODE': 'local',
+                    'THREAD_BUDGET_WORKERS': str(workers),
+                    f'THREAD_BUDGET_{library.upper()}_INTRA_OP': str(intra_op),
+                }
+                if options['inter_op'] is not None:
+                    environment[f'THREAD_BUDGET_{library.upper()}_INTER_OP'] = str(options['inter_op'])
+                results = self.run_workers(options['engine'], workers, options['seconds'], environment)
+                calls = sum(result['calls'] for result in results)
+                seconds = sum(result['seconds'] for result in results)
+                rows.append({
+                    'workers': workers,
+                    'intra_op': intra_op,
+                    'threads': workers * intra_op,
+                    'calls_per_second': sum(result['calls'] / result['seconds'] for result in results),
+                    'latency_ms': 1000 * seconds / calls if calls else None,
+                })
+                self.stdout.write(json.dumps(rows[-1]))
+
+        self.stdout.write(f"\n{options['engine']} ({library}) on {thread_budget.available_cpus()} CPUs")
+        self.stdout.write(f"{'workers':>8} {'intra-op':>9} {'threads':>8} {'calls/s':>10} {'latency ms':>11}")
+        for row in rows:
+            latency = f"{row['latency_ms']:11.1f}" if row['latency_ms'] is not None else f"{'-':>11}"
+            self.stdout.write(
+                f"{row['workers']:>8} {row['intra_op']:>9} {row['threads']:>8} {row['calls_per_second']:>10.2f} {latency}")
+
+    def run_workers(self, engine, workers, seconds, environment):
+        command = [sys.executable, sys.argv[0], 'bench_threads', '--child',
+                   '--engine', engine, '--seconds', str(seconds)]
+        processes = [
+            subprocess.Popen(command, env=environment, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+            for _ in range(workers)
+        ]
+        try:
+            # Every worker loads and warms the model up before any of them is timed
+            for process in processes:
+                _read_message(process)
+            for process in processes:
+                process.stdin.write('start\n')
+                process.stdin.flush()
+            return [_read_message(process) for process in processes]
+        finally:
+            for process in processes:
+                process.stdin.close()
+                process.wait()
+
+    def run_child(self, engine, seconds):
+        warm_up = apps.get_app_config(engine).warm_up
+        warm_up()
+        _write_message({'ready': True})
+        sys.stdin.readline()
+
+        calls = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            warm_up()
+            calls += 1
+        _write_message({'calls': calls, 'seconds': time.perf_counter() - start})
+
+
+def _integers(values):
+    return [int(value) for value in values.split(',') if value]
+
+
+def _write_message(message):
+    # Libraries may print to stdout too: messages are marked
+    sys.stdout.write('bench_threads ' + json.dumps(message) + '\n')
+    sys.stdout.flush()
+
+
+def _read_message(process):
+    for line in process.stdout:
+        if line.startswith('bench_threads '):
+            return json.loads(line[len('bench_threads '):])
+    raise CommandError(f'Benchmark worker exited with status {process.wait()}')
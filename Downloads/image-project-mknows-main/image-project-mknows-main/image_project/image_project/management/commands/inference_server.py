@@ -0,0 +1,47 @@
+"""
+Management command running the local inference server.
+
+Web processes configured with INFERENCE_SERVICE['MODE'] = 'remote' send their
+model calls to this process over a Unix socket, with image arrays in shared memory.
+"""
+import os
+
+from django.core.management.base import BaseCommand
+
+from image_project.libraries import inference_service
+from image_project.libraries.registry import registry
+from image_project.libraries.warmup import warmup
+
+
+class Command(BaseCommand):
+    help = 'Serve model inference for the web workers over a Unix socket.'
+
+    def add_arguments(self, parser):
+        service_options = inference_service.options()
+        parser.add_argument('--socket', default=service_options['SOCKET'])
+        parser.add_argument('--engines', nargs='+', default=service_options['ENGINES'],
+                            choices=list(inference_service.REMOTE_FUNCTIONS))
+
+    def handle(self, *args, **options):
+        from fsim.function import feature as fsim_feature
+        from ocr.function import feature as ocr_feature
+        from sfd.function import features as sfd_features
+        from ssim.function import feature as ssim_feature
+
+        # The engines run in this process, whatever the configured mode
+        inference_service.serving = True
+        targets = {
+            'ssim': ssim_feature.get_predictor,
+            'sfd': lambda: sfd_features,
+            'fsim': lambda: fsim_feature,
+            'ocr': lambda: ocr_feature,
+        }
+        targets = {engine: targets[engine] for engine in options['engines']}
+
+        registry.preload(options['engines'])
+        warmup.run(options['engines'])
+        if os.path.exists(options['socket']):
+            os.remove(options['socket'])
+
+        self.stdout.write(f"Serving {', '.join(targets)} on {options['socket']}")
+        inference_service.serve(options['socket'], targets)
@@ -0,0 +1,82 @@
+"""
+Management command running the pool of async job workers.
+
+Each worker process claims queued jobs from the database and replays them against
+their endpoint. The parent process restarts workers that die, requeues the jobs
+of workers that stopped in the middle of a job, and deletes the finished jobs past
+their retention.
+"""
+import multiprocessing
+import signal
+import time
+
+from django import db
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from image_project.libraries import inference_service, jobs
+from image_project.libraries.registry import registry
+
+
+class Command(BaseCommand):
+    help = 'Run a pool of worker processes executing queued async jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=2)
+        parser.add_argument('--preload', action='store_true',
+                            help='Load PRELOAD_MODELS in every worker before it claims jobs.')
+
+    def handle(self, *args, **options):
+        # Connections must not be shared with the forked workers
+        db.connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = {}
+        stopping = False
+
+        def stop(signum, frame):
+            nonlocal stopping
+            stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        self.stdout.write(f"Running {options['processes']} job workers")
+
+        job_options = jobs.options()
+        while not stopping:
+            for index in range(options['processes']):
+                if index not in workers or not workers[index].is_alive():
+                    workers[index] = context.Process(target=work, args=(index, options['preload']), daemon=True)
+                    workers[index].start()
+
+            jobs.requeue_stale()
+            jobs.purge_finished()
+            db.connections.close_all()
+            time.sleep(max(job_options['POLL_INTERVAL'], 1))
+
+        for worker in workers.values():
+            worker.terminate()
+        for worker in workers.values():
+            worker.join()
+
+
+def work(index, preload=False):
+    """
+    Claim and run jobs until the process is terminated.
+
+    Args:
+        index (int): The index of the worker in its pool.
+        preload (bool): Whether to load PRELOAD_MODELS before claiming jobs. They
+        are loaded after forking, since TensorFlow and Paddle are not fork-safe.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if preload:
+        registry.preload([name for name in settings.PRELOAD_MODELS if not inference_service.is_remote(name)])
+    name = jobs.worker_name(index)
+    poll_interval = jobs.options()['POLL_INTERVAL']
+    while True:
+        job = jobs.claim(name)
+        if job is None:
+            time.sleep(poll_interval)
+            continue
+        jobs.run(job)
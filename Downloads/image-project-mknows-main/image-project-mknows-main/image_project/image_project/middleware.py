@@ -0,0 +1,272 @@
+"""
+Module: middleware.py
+
+This module contains the middleware accepting asynchronous requests for the
+inference endpoints, the admission control in front of them, and the per-stage
+latency instrumentation of every request.
+"""
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve, reverse
+from django.utils.deprecation import MiddlewareMixin
+
+from .libraries import admission, jobs, timing
+
+
+class ServerTimingMiddleware:
+    """
+    Time the stages of every request and report them in a Server-Timing header.
+
+    Placed first, so the total covers the other middleware. The multipart body is
+    parsed here, once the view is resolved, so that parsing is timed on its own
+    instead of inside the first access to request.data. The durations are recorded
+    in the /metrics histograms under the URL name of the endpoint.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not timing.options()['ENABLED']:
+            return self.get_response(request)
+
+        token, timings = timing.start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            timing.end_request(token, endpoint_name(request), timings, total)
+        return timing_response(response, timings, total)
+
+    async def __acall__(self, request):
+        if not timing.options()['ENABLED']:
+            return await self.get_response(request)
+
+        token, timings = timing.start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter() - start
+            timing.end_request(token, endpoint_name(request), timings, total)
+        return timing_response(response, timings, total)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if timing.options()['ENABLED']:
+            parse_body(request)
+        return None
+
+
+def parse_body(request):
+    """
+    Parse the multipart body of a request once, timed as the 'parse' stage.
+
+    Async job submissions are left unparsed, since they store the raw body, which
+    parsing would consume.
+
+    Parameters:
+    - request: The HTTP request object.
+    """
+    if (request.method == 'POST' and request.content_type == 'multipart/form-data'
+            and not hasattr(request, '_post') and not wants_async(request)):
+        with timing.stage('parse'):
+            request.POST
+
+
+def endpoint_name(request):
+    """
+    Return the endpoint label of a request in the metrics.
+
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - str: The URL name ('app:name'), or 'unmatched' when no URL matched.
+    """
+    resolver_match = getattr(request, 'resolver_match', None)
+    return resolver_match.view_name if resolver_match else 'unmatched'
+
+
+def timing_response(response, timings, total):
+    if timing.options()['HEADER']:
+        response['Server-Timing'] = timings.header(total)
+    return response
+
+
+class AsyncJobMiddleware(MiddlewareMixin):
+    """
+    Queue the requests that opt in to the async job mode instead of running them.
+
+    A POST to one of ASYNC_JOBS['ENDPOINTS'] with '?async=1' or a
+    'Prefer: respond-async' header is stored as a job and answered with 202,
+    the job id and the URL to poll. Other requests pass through unchanged.
+
+    MiddlewareMixin makes it usable in both sync and async mode, so it does not force
+    the native async views back onto a single thread under ASGI.
+    """
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method != 'POST' or not wants_async(request):
+            return None
+
+        job_options = jobs.options()
+        endpoint = request.resolver_match.view_name
+        if endpoint not in job_options['ENDPOINTS']:
+            return error_response(400, f'Endpoint {endpoint} does not support async requests')
+
+        if int(request.META.get('CONTENT_LENGTH') or 0) > job_options['MAX_BODY_SIZE']:
+            return error_response(413, 'Request body too large for an async job')
+
+        callback_url = request.GET.get('callback_url', '')
+        if callback_url and not jobs.callback_allowed(callback_url):
+            return error_response(400, 'callback_url is not allowed')
+
+        # Read from the stream, which is not subject to DATA_UPLOAD_MAX_MEMORY_SIZE
+        body = request.read(job_options['MAX_BODY_SIZE'] + 1)
+        if len(body) > job_options['MAX_BODY_SIZE']:
+            return error_response(413, 'Request body too large for an async job')
+
+        job = jobs.submit(endpoint, request.path_info, request.get_host(),
+                          request.META.get('CONTENT_TYPE', ''), body, callback_url,
+                          request.META.get('QUERY_STRING', ''))
+        status_url = request.build_absolute_uri(reverse('job_status', args=[job.id]))
+        response = JsonResponse({
+            'status': 202,
+            'message': 'accepted',
+            'result': {'id': str(job.id), 'status': job.status, 'status_url': status_url},
+        }, status=202)
+        response['Location'] = status_url
+        return response
+
+
+class AdmissionControlMiddleware:
+    """
+    Limit the concurrent requests of each engine, with a bounded wait queue.
+
+    Requests to the endpoints of ADMISSION_CONTROL['ENDPOINTS'] wait for a slot of
+    their engine once their body is read and parsed, so slow uploads do not hold a
+    slot. They are shed with SHED_STATUS and a Retry-After header when the queue is
+    full, and with 504 when their deadline passes before they get a slot, or before
+    their inference starts (see admission.check_deadline).
+    Async job submissions are not controlled: they only store the request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        controller = controller_for(request)
+        if controller is None:
+            return self.get_response(request)
+        parse_body(request)
+        deadline_at = admission.parse_deadline(request.headers, request.received_at)
+        try:
+            with timing.stage('queue'):
+                controller.acquire(deadline_at)
+        except (admission.Overloaded, admission.DeadlineExceeded) as e:
+            return admission_response(e)
+
+        started = time.monotonic()
+        try:
+            with admission.deadline_scope(deadline_at) as deadline:
+                response = self.get_response(request)
+        finally:
+            controller.release(time.monotonic() - started)
+        return admission_response(admission.DeadlineExceeded()) if deadline.exceeded else response
+
+    async def __acall__(self, request):
+        controller = controller_for(request)
+        if controller is None:
+            return await self.get_response(request)
+        parse_body(request)
+        deadline_at = admission.parse_deadline(request.headers, request.received_at)
+        try:
+            with timing.stage('queue'):
+                await controller.acquire_async(deadline_at)
+        except (admission.Overloaded, admission.DeadlineExceeded) as e:
+            return admission_response(e)
+
+        started = time.monotonic()
+        try:
+            with admission.deadline_scope(deadline_at) as deadline:
+                response = await self.get_response(request)
+        finally:
+            controller.release(time.monotonic() - started)
+        return admission_response(admission.DeadlineExceeded()) if deadline.exceeded else response
+
+
+def controller_for(request):
+    """
+    Return the admission controller of the endpoint of a request.
+
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - AdmissionController: The controller of its engine, or None when the request is
+    not controlled.
+    """
+    request.received_at = time.time()
+    if request.method != 'POST' or wants_async(request):
+        return None
+    try:
+        endpoint = resolve(request.path_info).view_name
+    except Resolver404:
+        return None
+    engine = admission.options()['ENDPOINTS'].get(endpoint)
+    return admission.get_controller(engine) if engine else None
+
+
+def admission_response(error):
+    """
+    Build the response of a request refused by admission control.
+
+    Parameters:
+    - error: The Overloaded or DeadlineExceeded error.
+
+    Returns:
+    - JsonResponse: SHED_STATUS with Retry-After when overloaded, 504 when the deadline passed.
+    """
+    if isinstance(error, admission.Overloaded):
+        response = error_response(admission.options()['SHED_STATUS'], str(error))
+        response['Retry-After'] = str(error.retry_after)
+        return response
+    return error_response(504, str(error))
+
+
+def wants_async(request):
+    """
+    Tell whether a request opts in to the async job mode.
+
+    Parameters:
+    - request: The HTTP request object.
+
+    Returns:
+    - bool: True for '?async=1' (or 'true') or a 'Prefer: respond-async' header.
+    """
+    if request.GET.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    prefer = request.headers.get('Prefer', '')
+    return 'respond-async' in [token.strip().lower() for token in prefer.split(',')]
+
+
+def error_response(status, message):
+    return JsonResponse({'status': status, 'message': message, 'result': None}, status=status)
@@ -0,0 +1,35 @@
+import uuid
+
+from django.db import models
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    endpoint = models.CharField(max_length=64)
+    path = models.CharField(max_length=255)
+    # The original query string, restored when the request is replayed
+    query_string = models.TextField(blank=True, default='')
+    host = models.CharField(max_length=255, blank=True, default='')
+    content_type = models.CharField(max_length=255, blank=True, default='')
+    # The original request body, replayed by a job worker and cleared once the job ends
+    body = models.BinaryField(default=b'')
+    callback_url = models.URLField(max_length=500, blank=True, default='')
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED, db_index=True)
+    # Incremented by each claim: a worker only stores the outcome of its own attempt
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=64, blank=True, default='')
+    response_status = models.PositiveIntegerField(null=True, blank=True, default=None)
+    response = models.TextField(blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    started_at = models.DateTimeField(null=True, blank=True, default=None)
+    finished_at = models.DateTimeField(null=True, blank=True, default=None, db_index=True)
+
+    def __str__(self):
+        return f'{self.endpoint} {self.id}'
@@ -39,6 +39,7 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'image_project',
     'fsim',
     'ssim',
     'sfd',
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'image_project.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -53,6 +55,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'image_project.middleware.AsyncJobMiddleware',
+    'image_project.middleware.AdmissionControlMiddleware',
 ]
 
 ROOT_URLCONF = 'image_project.urls'
@@ -90,6 +94,237 @@ DATABASES = {
 MEDIA_ROOT= os.path.join(BASE_DIR, 'media/')
 MEDIA_URL= "/media/"
 
+# Uploads are decoded in memory; keep them out of temporary files on disk
+FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024
+
+# Models preloaded by the WSGI/ASGI entry points ('fsim', 'ssim', 'sfd', 'ocr');
+# the others load lazily on first use. OCR-only pods can set PRELOAD_MODELS=ocr
+PRELOAD_MODELS = [name for name in os.environ.get('PRELOAD_MODELS', 'fsim,ssim,sfd,ocr').split(',') if name]
+
+# Preloaded engines are run on synthetic inputs at boot, and /ready answers 503 until
+# this warmup is done. BACKGROUND starts serving (not ready) while warmup runs
+WARMUP = {
+    'ENABLED': os.environ.get('WARMUP', '1') == '1',
+    'BACKGROUND': os.environ.get('WARMUP_BACKGROUND', '0') == '1',
+}
+
+# Per-stage latency of every request (parsing, queueing, database, decoding, preprocessing,
+# inference, deletions), sent in the Server-Timing header and aggregated with per-model
+# inference counters on the Prometheus /metrics endpoint of each worker
+SERVER_TIMING = {
+    'ENABLED': os.environ.get('SERVER_TIMING', '1') == '1',
+    'HEADER': True,
+}
+
+# Model calls of ENGINES go to the inference server (manage.py inference_server)
+# over SOCKET when MODE is 'remote', and run in the web process when it is 'local'
+INFERENCE_SERVICE = {
+    'MODE': os.environ.get('INFERENCE_MODE', 'local'),
+    'SOCKET': os.environ.get('INFERENCE_SOCKET', '/tmp/image_project_inference.sock'),
+    'ENGINES': ['fsim', 'ssim', 'sfd', 'ocr'],
+}
+
+# CPU threads of each worker, applied before any model loads and reported by /health/.
+# CPUS (None: the CPUs of the process) are shared by WORKERS processes per node (gunicorn
+# sets it to its worker count). Per library, INTRA_OP/INTER_OP default to the worker's
+# share for the TensorFlow (fsim, ssim, sfd) and Paddle (ocr) intra-op pools and to 1
+# otherwise; an explicit Paddle value replaces the CPU_THREADS of the OCR profiles.
+# Compare choices with `manage.py bench_threads`
+THREAD_BUDGET = {
+    'CPUS': os.environ.get('THREAD_BUDGET_CPUS'),
+    'WORKERS': int(os.environ.get('THREAD_BUDGET_WORKERS', 1)),
+    'LIBRARIES': {
+        library: {
+            'INTRA_OP': os.environ.get(f'THREAD_BUDGET_{library.upper()}_INTRA_OP'),
+            'INTER_OP': os.environ.get(f'THREAD_BUDGET_{library.upper()}_INTER_OP'),
+        }
+        for library in ('tensorflow', 'paddle', 'opencv', 'blas')
+    },
+}
+
+# PaddleOCR engine profiles for KTP OCR, selectable per request with the 'profile' field.
+# MAX_SIDE caps the longer image side before detection (None keeps the full resolution).
+# 'accurate' matches the PaddleOCR(lang='en') defaults. Measure the latency and field
+# accuracy of each profile on labelled cards with `manage.py ocr_profile_report`
+OCR_PROFILES = {
+    'accurate': {
+        'DET_LIMIT_SIDE_LEN': 960,
+        'USE_ANGLE_CLS': False,
+        'REC_BATCH_NUM': 6,
+        'CPU_THREADS': 10,
+        'ENABLE_MKLDNN': False,
+        'MAX_SIDE': None,
+    },
+    'fast': {
+        'DET_LIMIT_SIDE_LEN': 640,
+        'USE_ANGLE_CLS': False,
+        'REC_BATCH_NUM': 16,
+        'CPU_THREADS': 4,
+        'ENABLE_MKLDNN': True,
+        'MAX_SIDE': 1280,
+    },
+}
+OCR_DEFAULT_PROFILE = os.environ.get('OCR_PROFILE', 'accurate')
+
+# Cards processed together by the batch KTP OCR endpoint: their text lines are recognized
+# in shared batches, and their results are streamed once the whole chunk is done
+OCR_BATCH_SIZE = 8
+
+# Limits of the zip archive of the batch KTP OCR endpoint, checked against the archive
+# headers before any entry is decompressed, so a zip bomb is rejected with a 400
+OCR_ARCHIVE_LIMITS = {
+    'MAX_ENTRIES': 1000,
+    'MAX_FILE_SIZE': 20 * 2 ** 20,
+    'MAX_TOTAL_SIZE': 512 * 2 ** 20,
+    'MAX_COMPRESSION_RATIO': 100,
+}
+
+# 1:N face identification: the coarse IVF index is used from this gallery size on,
+# scoring the FSIM_GALLERY_IVF_NPROBE clusters closest to the probe face
+FSIM_GALLERY_IVF_MIN_SIZE = 50000
+FSIM_GALLERY_IVF_NPROBE = 8
+
+# Enrolled ssim anchor embeddings are kept in a quantized, memory-mapped store
+# ('int8' with a per-vector scale, or 'float16'), one directory per model version
+SSIM_EMBEDDING_STORE_DIR = os.path.join(BASE_DIR, 'ssim', 'cache', 'embeddings')
+SSIM_EMBEDDING_STORE_DTYPE = 'int8'
+
+# Backend of the ssim embedding model: 'keras' (the .h5 model) or 'tflite' (the model
+# converted with `manage.py convert_ssim_tflite`, with QUANTIZATION 'dynamic' or 'int8').
+# NUM_THREADS is the number of TFLite interpreter threads (None for its default)
+SSIM_BACKEND = os.environ.get('SSIM_BACKEND', 'keras')
+SSIM_TFLITE = {
+    'QUANTIZATION': os.environ.get('SSIM_TFLITE_QUANTIZATION', 'dynamic'),
+    'NUM_THREADS': None,
+}
+# Local signature images used to calibrate int8 quantization and to check backend parity
+SSIM_SAMPLE_DIR = os.environ.get('SSIM_SAMPLE_DIR', os.path.join(BASE_DIR, 'ssim', 'samples'))
+
+# Backend of the sfd model: 'full' (vgg16_model.h5) or 'slim' (its convolutional base with
+# global average pooling, exported as float16 weights with `manage.py export_sfd_slim`).
+# The slim scores are distributed differently: the export calibrates a threshold against
+# the full model and stores it with the weights. THRESHOLD, when set, overrides it
+SFD_BACKEND = os.environ.get('SFD_BACKEND', 'full')
+SFD_SLIM = {
+    'THRESHOLD': float(os.environ['SFD_SLIM_THRESHOLD']) if os.environ.get('SFD_SLIM_THRESHOLD') else None,
+}
+# Local signature images used by the export report
+SFD_SAMPLE_DIR = os.environ.get('SFD_SAMPLE_DIR', os.path.join(BASE_DIR, 'sfd', 'samples'))
+
+# Micro-batching of concurrent requests in front of the ssim and sfd Keras models:
+# a forward pass runs when MAX_BATCH_SIZE rows are queued or after MAX_WAIT_MS
+INFERENCE_BATCHING = {
+    'ssim': {'ENABLED': True, 'MAX_BATCH_SIZE': 16, 'MAX_WAIT_MS': 5},
+    'sfd': {'ENABLED': True, 'MAX_BATCH_SIZE': 16, 'MAX_WAIT_MS': 5},
+}
+
+# Content-addressed result caches, keyed by the decoded pixels and the model version,
+# profile and options. MAX_ENTRIES bounds the in-memory LRU of each worker; DIRECTORY
+# adds an on-disk tier shared by the workers (None for memory only). OCR results hold
+# the personal data of the card, so the disk tier is opt-in and entries of both tiers
+# expire after TTL seconds
+RESULT_CACHE = {
+    'ocr': {
+        'ENABLED': os.environ.get('OCR_RESULT_CACHE', '1') == '1',
+        'MAX_ENTRIES': 2048,
+        'DIRECTORY': os.environ.get('OCR_RESULT_CACHE_DIR'),
+        'TTL': int(os.environ.get('OCR_RESULT_CACHE_TTL', 3600)),
+    },
+}
+
+# Embeddings of probe images, keyed by the hash of the uploaded bytes and the model
+# version. MAX_BYTES bounds the in-memory LRU of each worker; SHARED_DIRECTORY (e.g. on
+# /dev/shm) lets the workers of a node share embeddings, up to SHARED_MAX_BYTES
+EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR')
+EMBEDDING_CACHE = {
+    name: {
+        'ENABLED': os.environ.get('EMBEDDING_CACHE', '1') == '1',
+        'MAX_BYTES': 64 * 2 ** 20,
+        'SHARED_DIRECTORY': os.path.join(EMBEDDING_CACHE_DIR, name) if EMBEDDING_CACHE_DIR else None,
+        'SHARED_MAX_BYTES': 256 * 2 ** 20,
+    }
+    for name in ('ssim', 'sfd')
+}
+
+# Coalescing of identical requests in flight (same endpoint, upload and parameters):
+# duplicates wait up to TIMEOUT seconds for the first one and share its result.
+# COALESCING_DIR (e.g. on /dev/shm) also coalesces across the workers of a host. OCR
+# results hold the personal data of the card, so sharing them through files is opt-in
+# with its own OCR_COALESCING_DIR
+COALESCING_DIR = os.environ.get('COALESCING_DIR')
+COALESCING_DIRECTORIES = {
+    'fsim': os.path.join(COALESCING_DIR, 'fsim') if COALESCING_DIR else None,
+    'sfd': os.path.join(COALESCING_DIR, 'sfd') if COALESCING_DIR else None,
+    'ocr': os.environ.get('OCR_COALESCING_DIR'),
+}
+REQUEST_COALESCING = {
+    name: {
+        'ENABLED': os.environ.get('REQUEST_COALESCING', '1') == '1',
+        'DIRECTORY': directory,
+        'TIMEOUT': 60,
+    }
+    for name, directory in COALESCING_DIRECTORIES.items()
+}
+
+# Thread pools running the inference of the native async views (under ASGI), one per
+# engine, so a burst on one engine cannot take the threads of the others
+INFERENCE_EXECUTORS = {
+    'fsim': {'MAX_WORKERS': 2},
+    'ssim': {'MAX_WORKERS': 2},
+    'sfd': {'MAX_WORKERS': 2},
+    'ocr': {'MAX_WORKERS': 2},
+}
+
+# Admission control of the inference endpoints, per worker process: MAX_CONCURRENCY
+# requests of an engine run at once and MAX_QUEUE wait for a slot. Requests beyond
+# that are shed with SHED_STATUS and Retry-After. Clients may send 'X-Request-Deadline'
+# (Unix time) or 'X-Request-Timeout' (seconds) so that requests they have given up on
+# are dropped with 504 before inference starts
+ADMISSION_CONTROL = {
+    'ENDPOINTS': {
+        'fsim:predict_similarity': 'fsim',
+        'fsim:identify': 'fsim',
+        'fsim:async_predict_similarity': 'fsim',
+        'fsim:async_identify': 'fsim',
+        'ssim:predict_similarity': 'ssim',
+        'ssim:async_predict_similarity': 'ssim',
+        'sfd:image_similarity': 'sfd',
+        'sfd:async_image_similarity': 'sfd',
+        'ocr:KTPOCR': 'ocr',
+        'ocr:AsyncKTPOCR': 'ocr',
+    },
+    'LIMITS': {
+        'fsim': {'MAX_CONCURRENCY': 2, 'MAX_QUEUE': 16},
+        'ssim': {'MAX_CONCURRENCY': 2, 'MAX_QUEUE': 32},
+        'sfd': {'MAX_CONCURRENCY': 2, 'MAX_QUEUE': 32},
+        'ocr': {'MAX_CONCURRENCY': 2, 'MAX_QUEUE': 8},
+    },
+    'SHED_STATUS': 503,
+}
+
+# Async job mode: a POST with '?async=1' or 'Prefer: respond-async' to one of ENDPOINTS
+# is queued in the database and answered with 202 and a job id to poll at /jobs/<id>/.
+# Jobs run in `manage.py job_worker`; CALLBACK_URL, when set, is notified when they end.
+# A per-request '?callback_url=' must start with one of CALLBACK_ALLOWED_PREFIXES.
+# Finished jobs and their responses are deleted after RETENTION seconds
+ASYNC_JOBS = {
+    'ENDPOINTS': [
+        'fsim:predict_similarity',
+        'fsim:identify',
+        'ssim:predict_similarity',
+        'sfd:image_similarity',
+        'ocr:KTPOCR',
+    ],
+    'MAX_BODY_SIZE': 20 * 1024 * 1024,
+    'CALLBACK_URL': os.environ.get('ASYNC_JOBS_CALLBACK_URL') or None,
+    'CALLBACK_ALLOWED_PREFIXES': [prefix for prefix in os.environ.get('ASYNC_JOBS_CALLBACK_PREFIXES', '').split(',') if prefix],
+    'CALLBACK_TIMEOUT': 10,
+    'POLL_INTERVAL': 0.5,
+    'JOB_TIMEOUT': 600,
+    'MAX_ATTEMPTS': 3,
+    'RETENTION': int(os.environ.get('ASYNC_JOBS_RETENTION', 24 * 3600)),
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
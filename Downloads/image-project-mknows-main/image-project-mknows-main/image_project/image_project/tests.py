@@ -0,0 +1,643 @@
+import asyncio
+import errno
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from unittest import mock
+
+import numpy as np
+from django.http import JsonResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+
+from .libraries import admission, batching, benchmark, coalescing, embedding_cache, jobs, result_cache, warmup
+from .management.commands.bench import compare
+from .models import Job
+from .views import JobStatus
+
+
+@csrf_exempt
+def echo(request):
+    return JsonResponse({'query': request.GET.dict(), 'fields': request.POST.dict()})
+
+
+@csrf_exempt
+def wait_past_deadline(request):
+    # Like the inference views, errors are answered with 400
+    time.sleep(0.1)
+    try:
+        admission.check_deadline()
+    except Exception as e:
+        return JsonResponse({'message': str(e)}, status=400)
+    return JsonResponse({'fields': request.POST.dict()})
+
+
+urlpatterns = [
+    path('echo/', echo, name='echo'),
+    path('wait/', wait_past_deadline, name='wait'),
+    path('jobs/<uuid:job_id>/', JobStatus.as_view(), name='job_status'),
+]
+
+
+class MicroBatcherTest(SimpleTestCase):
+    def run_concurrently(self, batcher, requests):
+        # The first request holds the worker until the others are queued behind it
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def predict_fn(batch):
+            started.set()
+            release.wait(5)
+            calls.append(len(batch))
+            return batch * 10
+
+        with ThreadPoolExecutor(len(requests)) as pool:
+            futures = [pool.submit(batcher.predict, predict_fn, requests[0])]
+            self.assertTrue(started.wait(5))
+            futures += [pool.submit(batcher.predict, predict_fn, inputs) for inputs in requests[1:]]
+            while batcher._queue.qsize() < len(requests) - 1:
+                time.sleep(0.001)
+            release.set()
+            return [future.result(5) for future in futures], calls
+
+    def test_outputs_are_returned_in_order(self):
+        batcher = batching.MicroBatcher('test', max_batch_size=16, max_wait_ms=50)
+        requests = [np.full((size, 2), index, dtype=np.float32) for index, size in enumerate([1, 3, 2])]
+        outputs, calls = self.run_concurrently(batcher, requests)
+
+        for inputs, output in zip(requests, outputs):
+            np.testing.assert_array_equal(output, inputs * 10)
+        # The first request runs alone, the two queued behind it share one pass
+        self.assertEqual(calls, [1, 5])
+
+    def test_batches_are_split_at_max_batch_size(self):
+        batcher = batching.MicroBatcher('test', max_batch_size=2, max_wait_ms=50)
+        requests = [np.full((1, 2), index, dtype=np.float32) for index in range(5)]
+        outputs, calls = self.run_concurrently(batcher, requests)
+
+        for inputs, output in zip(requests, outputs):
+            np.testing.assert_array_equal(output, inputs * 10)
+        self.assertTrue(all(size <= 2 for size in calls))
+        self.assertEqual(sum(calls), 5)
+
+    def test_shapes_are_not_stacked(self):
+        batcher = batching.MicroBatcher('test', max_wait_ms=50)
+        outputs, calls = self.run_concurrently(
+            batcher, [np.ones((1, 2)), np.ones((1, 3)), np.ones((1, 2))])
+        self.assertEqual([output.shape for output in outputs], [(1, 2), (1, 3), (1, 2)])
+
+    def test_requests_use_their_own_function(self):
+        batcher = batching.MicroBatcher('test', max_wait_ms=1)
+        inputs = np.ones((1, 2))
+        np.testing.assert_array_equal(batcher.predict(lambda batch: batch * 2, inputs), inputs * 2)
+        # A reloaded model passes a new function, which is used instead of the first one
+        np.testing.assert_array_equal(batcher.predict(lambda batch: batch * 3, inputs), inputs * 3)
+
+    def test_errors_reach_every_caller(self):
+        batcher = batching.MicroBatcher('test', max_wait_ms=1)
+
+        def predict_fn(batch):
+            raise ValueError('model failed')
+
+        with self.assertRaises(ValueError):
+            batcher.predict(predict_fn, np.ones((1, 2)))
+
+
+class AdmissionControllerTest(SimpleTestCase):
+    def test_admits_up_to_max_concurrency(self):
+        controller = admission.AdmissionController('test', max_concurrency=2, max_queue=0)
+        controller.acquire()
+        controller.acquire()
+        with self.assertRaises(admission.Overloaded) as overloaded:
+            controller.acquire()
+        self.assertGreaterEqual(overloaded.exception.retry_after, 1)
+        self.assertEqual(controller.stats()['shed'], 1)
+
+        controller.release(0.1)
+        controller.acquire()
+        self.assertEqual(controller.stats()['active'], 2)
+
+    def test_released_slot_goes_to_the_oldest_waiter(self):
+        controller = admission.AdmissionController('test', max_concurrency=1, max_queue=2)
+        controller.acquire()
+        admitted = []
+
+        def wait(name):
+            controller.acquire()
+            admitted.append(name)
+
+        threads = []
+        for name in ['first', 'second']:
+            threads.append(threading.Thread(target=wait, args=(name,)))
+            threads[-1].start()
+            while controller.stats()['queue_depth'] < len(threads):
+                time.sleep(0.001)
+
+        controller.release()
+        threads[0].join(5)
+        self.assertEqual(admitted, ['first'])
+        controller.release()
+        threads[1].join(5)
+        self.assertEqual(admitted, ['first', 'second'])
+
+    def test_deadline_passed_before_arrival(self):
+        controller = admission.AdmissionController('test')
+        with self.assertRaises(admission.DeadlineExceeded):
+            controller.acquire(time.time() - 1)
+        self.assertEqual(controller.stats()['expired'], 1)
+
+    def test_deadline_passes_while_waiting(self):
+        controller = admission.AdmissionController('test', max_concurrency=1)
+        controller.acquire()
+        with self.assertRaises(admission.DeadlineExceeded):
+            controller.acquire(time.time() + 0.05)
+        self.assertEqual(controller.stats()['queue_depth'], 0)
+
+        # The expired waiter does not take the released slot
+        controller.release()
+        self.assertEqual(controller.stats()['active'], 0)
+
+    def test_parse_deadline(self):
+        received_at = time.time()
+        self.assertEqual(admission.parse_deadline({'X-Request-Timeout': '5'}, received_at), received_at + 5)
+        self.assertEqual(admission.parse_deadline({'X-Request-Deadline': '10', 'X-Request-Timeout': '5'},
+                                                  received_at), 10)
+        for value in ['inf', '-inf', 'nan', 'soon']:
+            with self.subTest(value=value):
+                self.assertIsNone(admission.parse_deadline({'X-Request-Timeout': value}, received_at))
+        # A finite but huge value is brought back, so waiting on it does not overflow
+        self.assertEqual(admission.parse_deadline({'X-Request-Timeout': '1e300'}, received_at),
+                         received_at + admission.MAX_DEADLINE_SECONDS)
+
+    def test_waits_on_a_huge_deadline(self):
+        controller = admission.AdmissionController('test', max_concurrency=1)
+        controller.acquire()
+        waiter = threading.Thread(target=controller.acquire,
+                                  args=[admission.parse_deadline({'X-Request-Deadline': '1e300'}, time.time())])
+        waiter.start()
+        while controller.stats()['queue_depth'] == 0:
+            time.sleep(0.001)
+        controller.release()
+        waiter.join(5)
+        self.assertEqual(controller.stats()['active'], 1)
+
+    def test_cancelled_waiter_leaves_the_queue(self):
+        controller = admission.AdmissionController('test', max_concurrency=1)
+        controller.acquire()
+
+        async def cancel_waiter():
+            task = asyncio.ensure_future(controller.acquire_async())
+            while controller.stats()['queue_depth'] == 0:
+                await asyncio.sleep(0.001)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(cancel_waiter())
+        self.assertEqual(controller.stats()['queue_depth'], 0)
+        controller.release()
+        self.assertEqual(controller.stats()['active'], 0)
+
+    def test_batcher_drops_expired_requests(self):
+        batcher = batching.MicroBatcher('test', max_wait_ms=1)
+        calls = []
+        with admission.deadline_scope(time.time() - 1) as deadline:
+            with self.assertRaises(admission.DeadlineExceeded):
+                batcher.predict(calls.append, np.ones((1, 2)))
+        self.assertTrue(deadline.exceeded)
+        self.assertEqual(calls, [])
+
+
+@override_settings(ROOT_URLCONF='image_project.tests',
+                   ADMISSION_CONTROL={'ENDPOINTS': {'wait': 'test-wait'}, 'LIMITS': {}})
+class AdmissionControlMiddlewareTest(SimpleTestCase):
+    def test_deadline_passed_during_the_view(self):
+        response = self.client.post('/wait/', {'name': 'budi'}, headers={'X-Request-Timeout': '0.05'})
+        self.assertEqual(response.status_code, 504)
+        self.assertEqual(admission.get_controller('test-wait').stats()['active'], 0)
+
+    def test_unbounded_deadlines_are_served(self):
+        for value in ['inf', '1e300', 'nan']:
+            with self.subTest(value=value):
+                response = self.client.post('/wait/', {'name': 'budi'}, headers={'X-Request-Timeout': value})
+                self.assertEqual(response.status_code, 200)
+
+    def test_request_within_its_deadline(self):
+        response = self.client.post('/wait/', {'name': 'budi'}, headers={'X-Request-Timeout': '5'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'fields': {'name': 'budi'}})
+
+
+class BenchmarkTest(SimpleTestCase):
+    def result(self, name, p95_ms, throughput_per_s, concurrency=1):
+        return {'name': name, 'concurrency': concurrency, 'p95_ms': p95_ms, 'throughput_per_s': throughput_per_s}
+
+    def test_compare_within_tolerance(self):
+        baseline = [self.result('ssim', 100, 10)]
+        self.assertEqual(compare(baseline, [self.result('ssim', 114, 8.6)], 0.15), [])
+
+    def test_compare_reports_regressions(self):
+        baseline = [self.result('ssim', 100, 10), self.result('ssim', 200, 20, concurrency=4)]
+        regressions = compare(baseline, [self.result('ssim', 120, 8), self.result('ssim', 200, 20, concurrency=4)], 0.15)
+        self.assertEqual(regressions, [
+            'ssim (concurrency 1): p95 100.0 -> 120.0 ms',
+            'ssim (concurrency 1): throughput 10.00 -> 8.00/s',
+        ])
+
+    def test_compare_skips_unmatched_and_failed_benchmarks(self):
+        baseline = [self.result('ssim', 100, 10), {'name': 'ocr', 'error': 'setup failed'}]
+        results = [self.result('ssim', 500, 1, concurrency=4), self.result('ocr', 500, 1), self.result('sfd', 500, 1)]
+        self.assertEqual(compare(baseline, results, 0.15), [])
+
+    def test_rss_is_measured_per_benchmark(self):
+        if benchmark.current_rss_mb() is None:
+            self.skipTest('/proc is not available')
+        held = []
+
+        def allocate(index):
+            held.append(np.ones(16 * 2 ** 20 // 8))
+            time.sleep(0.03)
+            held.clear()
+
+        heavy = benchmark.measure(allocate, iterations=2)
+        light = benchmark.measure(lambda index: None, iterations=2)
+        self.assertEqual(heavy['errors'], 0)
+        self.assertGreater(heavy['rss_delta_mb'], 8)
+        # A lighter benchmark after a heavier one does not report its peak
+        self.assertLess(light['rss_delta_mb'], 8)
+
+
+class WarmupTest(SimpleTestCase):
+    def test_run_records_every_engine(self):
+        engines = warmup.Warmup()
+        engines.register('ok', lambda: None)
+        engines.register('broken', lambda: 1 / 0)
+        notified = []
+        engines.run(['ok', 'broken', 'unregistered'], notify=lambda: notified.append(True))
+
+        self.assertEqual(engines.state, warmup.FAILED)
+        self.assertFalse(engines.is_ready())
+        self.assertEqual(engines.engines['ok']['state'], warmup.DONE)
+        self.assertEqual(engines.engines['broken']['state'], warmup.FAILED)
+        self.assertEqual(len(notified), 2)
+
+    def test_fork_during_warmup_starts_pending(self):
+        engines = warmup.Warmup()
+        started, release = threading.Event(), threading.Event()
+        engines.register('slow', lambda: (started.set(), release.wait(5)))
+        thread = threading.Thread(target=engines.run, args=(['slow'],))
+        thread.start()
+        self.assertTrue(started.wait(5))
+
+        pid = os.fork()
+        if pid == 0:
+            # The warmup thread and its lock are not in the child
+            ok = engines.state == warmup.PENDING and engines._lock.acquire(timeout=1)
+            os._exit(0 if ok else 1)
+        release.set()
+        thread.join()
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertTrue(engines.is_ready())
+
+
+class CustomError(Exception):
+    pass
+
+
+class CoalescerTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def run_duplicates(self, leader, duplicate, outcome):
+        # The leader holds its flight until the duplicate waits for it
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(threading.current_thread().name)
+            started.set()
+            release.wait(5)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        def run(coalescer):
+            try:
+                return coalescer.run('key', compute)
+            except Exception as e:
+                return e
+
+        with ThreadPoolExecutor(2) as pool:
+            leading = pool.submit(run, leader)
+            self.assertTrue(started.wait(5))
+            waiting = pool.submit(run, duplicate)
+            time.sleep(0.05)
+            release.set()
+            return leading.result(5), waiting.result(5), calls
+
+    def test_duplicates_share_one_run(self):
+        coalescer = coalescing.Coalescer('test')
+        leading, waiting, calls = self.run_duplicates(coalescer, coalescer, {'score': [1, 2]})
+        self.assertEqual(leading, waiting)
+        self.assertIsNot(leading, waiting)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(coalescer.stats()['coalesced'], 1)
+
+    def test_duplicates_share_the_error(self):
+        coalescer = coalescing.Coalescer('test')
+        leading, waiting, calls = self.run_duplicates(coalescer, coalescer, ValueError('no face'))
+        self.assertIsInstance(waiting, ValueError)
+        self.assertEqual(len(calls), 1)
+
+    def test_workers_share_results_as_json(self):
+        leader = coalescing.Coalescer('test', directory=self.directory)
+        duplicate = coalescing.Coalescer('test', directory=self.directory)
+        leading, waiting, calls = self.run_duplicates(leader, duplicate, (np.float32(0.5), True))
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(waiting, [0.5, True])
+        self.assertEqual(duplicate.stats()['shared_coalesced'], 1)
+        with open(os.path.join(self.directory, 'key.json'), encoding='utf-8') as file:
+            self.assertEqual(json.load(file), {'result': [0.5, True]})
+
+    def test_workers_share_builtin_errors(self):
+        leader = coalescing.Coalescer('test', directory=self.directory)
+        duplicate = coalescing.Coalescer('test', directory=self.directory)
+        _, waiting, calls = self.run_duplicates(leader, duplicate, ValueError('no face'))
+        self.assertEqual((type(waiting), str(waiting)), (ValueError, 'no face'))
+        self.assertEqual(len(calls), 1)
+
+    def test_other_errors_are_run_again(self):
+        leader = coalescing.Coalescer('test', directory=self.directory)
+        duplicate = coalescing.Coalescer('test', directory=self.directory)
+        _, waiting, calls = self.run_duplicates(leader, duplicate, CustomError('failed'))
+        self.assertIsInstance(waiting, CustomError)
+        self.assertEqual(len(calls), 2)
+
+    def test_old_files_are_swept(self):
+        written_at = time.time() - coalescing.RESULT_LIFETIME - 1
+        for name in ['old.json', 'old.tmp', 'idle.lock', 'held.lock', 'new.json']:
+            with open(os.path.join(self.directory, name), 'w'):
+                pass
+            if name != 'new.json':
+                os.utime(os.path.join(self.directory, name), (written_at, written_at))
+
+        with open(os.path.join(self.directory, 'held.lock'), 'a') as held:
+            fcntl.flock(held, fcntl.LOCK_EX)
+            # The first leader of a worker sweeps the directory
+            coalescing.Coalescer('test', directory=self.directory).run('key', lambda: 1)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['held.lock', 'key.json', 'key.lock', 'new.json'])
+
+    def test_failed_result_writes_are_not_shared(self):
+        coalescer = coalescing.Coalescer('test', directory=self.directory)
+        full = OSError(errno.ENOSPC, 'No space left on device')
+        with mock.patch.object(coalescing.tempfile, 'mkstemp', side_effect=full):
+            self.assertEqual(coalescer.run('key', lambda: 7), 7)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'key.json')))
+
+    def test_key(self):
+        key = coalescing.key('fsim:verify', '1', 7, b'probe')
+        self.assertEqual(coalescing.key('fsim:verify', '1', 7, b'probe'), key)
+        self.assertNotEqual(coalescing.key('fsim:verify', '1', 8, b'probe'), key)
+        self.assertNotEqual(coalescing.key('fsim:verify', '1', 7, b'other'), key)
+
+
+class EmbeddingCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def embedding(self, value):
+        # 64 bytes
+        return np.full(16, value, dtype=np.float32)
+
+    def test_lru_is_bounded_in_bytes(self):
+        cache = embedding_cache.EmbeddingCache('test', max_bytes=128)
+        cache.set('a', self.embedding(1))
+        cache.set('b', self.embedding(2))
+        # 'a' becomes the most recently used, so 'b' is evicted
+        np.testing.assert_array_equal(cache.get('a'), self.embedding(1))
+        cache.set('c', self.embedding(3))
+
+        self.assertIsNone(cache.get('b'))
+        self.assertIsNotNone(cache.get('c'))
+        stats = cache.stats()
+        self.assertEqual((stats['entries'], stats['bytes'], stats['evictions']), (2, 128, 1))
+
+    def test_replacing_an_entry_counts_its_bytes_once(self):
+        cache = embedding_cache.EmbeddingCache('test', max_bytes=128)
+        cache.set('a', self.embedding(1))
+        cache.set('a', self.embedding(2))
+        self.assertEqual(cache.stats()['bytes'], 64)
+        np.testing.assert_array_equal(cache.get('a'), self.embedding(2))
+
+    def test_oversized_embeddings_are_not_kept_in_memory(self):
+        cache = embedding_cache.EmbeddingCache('test', max_bytes=32)
+        cache.set('a', self.embedding(1))
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertIsNone(cache.get('a'))
+
+    def test_cached_embeddings_are_read_only(self):
+        cache = embedding_cache.EmbeddingCache('test')
+        cache.set('a', self.embedding(1))
+        with self.assertRaises(ValueError):
+            cache.get('a')[0] = 0
+
+    def test_failed_shared_writes_are_counted(self):
+        cache = embedding_cache.EmbeddingCache('test', shared_directory=self.directory)
+        full = OSError(errno.ENOSPC, 'No space left on device')
+        with mock.patch.object(embedding_cache.tempfile, 'mkstemp', side_effect=full):
+            cache.set('a', self.embedding(1))
+        # Still served from memory
+        np.testing.assert_array_equal(cache.get('a'), self.embedding(1))
+        self.assertEqual(cache.stats()['write_errors'], 1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_shared_directory_serves_other_workers(self):
+        embedding_cache.EmbeddingCache('test', shared_directory=self.directory).set('a', self.embedding(1))
+        other = embedding_cache.EmbeddingCache('test', shared_directory=self.directory)
+        np.testing.assert_array_equal(other.get('a'), self.embedding(1))
+        self.assertEqual(other.stats()['shared_hits'], 1)
+        # Now served from memory
+        other.get('a')
+        self.assertEqual(other.stats()['hits'], 1)
+
+    def test_trim_removes_least_recently_used_files(self):
+        cache = embedding_cache.EmbeddingCache('test', shared_directory=self.directory)
+        for index, key in enumerate(['old', 'used', 'new']):
+            cache.set(key, self.embedding(index))
+            written_at = time.time() - 100 + index
+            os.utime(cache._path(key), (written_at, written_at))
+        file_size = os.path.getsize(cache._path('old'))
+
+        # Reading an entry refreshes its mtime, so it outlives older writes
+        embedding_cache.EmbeddingCache('test', shared_directory=self.directory).get('used')
+        cache.shared_max_bytes = 2 * file_size
+        cache._trim()
+        self.assertEqual(sorted(os.listdir(self.directory)), ['new.npy', 'used.npy'])
+
+    def test_trim_runs_every_trim_interval_writes(self):
+        cache = embedding_cache.EmbeddingCache('test', shared_directory=self.directory, shared_max_bytes=0)
+        for index in range(embedding_cache.TRIM_INTERVAL - 1):
+            cache.set(str(index), self.embedding(index))
+        self.assertEqual(len(os.listdir(self.directory)), embedding_cache.TRIM_INTERVAL - 1)
+        cache.set('last', self.embedding(0))
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+class ResultCacheTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def test_disk_tier_stores_json(self):
+        cache = result_cache.ResultCache('test', directory=self.directory)
+        cache.set('ab12', {'nik': '3171234567890001', 'all_text': ['NIK']})
+        with open(cache._path('ab12'), encoding='utf-8') as file:
+            self.assertIn('3171234567890001', file.read())
+
+        # Another worker reads it from disk
+        other = result_cache.ResultCache('test', directory=self.directory)
+        self.assertEqual(other.get('ab12'), (True, {'nik': '3171234567890001', 'all_text': ['NIK']}))
+        self.assertEqual(other.stats()['disk_hits'], 1)
+
+    def test_unreadable_entries_miss(self):
+        cache = result_cache.ResultCache('test', directory=self.directory)
+        os.makedirs(os.path.dirname(cache._path('ab12')))
+        with open(cache._path('ab12'), 'wb') as file:
+            file.write(b'\x80\x04not json')
+        self.assertEqual(cache.get('ab12'), (False, None))
+
+    def test_entries_expire(self):
+        cache = result_cache.ResultCache('test', directory=self.directory, ttl=60)
+        cache.set('ab12', 'value')
+        self.assertEqual(cache.get('ab12'), (True, 'value'))
+
+        written_at = time.time() - 120
+        os.utime(cache._path('ab12'), (written_at, written_at))
+        cache._entries['ab12'] = (written_at, 'value')
+        self.assertEqual(cache.get('ab12'), (False, None))
+        self.assertFalse(os.path.exists(cache._path('ab12')))
+
+    def test_purge_deletes_expired_entries(self):
+        cache = result_cache.ResultCache('test', directory=self.directory, ttl=60)
+        cache.set('ab12', 'old')
+        cache.set('cd34', 'new')
+        written_at = time.time() - 120
+        os.utime(cache._path('ab12'), (written_at, written_at))
+
+        self.assertEqual(cache.purge(), 1)
+        self.assertFalse(os.path.exists(cache._path('ab12')))
+        self.assertTrue(os.path.exists(cache._path('cd34')))
+
+    def test_cards_differing_by_one_pixel_have_their_own_keys(self):
+        cache = result_cache.ResultCache('test')
+        card = np.full((8, 16, 3), 200, dtype=np.uint8)
+        other = card.copy()
+        other[4, 8] = 199
+        self.assertNotEqual(cache.key(card, 'v1'), cache.key(other, 'v1'))
+        self.assertEqual(cache.key(card, 'v1'), cache.key(card.copy(), 'v1'))
+
+    def test_failed_disk_writes_are_counted(self):
+        cache = result_cache.ResultCache('test', directory=self.directory)
+        with mock.patch.object(result_cache.os, 'replace', side_effect=PermissionError('read-only')):
+            cache.set('ab12', 'value')
+        self.assertEqual(cache.get('ab12'), (True, 'value'))
+        self.assertEqual(cache.stats()['write_errors'], 1)
+        self.assertEqual(os.listdir(os.path.dirname(cache._path('ab12'))), [])
+
+    def test_memory_only_by_default(self):
+        cache = result_cache.ResultCache('test', max_entries=2)
+        for key in ['a', 'b', 'c']:
+            cache.set(key, key)
+        self.assertEqual(cache.get('a'), (False, None))
+        self.assertEqual(cache.get('c'), (True, 'c'))
+        self.assertEqual(result_cache.DEFAULT_OPTIONS['DIRECTORY'], None)
+
+
+@override_settings(ROOT_URLCONF='image_project.tests')
+class JobsTest(TestCase):
+    def submit(self, query_string=''):
+        return jobs.submit('echo', '/echo/', 'testserver', 'application/x-www-form-urlencoded',
+                           b'name=budi', query_string=query_string)
+
+    def expire(self, job):
+        Job.objects.filter(id=job.id).update(started_at=timezone.now() - timedelta(hours=1))
+
+    def test_claim_oldest_job_once(self):
+        first, second = self.submit(), self.submit()
+        self.assertEqual(jobs.claim('a').id, first.id)
+        claimed = jobs.claim('b')
+        self.assertEqual((claimed.id, claimed.attempts, claimed.worker), (second.id, 1, 'b'))
+        self.assertIsNone(jobs.claim('c'))
+
+    def test_requeued_attempt_does_not_overwrite_the_next(self):
+        self.submit()
+        lost = jobs.claim('a')
+        self.expire(lost)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        retried = jobs.claim('b')
+        self.assertEqual(retried.attempts, 2)
+
+        self.assertTrue(jobs.finish(retried, Job.DONE, response_status=200, response='retried'))
+        # The first worker ends after the retry and its outcome is dropped
+        self.assertFalse(jobs.finish(lost, Job.DONE, response_status=200, response='lost'))
+        self.assertEqual(Job.objects.get(id=lost.id).response, 'retried')
+
+    @override_settings(ASYNC_JOBS={'MAX_ATTEMPTS': 1})
+    def test_stale_job_fails_after_max_attempts(self):
+        self.submit()
+        job = jobs.claim('a')
+        self.expire(job)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.FAILED)
+
+    def test_replay_restores_the_query_string(self):
+        self.submit(query_string='async=1&mode=fast')
+        job = jobs.claim('a')
+        response_status, response = jobs.replay(job)
+        self.assertEqual(response_status, 200)
+        self.assertEqual(json.loads(response), {'query': {'async': '1', 'mode': 'fast'}, 'fields': {'name': 'budi'}})
+
+    @override_settings(ASYNC_JOBS={'RETENTION': 60})
+    def test_purge_finished_jobs(self):
+        self.submit()
+        old = jobs.claim('a')
+        jobs.finish(old, Job.DONE, response_status=200, response='{}')
+        Job.objects.filter(id=old.id).update(finished_at=timezone.now() - timedelta(minutes=2))
+        recent = self.submit()
+        jobs.finish(jobs.claim('a'), Job.DONE, response_status=200, response='{}')
+        queued = self.submit()
+
+        self.assertEqual(jobs.purge_finished(), 1)
+        self.assertEqual(set(Job.objects.values_list('id', flat=True)), {recent.id, queued.id})
+
+    @override_settings(ASYNC_JOBS={'ENDPOINTS': ['echo']})
+    def test_middleware_queues_and_worker_replays(self):
+        response = self.client.post('/echo/?async=1&mode=fast', {'name': 'budi'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['result']['id']
+        self.assertTrue(response['Location'].endswith(f'/jobs/{job_id}/'))
+
+        jobs.run(jobs.claim('a'))
+        result = self.client.get(f'/jobs/{job_id}/').json()['result']
+        self.assertEqual(result['status'], Job.DONE)
+        self.assertEqual(result['result'], {'query': {'async': '1', 'mode': 'fast'}, 'fields': {'name': 'budi'}})
+        self.assertEqual(Job.objects.get(id=job_id).body, b'')
+
+    @override_settings(ASYNC_JOBS={'ENDPOINTS': []})
+    def test_middleware_refuses_other_endpoints(self):
+        response = self.client.post('/echo/', {'name': 'budi'}, headers={'Prefer': 'respond-async'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Job.objects.exists())
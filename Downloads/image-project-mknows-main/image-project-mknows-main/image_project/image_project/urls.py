@@ -18,6 +18,8 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from .views import (AdmissionStats, BatchingStats, CoalescingStats, EmbeddingCacheStats, ExecutorStats, Health,
+                    JobStatus, Metrics, Readiness, ResultCacheStats, WorkerMemory)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,6 +27,17 @@ urlpatterns = [
     path('ssim/', include(('ssim.urls', 'ssim'), namespace='ssim')),
     path('sfd/', include(('sfd.urls', 'sfd'), namespace='sfd')),
     path('ocr/', include(('ocr.urls', 'ocr'), namespace='ocr')),
+    path('admission/stats/', AdmissionStats.as_view(), name='admission_stats'),
+    path('batching/stats/', BatchingStats.as_view(), name='batching_stats'),
+    path('executors/stats/', ExecutorStats.as_view(), name='executor_stats'),
+    path('cache/stats/', ResultCacheStats.as_view(), name='result_cache_stats'),
+    path('cache/embeddings/stats/', EmbeddingCacheStats.as_view(), name='embedding_cache_stats'),
+    path('coalescing/stats/', CoalescingStats.as_view(), name='coalescing_stats'),
+    path('metrics/', Metrics.as_view(), name='metrics'),
+    path('jobs/<uuid:job_id>/', JobStatus.as_view(), name='job_status'),
+    path('ready/', Readiness.as_view(), name='ready'),
+    path('health/', Health.as_view(), name='health'),
+    path('memory/', WorkerMemory.as_view(), name='worker_memory'),
 ]
 
 if settings.DEBUG:
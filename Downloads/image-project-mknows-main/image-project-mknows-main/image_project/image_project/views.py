@@ -0,0 +1,295 @@
+"""
+Module: views.py
+
+This module contains project-level views for operating the inference endpoints.
+"""
+from django.http import HttpResponse, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
+from rest_framework.response import Response
+from rest_framework import status
+from .libraries import (admission, batching, coalescing, embedding_cache, executors, jobs, result_cache,
+                        thread_budget, timing)
+from .models import Job
+from .libraries.memory import process_memory
+from .libraries.registry import registry
+from .libraries.warmup import warmup
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """
+    Base class of the native async inference views.
+
+    Subclasses define ``async def post``. Uploads are parsed and validated on the
+    event loop, and the blocking feature call is awaited in the executor of its engine
+    (see libraries.executors). Like the DRF views, these views are exempt from CSRF.
+    """
+
+    http_method_names = ['post', 'options']
+
+    @staticmethod
+    def request_data(request):
+        """
+        Merge the form fields and the uploaded files of a request for a serializer.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - QueryDict: The fields and files, like the DRF request.data of a multipart request.
+        """
+        data = request.POST.copy()
+        data.update(request.FILES)
+        return data
+
+    @staticmethod
+    def respond(data, status_code=status.HTTP_200_OK):
+        """
+        Build a JSON response, encoding data the same way DRF does.
+
+        Parameters:
+        - data: The response data.
+        - status_code: The HTTP status code.
+
+        Returns:
+        - JsonResponse: The response.
+        """
+        return JsonResponse(data, status=status_code, encoder=JSONEncoder, safe=False)
+
+
+class AdmissionStats(APIView):
+    """
+    API view exposing the queue depth, shed count and wait times of admission control.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the admission statistics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The statistics of this worker keyed by engine name.
+        """
+        return Response(build_result(admission.stats()), status=status.HTTP_200_OK)
+
+
+class BatchingStats(APIView):
+    """
+    API view exposing the micro-batching queue depth and batch size histograms.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the batching statistics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The statistics keyed by model name.
+        """
+        return Response(build_result(batching.stats()), status=status.HTTP_200_OK)
+
+
+class ResultCacheStats(APIView):
+    """
+    API view exposing the hit and miss counters of the result caches.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the result cache statistics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The statistics of this worker keyed by cache name.
+        """
+        return Response(build_result(result_cache.stats()), status=status.HTTP_200_OK)
+
+
+class CoalescingStats(APIView):
+    """
+    API view exposing the counters of the request coalescing.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the coalescing statistics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The statistics of this worker keyed by engine name.
+        """
+        return Response(build_result(coalescing.stats()), status=status.HTTP_200_OK)
+
+
+class EmbeddingCacheStats(APIView):
+    """
+    API view exposing the size and hit rate of the probe embedding caches.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the embedding cache statistics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The statistics of this worker keyed by cache name.
+        """
+        return Response(build_result(embedding_cache.stats()), status=status.HTTP_200_OK)
+
+
+class Metrics(View):
+    """
+    View exposing the request, stage and inference metrics in the Prometheus text format.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the metrics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - HttpResponse: The histograms and counters of this worker.
+        """
+        return HttpResponse(timing.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+class JobStatus(APIView):
+    """
+    API view exposing the status and result of an async job.
+    """
+
+    def get(self, request, job_id):
+        """
+        Handle the GET request for the status of a job.
+
+        Parameters:
+        - request: The HTTP request object.
+        - job_id: The id returned when the job was submitted.
+
+        Returns:
+        - Response: The job status and, once done, the response of its endpoint.
+        """
+        try:
+            job = Job.objects.get(id=job_id)
+        except Job.DoesNotExist:
+            return Response({'status': 404, 'message': 'Job not found', 'result': None},
+                            status=status.HTTP_404_NOT_FOUND)
+        return Response(build_result(jobs.describe(job)), status=status.HTTP_200_OK)
+
+
+class ExecutorStats(APIView):
+    """
+    API view exposing the load of the inference executors of the async views.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the executor statistics.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The statistics of this worker keyed by engine name.
+        """
+        return Response(build_result(executors.stats()), status=status.HTTP_200_OK)
+
+
+class Readiness(APIView):
+    """
+    API view telling the load balancer whether this worker can take traffic.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the readiness.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: 200 once the preloaded engines of this worker are warmed up, 503
+          before or if it failed.
+        """
+        result = {'ready': warmup.is_ready(), 'warmup': warmup.state}
+        if result['ready']:
+            return Response(build_result(result), status=status.HTTP_200_OK)
+        return Response({'status': 503, 'message': 'not ready', 'result': result},
+                        status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+class Health(APIView):
+    """
+    API view reporting the models, the warmup and the memory of this worker.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the health report.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The load state of every engine, the warmup timings, the memory use
+          and the thread budget.
+        """
+        result = {
+            'ready': warmup.is_ready(),
+            'models': registry.stats(),
+            'warmup': warmup.stats(),
+            'memory': process_memory(),
+            'threads': thread_budget.effective(),
+        }
+        return Response(build_result(result), status=status.HTTP_200_OK)
+
+
+class WorkerMemory(APIView):
+    """
+    API view exposing the memory use of the worker serving the request.
+    """
+
+    def get(self, request):
+        """
+        Handle the GET request for the worker memory.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - Response: The worker pid and its RSS, PSS, shared and private memory in kB.
+        """
+        return Response(build_result(process_memory()), status=status.HTTP_200_OK)
+
+
+def build_result(result):
+    """
+    Build the result dictionary.
+
+    Parameters:
+    - result (dict): The result dictionary.
+
+    Returns:
+    - dict: The formatted result.
+    """
+    return {
+        "status": 200,
+        "message": "success",
+        "result": result
+    }
@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_project.settings')
 
 application = get_wsgi_application()
+
+# Only server processes preload and warm up models; management commands load them
+# lazily. The gunicorn config loads them in each worker after forking instead
+if os.environ.get('SERVER_PREFORK') != '1':
+    from image_project.libraries.warmup import boot
+
+    boot()
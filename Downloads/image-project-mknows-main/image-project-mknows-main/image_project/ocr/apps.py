@@ -1,13 +1,42 @@
-from pathlib import Path
-import os
-
 from django.apps import AppConfig
-from paddleocr import PaddleOCR
+from django.conf import settings
 
 
 
 class OcrConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ocr'
-    
-    ocr_model = PaddleOCR(lang='en')
+    model_version = 'paddleocr-2.7-en'
+
+    def ready(self):
+        from image_project.libraries.registry import registry
+        from image_project.libraries.warmup import warmup
+
+        # One PaddleOCR per profile, constructed on first use, or at server start if preloaded.
+        # 'ocr' is the default profile of the deployment
+        for profile in settings.OCR_PROFILES:
+            registry.register(f'ocr:{profile}', lambda profile=profile: self.load_model(profile))
+        registry.register('ocr', lambda: registry.get(f'ocr:{settings.OCR_DEFAULT_PROFILE}'))
+        warmup.register('ocr', self.warm_up)
+
+    def load_model(self, profile):
+        from paddleocr import PaddleOCR
+        from image_project.libraries import thread_budget
+
+        options = settings.OCR_PROFILES[profile]
+        # The angle classifier is always loaded: the field-selective mode uses it to turn
+        # upside-down cards upright. USE_ANGLE_CLS only chooses whether recognized lines
+        # are classified too, per call
+        return PaddleOCR(
+            lang='en',
+            det_limit_side_len=options['DET_LIMIT_SIDE_LEN'],
+            use_angle_cls=True,
+            rec_batch_num=options['REC_BATCH_NUM'],
+            cpu_threads=thread_budget.paddle_threads(options['CPU_THREADS']),
+            enable_mkldnn=options['ENABLE_MKLDNN'],
+        )
+
+    def warm_up(self):
+        from .function import feature
+
+        feature.warmup()
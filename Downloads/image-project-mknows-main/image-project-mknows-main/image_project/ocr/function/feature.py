@@ -4,28 +4,178 @@ Module: feature.py
 This module contains functions for extracting information from KTP (Kartu Tanda Penduduk) using OCR.
 
 Functions:
-- ktp_ocr(data): Perform OCR on KTP data and extract relevant information.
+- ktp_ocr(data, profile, fields, bypass_cache): Perform OCR on KTP data and extract relevant
+  information, serving resubmitted images from the result cache.
+- ktp_ocr_batch(images, profile, fields, bypass_cache): Perform OCR on a batch of KTP images
+  with recognition batched across the cards.
+- read_ktp(data, profile, fields): Run OCR on the KTP and parse the fields.
+- cache_key(cache, data, profile, fields): Build the result cache key of a KTP image.
+- parse_ktp(ocr_reader): Parse the NIK, name and address from a full-card OCR result.
+- ktp_ocr_fields(data, fields, profile): Recognize only the requested fields of a KTP.
+- normalize_card(data, profile): Locate, warp and orient a KTP for the field-selective OCR.
+- classify_orientation(card, profile): Classify the orientation of the text lines of a card.
+- run_ocr(image, profile): Run PaddleOCR on an image, in this process or in the inference server.
+- run_ocr_batch(images, profile): Run PaddleOCR on several images, batching text recognition.
+- model_lock(profile): Return the lock serializing the PaddleOCR calls of a profile.
+- warmup(): Run OCR on a synthetic card with every loaded profile.
 """
 import re
-from ..apps import OcrConfig
-from ..libraries import utils
+import threading
+import cv2
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from image_project.libraries import coalescing, inference_service, timing
+from image_project.libraries.result_cache import get_cache
+from image_project.libraries.registry import registry
+from ..libraries import layout
 
+# Recognized lines below this confidence are dropped, as PaddleOCR does by default
+DROP_SCORE = 0.5
 
-def ktp_ocr(data):
+# Number of text lines, the widest of the card, whose orientation is classified
+ORIENTATION_LINES = 6
+
+# PaddleOCR predictors are not thread-safe, so the calls on the engine of a profile
+# are serialized, as the ssim TFLite interpreter is
+_model_locks = {}
+_model_locks_lock = threading.Lock()
+
+
+def ktp_ocr(data, profile=None, fields=None, bypass_cache=False):
     """
     Perform OCR on KTP data.
 
+    Results are cached by the content of the decoded image, the OCR model version,
+    the options of the profile and the fields, so a resubmitted card skips OCR entirely. Identical
+    cards submitted while their OCR is running wait for it instead of running their own.
+
     Args:
-        data (str): The input data for OCR.
+        data (numpy.ndarray): The decoded BGR KTP image.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+        fields (list): The fields to extract, or None for the whole card.
+        bypass_cache (bool): Whether to run OCR even if the result is cached.
+
+    Returns:
+        dict: The extracted information, see read_ktp.
+    """
+    profile = profile or settings.OCR_DEFAULT_PROFILE
+    fields = sorted(fields) if fields else None
+    cache = get_cache('ocr')
+    key = cache_key(cache, data, profile, fields)
+    # On a miss, identical requests in flight (retries, double submits) share one OCR run
+    return cache.get_or_compute(
+        key, lambda: coalescing.run('ocr', key, lambda: read_ktp(data, profile, fields)), bypass=bypass_cache)
+
+
+def read_ktp(data, profile=None, fields=None):
+    """
+    Run OCR on KTP data and parse the fields.
+
+    Args:
+        data (numpy.ndarray): The decoded BGR KTP image.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+        fields (list): The fields to extract. When given, only their regions of the
+        card are recognized (see ktp_ocr_fields); otherwise the whole card is read.
 
     Returns:
         dict: A dictionary containing extracted information, including all text,
-        NIK, name, and address.
+        NIK, name, and address, or only the requested fields.
+    """
+    if fields:
+        return ktp_ocr_fields(data, fields, profile)
+    return parse_ktp(run_ocr(data, profile))
+
+
+def ktp_ocr_batch(images, profile=None, fields=None, bypass_cache=False):
+    """
+    Perform OCR on a batch of KTP images.
+
+    Cached cards are served from the result cache. Text detection runs per card, then
+    the text lines of all the other cards are recognized in shared batches.
+
+    Args:
+        images (list): The decoded BGR KTP images.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+        fields (list): The fields to extract, or None for the whole card.
+        bypass_cache (bool): Whether to run OCR even if the results are cached.
+
+    Returns:
+        list: The extracted information of each card, see read_ktp, or the exception
+        raised while parsing it.
+    """
+    profile = profile or settings.OCR_DEFAULT_PROFILE
+    fields = sorted(fields) if fields else None
+    cache = get_cache('ocr')
+
+    results = [None] * len(images)
+    keys = [cache_key(cache, image, profile, fields) for image in images]
+    pending = []
+    for index, key in enumerate(keys):
+        found, value = cache.lookup(key, bypass_cache)
+        if found:
+            results[index] = value
+        else:
+            pending.append(index)
+    if not pending:
+        return results
+
+    if fields:
+        # Every field region of every card is one image of the OCR batch
+        cards = [normalize_card(images[index], profile) for index in pending]
+        ocr_results = run_ocr_batch(
+            [layout.crop_field(card, field) for card in cards for field in fields], profile)
+        ocr_results = [ocr_results[i:i + len(fields)] for i in range(0, len(ocr_results), len(fields))]
+    else:
+        ocr_results = run_ocr_batch([images[index] for index in pending], profile)
+
+    for index, ocr_result in zip(pending, ocr_results):
+        try:
+            if fields:
+                value = {field: layout.parse_field(field, result) for field, result in zip(fields, ocr_result)}
+            else:
+                value = parse_ktp(ocr_result)
+        except Exception as e:
+            results[index] = e
+            continue
+        cache.set(keys[index], value)
+        results[index] = value
+    return results
+
+
+def cache_key(cache, data, profile, fields):
+    """
+    Build the result cache key of a KTP image.
+
+    The key holds the resolved options of the profile rather than its name, so
+    retuning a profile does not serve the results of its previous options.
+
+    Args:
+        cache (ResultCache): The OCR result cache.
+        data (numpy.ndarray): The decoded BGR KTP image.
+        profile (str): The OCR engine profile.
+        fields (list): The sorted fields to extract, or None for the whole card.
+
+    Returns:
+        str: The cache key.
     """
+    options = sorted(settings.OCR_PROFILES[profile].items())
+    return cache.key(data, apps.get_app_config('ocr').model_version, options, fields)
 
-    ktp_ocr_model = OcrConfig.ocr_model
-    ocr_reader = ktp_ocr_model.ocr(data)
-    utils.delete_uploaded_image(data)
+
+def parse_ktp(ocr_reader):
+    """
+    Parse the NIK, name and address from the PaddleOCR result of a whole KTP.
+
+    Args:
+        ocr_reader (list): The PaddleOCR result, one list of (box, (text, score)) per page.
+
+    Returns:
+        dict: A dictionary containing all text, NIK, name, and address.
+
+    Raises:
+        ValueError: When the NIK, the name or the address cannot be found on the card.
+    """
     # List untuk menyimpan teks
     texts = []
     for sentences in ocr_reader:
@@ -40,10 +190,11 @@ def ktp_ocr(data):
     # Mencari indeks di mana "nama" muncul
     nama_indices = [i for i, item in enumerate(texts_list) if "nama" in item.lower()]
 
+    nama = None
     for i in nama_indices:
         if i + 1 < len(texts_list) and "/" not in texts_list[i + 1]:
             nama = texts_list[i + 1]
-        else:
+        elif i + 2 < len(texts_list):
             nama = texts_list[i + 2]
 
     # Mencari indeks di mana "nama" muncul
@@ -53,6 +204,7 @@ def ktp_ocr(data):
         if ("alamat" in item.lower()) or ("alamal" in item.lower())
     ]
 
+    alamat = None
     for i in alamat_indices:
         if (
             i + 1 < len(texts_list) and
@@ -68,11 +220,18 @@ def ktp_ocr(data):
             alamat = texts_list[i + 2]
 
         if (
+            alamat is not None and
             i + 3 < len(texts_list) and
             "rt" not in texts_list[i + 3].lower() and
             "rw" not in texts_list[i + 3].lower()
         ):
             alamat += " " + texts_list[i + 3]
+
+    missing = [
+        field for field, value in (("NIK", nik), ("nama", nama), ("alamat", alamat)) if not value
+    ]
+    if missing:
+        raise ValueError(f"Could not find {', '.join(missing)} on the KTP")
     data = {
         "all_text" : texts_list,
         "nik": nik[0],
@@ -80,3 +239,202 @@ def ktp_ocr(data):
         "alamat": alamat
     }
     return data
+
+
+def ktp_ocr_fields(data, fields, profile=None):
+    """
+    Perform layout-aware OCR on the requested fields of a KTP.
+
+    The card is located and warped to a fixed geometry, then detection and
+    recognition only run on the regions of the requested fields.
+
+    Args:
+        data (numpy.ndarray): The decoded BGR KTP image.
+        fields (list): The fields to extract, among layout.FIELD_REGIONS.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+
+    Returns:
+        dict: The value of each requested field, None when it could not be read.
+    """
+    card = normalize_card(data, profile)
+    return {
+        field: layout.parse_field(field, run_ocr(layout.crop_field(card, field), profile))
+        for field in fields
+    }
+
+
+def normalize_card(data, profile=None):
+    """
+    Locate a KTP in a photo, warp it to the normalized card size, and turn it upright.
+
+    The outline of the card does not tell an upright card from an upside-down one, so
+    the orientation of its text lines is classified, and the card is turned a half
+    turn when most of them are upside down.
+
+    Args:
+        data (numpy.ndarray): The decoded BGR KTP image.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+
+    Returns:
+        numpy.ndarray: The upright card, see layout.normalize_card.
+    """
+    with timing.stage('preprocess'):
+        card = layout.normalize_card(data)
+    if layout.is_upside_down(classify_orientation(card, profile)):
+        card = layout.rotate_half_turn(card)
+    return card
+
+
+def classify_orientation(card, profile=None):
+    """
+    Classify the orientation of the widest text lines of a card with the angle classifier.
+
+    Args:
+        card (numpy.ndarray): The normalized card.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+
+    Returns:
+        list: The (label, score) of each line, the label being '0' or '180'; empty
+        when no text is detected.
+    """
+    profile = profile or settings.OCR_DEFAULT_PROFILE
+    if inference_service.is_remote('ocr'):
+        return inference_service.call('ocr', 'classify_orientation', card, profile)
+
+    ktp_ocr_model = registry.get(f'ocr:{profile}')
+    with timing.stage('inference', model='ocr'), model_lock(profile):
+        detected = ktp_ocr_model.ocr(card, rec=False, cls=False)[0] or []
+    boxes = sorted(detected, key=lambda box: np.ptp(np.asarray(box)[:, 0]), reverse=True)[:ORIENTATION_LINES]
+    if not boxes:
+        return []
+
+    lines = [layout.crop_box(card, box) for box in boxes]
+    with timing.stage('inference', model='ocr'), model_lock(profile):
+        return [tuple(result) for result in ktp_ocr_model.ocr([lines], det=False, rec=False, cls=True)[0]]
+
+
+def run_ocr(image, profile=None):
+    """
+    Run PaddleOCR on an image with an engine profile.
+
+    Args:
+        image (str or numpy.ndarray): The image path, or the decoded BGR image.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+
+    Returns:
+        list: The PaddleOCR result, one list of (box, (text, score)) per page.
+    """
+    profile = profile or settings.OCR_DEFAULT_PROFILE
+    if isinstance(image, str):
+        # Decoded the same way PaddleOCR decodes paths
+        image = cv2.imread(image)
+
+    if inference_service.is_remote('ocr'):
+        return inference_service.call('ocr', 'run_ocr', image, profile)
+
+    options = settings.OCR_PROFILES[profile]
+    with timing.stage('preprocess'):
+        image = limit_side(image, options['MAX_SIDE'])
+    ktp_ocr_model = registry.get(f'ocr:{profile}')
+    with timing.stage('inference', model='ocr'), model_lock(profile):
+        return ktp_ocr_model.ocr(image, cls=options['USE_ANGLE_CLS'])
+
+
+def run_ocr_batch(images, profile=None):
+    """
+    Run PaddleOCR on several images, recognizing the text lines of all of them together.
+
+    Text detection runs on each image, then every detected line is recognized in
+    batches of REC_BATCH_NUM lines regardless of the image it comes from. Lines are
+    ordered and filtered as in a single-image PaddleOCR call.
+
+    Args:
+        images (list): The decoded BGR images.
+        profile (str): The OCR engine profile, defaults to OCR_DEFAULT_PROFILE.
+
+    Returns:
+        list: The PaddleOCR result of each image, one list of (box, (text, score)) per page.
+    """
+    profile = profile or settings.OCR_DEFAULT_PROFILE
+    if inference_service.is_remote('ocr'):
+        return inference_service.call('ocr', 'run_ocr_batch', list(images), profile)
+
+    options = settings.OCR_PROFILES[profile]
+    ktp_ocr_model = registry.get(f'ocr:{profile}')
+
+    image_boxes = []
+    lines = []
+    for image in images:
+        with timing.stage('preprocess'):
+            image = limit_side(image, options['MAX_SIDE'])
+        with timing.stage('inference', model='ocr'), model_lock(profile):
+            detected = ktp_ocr_model.ocr(image, rec=False, cls=False)[0]
+        boxes = layout.sort_boxes(detected or [])
+        image_boxes.append(boxes)
+        lines.extend(layout.crop_box(image, box) for box in boxes)
+
+    # A single page holding every line, so the recognizer batches across images
+    recognized = []
+    if lines:
+        with timing.stage('inference', model='ocr'), model_lock(profile):
+            recognized = ktp_ocr_model.ocr([lines], det=False, cls=options['USE_ANGLE_CLS'])[0]
+
+    results = []
+    start = 0
+    for boxes in image_boxes:
+        texts = recognized[start:start + len(boxes)]
+        start += len(boxes)
+        results.append([[
+            [box, (text, score)] for box, (text, score) in zip(boxes, texts) if score >= DROP_SCORE
+        ]])
+    return results
+
+
+def model_lock(profile):
+    """
+    Return the lock serializing the PaddleOCR calls of an engine profile.
+
+    Args:
+        profile (str): The OCR engine profile.
+
+    Returns:
+        threading.Lock: The lock of the profile, created on first use.
+    """
+    with _model_locks_lock:
+        return _model_locks.setdefault(profile, threading.Lock())
+
+
+def warmup():
+    """
+    Run OCR on a synthetic card with every loaded profile.
+
+    PaddleOCR creates its predictors on the first call; running it at boot keeps
+    that cost out of the first request.
+    """
+    card = np.full((layout.CARD_HEIGHT, layout.CARD_WIDTH, 3), 230, dtype=np.uint8)
+    for row, text in enumerate(['NIK : 3171234567890001', 'Nama : BUDI SANTOSO', 'Alamat : JL MERDEKA 1']):
+        cv2.putText(card, text, (40, 120 + 70 * row), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (20, 20, 20), 2)
+
+    profiles = {settings.OCR_DEFAULT_PROFILE}
+    profiles.update(profile for profile in settings.OCR_PROFILES if registry.is_loaded(f'ocr:{profile}'))
+    for profile in sorted(profiles):
+        run_ocr(card, profile)
+
+
+def limit_side(image, max_side):
+    """
+    Downscale an image so that its longer side is at most max_side.
+
+    Args:
+        image (numpy.ndarray): The decoded image.
+        max_side (int): The maximum length of the longer side, or None for no limit.
+
+    Returns:
+        numpy.ndarray: The image, downscaled with area interpolation if it was larger.
+    """
+    height, width = image.shape[:2]
+    if not max_side or max(height, width) <= max_side:
+        return image
+
+    scale = max_side / max(height, width)
+    return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_AREA)
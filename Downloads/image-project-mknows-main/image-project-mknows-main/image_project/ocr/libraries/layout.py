@@ -0,0 +1,278 @@
+"""
+Module: layout.py
+
+This module contains the KTP card layout used by the field-selective OCR mode.
+
+The card is located in the photo and warped to a fixed size, so every field sits
+in a known region. Only the regions of the requested fields are then recognized,
+and their values are read from the box coordinates returned by PaddleOCR.
+
+The outline of a card does not tell which way up it is: the warped card may be
+upside down. Its orientation is read from its text by the angle classifier (see
+ocr.function.feature.normalize_card), and the card is turned with rotate_half_turn.
+"""
+import re
+
+import cv2
+import numpy as np
+
+# Size of the normalized card, with the ID-1 aspect ratio (85.6 x 54 mm)
+CARD_WIDTH = 1000
+CARD_HEIGHT = 630
+
+# Field regions as (left, top, right, bottom) fractions of the normalized card.
+# Each region includes the field label, which anchors the value horizontally
+FIELD_REGIONS = {
+    'nik': (0.0, 0.14, 0.75, 0.27),
+    'nama': (0.0, 0.26, 0.72, 0.34),
+    'alamat': (0.0, 0.41, 0.72, 0.58),
+}
+
+FIELD_LABELS = {
+    'nik': ('nik',),
+    'nama': ('nama',),
+    'alamat': ('alamat', 'alamal'),
+}
+
+# Labels of the rows that follow a field and end its value
+STOP_LABELS = {
+    'alamat': ('rt', 'rw', 'kel', 'desa'),
+}
+
+# The located card must cover at least this fraction of the photo
+MIN_CARD_AREA = 0.2
+
+# Label of the angle classifier for upside-down text
+UPSIDE_DOWN_LABEL = '180'
+
+
+def normalize_card(image):
+    """
+    Locate the KTP card in a photo and warp it to the normalized card size.
+
+    Args:
+        image (numpy.ndarray): The decoded BGR photo.
+
+    Returns:
+        numpy.ndarray: The card, CARD_WIDTH x CARD_HEIGHT, landscape but possibly upside
+        down. When no card outline is found, the photo is assumed to be cropped to the
+        card and is only resized.
+    """
+    corners = find_card_corners(image)
+    if corners is None:
+        return cv2.resize(image, (CARD_WIDTH, CARD_HEIGHT), interpolation=cv2.INTER_AREA)
+
+    target = np.float32([[0, 0], [CARD_WIDTH, 0], [CARD_WIDTH, CARD_HEIGHT], [0, CARD_HEIGHT]])
+    transform = cv2.getPerspectiveTransform(corners, target)
+    return cv2.warpPerspective(image, transform, (CARD_WIDTH, CARD_HEIGHT))
+
+
+def find_card_corners(image):
+    """
+    Find the four corners of the card outline.
+
+    Args:
+        image (numpy.ndarray): The decoded BGR photo.
+
+    Returns:
+        numpy.ndarray: The corners ordered top-left, top-right, bottom-right,
+        bottom-left, or None when no large enough quadrilateral is found.
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    edges = cv2.Canny(cv2.GaussianBlur(gray, (5, 5), 0), 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = MIN_CARD_AREA * image.shape[0] * image.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True):
+        if cv2.contourArea(contour) < min_area:
+            break
+        approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(approx) == 4:
+            return order_corners(approx.reshape(4, 2).astype(np.float32))
+    return None
+
+
+def order_corners(points):
+    """
+    Order four points as top-left, top-right, bottom-right, bottom-left.
+
+    Args:
+        points (numpy.ndarray): The four points, shape (4, 2).
+
+    Returns:
+        numpy.ndarray: The ordered points.
+    """
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).reshape(-1)
+    corners = np.float32([
+        points[np.argmin(sums)],
+        points[np.argmin(diffs)],
+        points[np.argmax(sums)],
+        points[np.argmax(diffs)],
+    ])
+
+    # Portrait photos of a landscape card: rotate the corners a quarter turn. Which
+    # quarter turn is right cannot be told from the outline, so the card may end up
+    # upside down, like a card photographed upside down in landscape
+    width = np.linalg.norm(corners[1] - corners[0])
+    height = np.linalg.norm(corners[3] - corners[0])
+    if height > width:
+        corners = np.roll(corners, 1, axis=0)
+    return corners
+
+
+def rotate_half_turn(card):
+    """
+    Rotate a card by 180 degrees.
+
+    Args:
+        card (numpy.ndarray): The normalized card.
+
+    Returns:
+        numpy.ndarray: The rotated card.
+    """
+    return cv2.rotate(card, cv2.ROTATE_180)
+
+
+def is_upside_down(orientations):
+    """
+    Tell whether a card is upside down from the orientations of its text lines.
+
+    Args:
+        orientations (list): The (label, score) of each line, as returned by the
+        PaddleOCR angle classifier, with the label '0' or '180'.
+
+    Returns:
+        bool: True when the scores of the upside-down lines outweigh the others.
+    """
+    votes = 0.0
+    for label, score in orientations:
+        votes += score if label == UPSIDE_DOWN_LABEL else -score
+    return votes > 0
+
+
+def crop_field(card, field):
+    """
+    Crop the region of a field from the normalized card.
+
+    Args:
+        card (numpy.ndarray): The normalized card.
+        field (str): The field name, one of FIELD_REGIONS.
+
+    Returns:
+        numpy.ndarray: The field region.
+    """
+    left, top, right, bottom = FIELD_REGIONS[field]
+    return card[round(top * CARD_HEIGHT):round(bottom * CARD_HEIGHT),
+                round(left * CARD_WIDTH):round(right * CARD_WIDTH)]
+
+
+def parse_field(field, ocr_result):
+    """
+    Read the value of a field from the PaddleOCR result of its region.
+
+    The value is made of the boxes to the right of the field label, grouped into
+    rows by their vertical position, and read row by row from left to right.
+
+    Args:
+        field (str): The field name, one of FIELD_REGIONS.
+        ocr_result (list): The PaddleOCR result of the field region.
+
+    Returns:
+        str: The field value, or None when nothing was recognized.
+    """
+    boxes = [
+        (np.array(box, dtype=np.float32), text.replace(':', '').strip())
+        for page in ocr_result if page
+        for box, (text, _) in page
+    ]
+    boxes = [(box, text) for box, text in boxes if text]
+
+    label_right = None
+    for box, text in boxes:
+        if any(label in text.lower() for label in FIELD_LABELS[field]):
+            label_right = box[:, 0].max()
+            break
+
+    values = []
+    for row in group_rows(boxes):
+        if any(text.lower().startswith(STOP_LABELS.get(field, ())) for _, text in row):
+            break
+        values.extend(
+            text for box, text in row
+            if (label_right is None or box[:, 0].mean() > label_right) and
+            not any(label in text.lower() for label in FIELD_LABELS[field])
+        )
+
+    if field == 'nik':
+        digits = re.sub(r'\D', '', ''.join(values))
+        return digits if len(digits) == 16 else None
+    return ' '.join(values) or None
+
+
+def group_rows(boxes):
+    """
+    Group boxes into text rows by the vertical overlap of their boxes.
+
+    Args:
+        boxes (list): The (box, text) tuples.
+
+    Returns:
+        list: The rows from top to bottom, each sorted from left to right.
+    """
+    rows = []
+    for box, text in sorted(boxes, key=lambda item: item[0][:, 1].mean()):
+        center = box[:, 1].mean()
+        if rows and rows[-1]['top'] <= center <= rows[-1]['bottom']:
+            rows[-1]['boxes'].append((box, text))
+        else:
+            rows.append({'top': box[:, 1].min(), 'bottom': box[:, 1].max(), 'boxes': [(box, text)]})
+    return [sorted(row['boxes'], key=lambda item: item[0][:, 0].min()) for row in rows]
+
+
+def sort_boxes(boxes):
+    """
+    Sort detected text boxes in reading order, the way PaddleOCR orders its results.
+
+    Boxes are sorted from top to bottom, and boxes whose tops are within 10 pixels
+    of each other from left to right.
+
+    Args:
+        boxes (list): The detected boxes, each four (x, y) points.
+
+    Returns:
+        list: The boxes in reading order.
+    """
+    boxes = sorted(boxes, key=lambda box: (box[0][1], box[0][0]))
+    for i in range(len(boxes) - 1):
+        for j in range(i, -1, -1):
+            if abs(boxes[j + 1][0][1] - boxes[j][0][1]) < 10 and boxes[j + 1][0][0] < boxes[j][0][0]:
+                boxes[j], boxes[j + 1] = boxes[j + 1], boxes[j]
+            else:
+                break
+    return boxes
+
+
+def crop_box(image, box):
+    """
+    Crop a detected text box, straightened with a perspective transform.
+
+    Args:
+        image (numpy.ndarray): The decoded BGR image.
+        box (list): The four (x, y) points of the box, clockwise from top-left.
+
+    Returns:
+        numpy.ndarray: The text line, rotated upright when it is taller than wide.
+    """
+    points = np.float32(box)
+    width = int(max(np.linalg.norm(points[0] - points[1]), np.linalg.norm(points[2] - points[3])))
+    height = int(max(np.linalg.norm(points[0] - points[3]), np.linalg.norm(points[1] - points[2])))
+    width, height = max(width, 1), max(height, 1)
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    transform = cv2.getPerspectiveTransform(points, target)
+    crop = cv2.warpPerspective(image, transform, (width, height),
+                               borderMode=cv2.BORDER_REPLICATE, flags=cv2.INTER_CUBIC)
+    if height / width >= 1.5:
+        crop = np.rot90(crop)
+    return crop
@@ -8,6 +8,9 @@ Author: [Your Name]
 Date: [Current Date]
 """
 import os
+import zipfile
+
+from django.conf import settings
 
 def delete_uploaded_image(img_path):
     """
@@ -20,3 +23,66 @@ def delete_uploaded_image(img_path):
         remove uploaded image
     """
     return os.remove(img_path)
+
+
+def iter_uploads(images=None, archive=None):
+    """
+    Iterate over the uploaded images, then over the images of an uploaded zip archive.
+
+    Files are read one at a time, so a large batch is never held in memory at once.
+    The archive is checked against OCR_ARCHIVE_LIMITS before any entry is read.
+
+    Args:
+        images (list): The uploaded image files.
+        archive: The uploaded zip archive of images.
+
+    Returns:
+        generator: (name, bytes) of each image.
+
+    Raises:
+        ValueError: When the archive exceeds OCR_ARCHIVE_LIMITS.
+    """
+    for image in images or []:
+        image.seek(0)
+        yield image.name, image.read()
+
+    if archive is not None:
+        archive.seek(0)
+        with zipfile.ZipFile(archive) as zip_file:
+            check_archive(zip_file)
+            for info in zip_file.infolist():
+                name = os.path.basename(info.filename)
+                # Folders and the resource forks added by macOS are not cards
+                if info.is_dir() or name.startswith('.') or info.filename.startswith('__MACOSX/'):
+                    continue
+                yield info.filename, zip_file.read(info)
+
+
+def check_archive(zip_file):
+    """
+    Check a zip archive against OCR_ARCHIVE_LIMITS without decompressing it.
+
+    The sizes are read from the archive headers. zipfile never decompresses an entry
+    past the size of its header, so they also bound what iter_uploads reads.
+
+    Args:
+        zip_file (zipfile.ZipFile): The opened archive.
+
+    Raises:
+        ValueError: When the archive has too many entries, an entry is too large or
+        too compressed, or the entries are too large together.
+    """
+    limits = settings.OCR_ARCHIVE_LIMITS
+    infolist = zip_file.infolist()
+    if len(infolist) > limits['MAX_ENTRIES']:
+        raise ValueError(f"The archive has more than {limits['MAX_ENTRIES']} files.")
+
+    total_size = 0
+    for info in infolist:
+        if info.file_size > limits['MAX_FILE_SIZE']:
+            raise ValueError(f"{info.filename} is larger than {limits['MAX_FILE_SIZE']} bytes.")
+        if info.file_size > limits['MAX_COMPRESSION_RATIO'] * max(info.compress_size, 1):
+            raise ValueError(f"{info.filename} is compressed more than {limits['MAX_COMPRESSION_RATIO']} times.")
+        total_size += info.file_size
+    if total_size > limits['MAX_TOTAL_SIZE']:
+        raise ValueError(f"The archive is larger than {limits['MAX_TOTAL_SIZE']} bytes uncompressed.")
@@ -0,0 +1,98 @@
+"""
+Module: ocr_profile_report.py
+
+Management command measuring the latency and field accuracy of each OCR profile.
+
+The sample directory holds KTP images and, optionally, a labels.json file mapping
+each file name to its expected fields, e.g. {"ktp1.jpg": {"nik": "...", "nama": "..."}}.
+"""
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...function import feature
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+FIELDS = ('nik', 'nama', 'alamat')
+
+
+class Command(BaseCommand):
+    help = 'Measure the latency and field accuracy of the OCR profiles on sample KTP images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('samples', help='Directory of KTP images, with an optional labels.json.')
+        parser.add_argument('--profiles', nargs='+', choices=list(settings.OCR_PROFILES),
+                            default=list(settings.OCR_PROFILES))
+        parser.add_argument('--repeat', type=int, default=1, help='Runs per image.')
+
+    def handle(self, *args, **options):
+        samples = options['samples']
+        file_names = sorted(name for name in os.listdir(samples) if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not file_names:
+            raise CommandError(f'No KTP images found in {samples}')
+
+        labels = {}
+        labels_path = os.path.join(samples, 'labels.json')
+        if os.path.exists(labels_path):
+            with open(labels_path) as labels_file:
+                labels = json.load(labels_file)
+
+        images = {name: cv2.imread(os.path.join(samples, name)) for name in file_names}
+        reports = [self.profile_report(profile, images, labels, options['repeat'])
+                   for profile in options['profiles']]
+        self.stdout.write(json.dumps(reports, indent=2))
+
+    def profile_report(self, profile, images, labels, repeat):
+        # The first call loads the engine and initializes its predictors
+        _ktp_ocr(next(iter(images.values())), profile)
+
+        latencies = []
+        correct = {field: 0 for field in FIELDS}
+        labelled = {field: 0 for field in FIELDS}
+        failures = 0
+        for name, image in images.items():
+            for _ in range(repeat):
+                start = time.perf_counter()
+                result = _ktp_ocr(image, profile)
+                latencies.append(time.perf_counter() - start)
+                failures += result is None
+
+            for field, expected in labels.get(name, {}).items():
+                if field in labelled:
+                    labelled[field] += 1
+                    correct[field] += bool(result) and _normalize(result.get(field)) == _normalize(expected)
+
+        latencies_ms = np.array(latencies) * 1000
+        return {
+            'profile': profile,
+            'options': settings.OCR_PROFILES[profile],
+            'images': len(images),
+            'runs': len(latencies),
+            'latency_ms': {
+                'mean': float(latencies_ms.mean()),
+                'p50': float(np.percentile(latencies_ms, 50)),
+                'p95': float(np.percentile(latencies_ms, 95)),
+            },
+            'failures': failures,
+            'failure_rate': failures / len(latencies),
+            'field_accuracy': {
+                field: correct[field] / labelled[field] for field in FIELDS if labelled[field]
+            },
+        }
+
+
+def _ktp_ocr(image, profile):
+    try:
+        return feature.ktp_ocr(image, profile, bypass_cache=True)
+    except ValueError:
+        # A field could not be found on the card
+        return None
+
+
+def _normalize(value):
+    return ' '.join(str(value or '').upper().split())
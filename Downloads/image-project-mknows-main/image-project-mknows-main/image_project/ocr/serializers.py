@@ -1,9 +1,40 @@
+import zipfile
+from django.conf import settings
 from rest_framework import serializers
 from rest_framework.response import Response
 from rest_framework import status
 from .models import KTPmodel
+from .libraries.layout import FIELD_REGIONS
+from .libraries.utils import check_archive
 
 class KTPSerializer(serializers.ModelSerializer):
+    profile = serializers.ChoiceField(choices=list(settings.OCR_PROFILES), required=False, write_only=True)
+    fields = serializers.MultipleChoiceField(choices=list(FIELD_REGIONS), required=False, write_only=True)
+    bypass_cache = serializers.BooleanField(default=False, write_only=True)
+
     class Meta:
         model = KTPmodel
-        fields = ('id', 'img', 'img_path')
+        fields = ('id', 'img', 'img_path', 'profile', 'fields', 'bypass_cache')
+
+
+class KTPBatchSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.FileField(), required=False)
+    archive = serializers.FileField(required=False)
+    profile = serializers.ChoiceField(choices=list(settings.OCR_PROFILES), required=False)
+    fields = serializers.MultipleChoiceField(choices=list(FIELD_REGIONS), required=False)
+    bypass_cache = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if not attrs.get('images') and not attrs.get('archive'):
+            raise serializers.ValidationError('Upload the cards as images or as a zip archive.')
+        if attrs.get('archive'):
+            if not zipfile.is_zipfile(attrs['archive']):
+                raise serializers.ValidationError({'archive': 'The archive is not a valid zip file.'})
+            # Checked before the response starts streaming, so a zip bomb is answered with a 400
+            attrs['archive'].seek(0)
+            with zipfile.ZipFile(attrs['archive']) as zip_file:
+                try:
+                    check_archive(zip_file)
+                except ValueError as e:
+                    raise serializers.ValidationError({'archive': str(e)})
+        return attrs
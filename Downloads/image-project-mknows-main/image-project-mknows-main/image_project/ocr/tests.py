@@ -1,3 +1,187 @@
-from django.test import TestCase
+import io
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from django.urls import reverse
+
+from image_project.libraries.result_cache import ResultCache
+from .function import feature
+from .function.feature import cache_key, parse_ktp
+from .libraries import layout
+from .libraries.utils import iter_uploads
+
+
+def ocr_result(texts):
+    box = [[0, 0], [1, 0], [1, 1], [0, 1]]
+    return [[[box, (text, 0.99)] for text in texts]]
+
+
+def line(text, left, top, width=100, height=20):
+    box = [[left, top], [left + width, top], [left + width, top + height], [left, top + height]]
+    return [box, (text, 0.99)]
+
+
+class ParseKtpTest(SimpleTestCase):
+    def test_fields(self):
+        result = parse_ktp(ocr_result([
+            'NIK', ':3171234567890001', 'Nama', 'BUDI SANTOSO', 'Tempat/Tgl Lahir', 'JAKARTA',
+            'Alamat', 'JL MERDEKA NO 1', 'RT/RW', 'GAMBIR',
+        ]))
+        self.assertEqual(result['nik'], '3171234567890001')
+        self.assertEqual(result['nama'], 'BUDI SANTOSO')
+        self.assertEqual(result['alamat'], 'JL MERDEKA NO 1 GAMBIR')
+
+    def test_missing_fields(self):
+        with self.assertRaisesMessage(ValueError, 'Could not find NIK, alamat on the KTP'):
+            parse_ktp(ocr_result(['Nama', 'BUDI SANTOSO']))
+
+
+class LayoutTest(SimpleTestCase):
+    def test_order_corners(self):
+        corners = layout.order_corners(np.float32([[900, 600], [100, 50], [100, 600], [900, 50]]))
+        np.testing.assert_array_equal(corners, [[100, 50], [900, 50], [900, 600], [100, 600]])
+
+    def test_order_corners_of_portrait_card(self):
+        corners = layout.order_corners(np.float32([[50, 100], [600, 100], [600, 900], [50, 900]]))
+        # A quarter turn, so the long side of the card becomes its width
+        self.assertGreater(np.linalg.norm(corners[1] - corners[0]), np.linalg.norm(corners[3] - corners[0]))
+
+    def test_normalize_card(self):
+        photo = np.zeros((800, 1200, 3), dtype=np.uint8)
+        cv2.rectangle(photo, (100, 100), (1052, 700), (230, 230, 230), -1)
+        card = layout.normalize_card(photo)
+        self.assertEqual(card.shape, (layout.CARD_HEIGHT, layout.CARD_WIDTH, 3))
+        # The background around the card is cropped away
+        self.assertGreater(card[20:-20, 20:-20].min(), 200)
+
+    def test_rotate_half_turn(self):
+        card = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+        np.testing.assert_array_equal(layout.rotate_half_turn(layout.rotate_half_turn(card)), card)
+        np.testing.assert_array_equal(layout.rotate_half_turn(card)[0, 0], card[-1, -1])
+
+    def test_is_upside_down(self):
+        self.assertTrue(layout.is_upside_down([('180', 0.9), ('180', 0.8), ('0', 0.6)]))
+        self.assertFalse(layout.is_upside_down([('0', 0.9), ('180', 0.55)]))
+        self.assertFalse(layout.is_upside_down([]))
+
+    def test_crop_field(self):
+        card = np.zeros((layout.CARD_HEIGHT, layout.CARD_WIDTH, 3), dtype=np.uint8)
+        left, top, right, bottom = layout.FIELD_REGIONS['nama']
+        self.assertEqual(layout.crop_field(card, 'nama').shape[:2],
+                         (round(bottom * layout.CARD_HEIGHT) - round(top * layout.CARD_HEIGHT),
+                          round(right * layout.CARD_WIDTH) - round(left * layout.CARD_WIDTH)))
+
+    def test_parse_nik(self):
+        result = [[line('NIK', 10, 10), line(':', 120, 10, 10), line('3171 2345 6789 0001', 150, 12, 300)]]
+        self.assertEqual(layout.parse_field('nik', result), '3171234567890001')
+        self.assertIsNone(layout.parse_field('nik', [[line('NIK', 10, 10), line('31712345', 150, 10)]]))
+
+    def test_parse_multi_row_address(self):
+        result = [[
+            line('Alamat', 10, 10), line('JL MERDEKA', 150, 10), line('NO 1', 260, 12),
+            line('BLOK A', 150, 40),
+            line('RT/RW', 10, 70), line('001/002', 150, 70),
+        ]]
+        self.assertEqual(layout.parse_field('alamat', result), 'JL MERDEKA NO 1 BLOK A')
+
+    def test_parse_empty_field(self):
+        self.assertIsNone(layout.parse_field('nama', [None]))
+
+    def test_group_rows(self):
+        rows = layout.group_rows([
+            (np.float32(line('B', 200, 12)[0]), 'B'),
+            (np.float32(line('C', 10, 60)[0]), 'C'),
+            (np.float32(line('A', 10, 10)[0]), 'A'),
+        ])
+        self.assertEqual([[text for _, text in row] for row in rows], [['A', 'B'], ['C']])
+
+    def test_sort_boxes(self):
+        boxes = [line('', 200, 15)[0], line('', 10, 60)[0], line('', 10, 10)[0]]
+        self.assertEqual([box[0] for box in layout.sort_boxes(boxes)], [[10, 10], [200, 15], [10, 60]])
+
+
+class CacheKeyTest(SimpleTestCase):
+    def test_profile_options_are_keyed(self):
+        cache = ResultCache('test')
+        image = np.zeros((4, 4, 3), dtype=np.uint8)
+        profiles = {'accurate': {'DET_LIMIT_SIDE_LEN': 960}}
+        with override_settings(OCR_PROFILES=profiles):
+            key = cache_key(cache, image, 'accurate', None)
+            self.assertEqual(cache_key(cache, image, 'accurate', None), key)
+            self.assertNotEqual(cache_key(cache, image, 'accurate', ['nik']), key)
+        # Retuning the profile under the same name changes the key
+        with override_settings(OCR_PROFILES={'accurate': {'DET_LIMIT_SIDE_LEN': 640}}):
+            self.assertNotEqual(cache_key(cache, image, 'accurate', None), key)
+
+
+class ModelLockTest(SimpleTestCase):
+    def test_calls_of_a_profile_are_serialized(self):
+        class Engine:
+            active = 0
+            overlaps = 0
+            guard = threading.Lock()
+
+            def ocr(self, image, **kwargs):
+                with self.guard:
+                    self.active += 1
+                    self.overlaps += self.active > 1
+                time.sleep(0.01)
+                with self.guard:
+                    self.active -= 1
+                return [[]]
+
+        engine = Engine()
+        image = np.zeros((4, 4, 3), dtype=np.uint8)
+        with mock.patch.object(feature.registry, 'get', lambda name: engine), \
+                ThreadPoolExecutor(4) as executor:
+            calls = [executor.submit(feature.run_ocr, image, 'fast') for _ in range(4)]
+            calls += [executor.submit(feature.run_ocr_batch, [image], 'fast') for _ in range(2)]
+            for call in calls:
+                call.result()
+        self.assertEqual(engine.overlaps, 0)
+
+
+def zip_archive(files, compression=zipfile.ZIP_DEFLATED):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', compression) as zip_file:
+        for name, content in files.items():
+            zip_file.writestr(name, content)
+    return SimpleUploadedFile('cards.zip', buffer.getvalue(), content_type='application/zip')
+
+
+LIMITS = {'MAX_ENTRIES': 3, 'MAX_FILE_SIZE': 1000, 'MAX_TOTAL_SIZE': 1500, 'MAX_COMPRESSION_RATIO': 10}
+
+
+@override_settings(OCR_ARCHIVE_LIMITS=LIMITS)
+class ArchiveLimitsTest(SimpleTestCase):
+    def assertRejected(self, archive, message):
+        response = self.client.post(reverse('ocr:KTPOCRBatch'), {'archive': archive})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(message, response.json()['archive'][0])
+
+    def test_too_many_entries(self):
+        archive = zip_archive({f'{index}.jpg': b'card' for index in range(4)}, zipfile.ZIP_STORED)
+        self.assertRejected(archive, 'more than 3 files')
+
+    def test_entry_too_large(self):
+        self.assertRejected(zip_archive({'card.jpg': bytes(2000)}, zipfile.ZIP_STORED), 'larger than 1000 bytes')
+
+    def test_entries_too_large_together(self):
+        archive = zip_archive({'a.jpg': bytes(800), 'b.jpg': bytes(800)}, zipfile.ZIP_STORED)
+        self.assertRejected(archive, 'larger than 1500 bytes uncompressed')
+
+    def test_compression_ratio(self):
+        self.assertRejected(zip_archive({'card.jpg': bytes(900)}), 'compressed more than 10 times')
+
+    def test_iter_uploads_checks_the_archive(self):
+        with self.assertRaises(ValueError):
+            list(iter_uploads(archive=zip_archive({'card.jpg': bytes(900)})))
+        archive = zip_archive({'card.jpg': b'card', '__MACOSX/._card.jpg': b'fork'}, zipfile.ZIP_STORED)
+        self.assertEqual(list(iter_uploads(archive=archive)), [('card.jpg', b'card')])
@@ -1,8 +1,10 @@
 from django.urls import path
 
-from .views import KTPOCRUpload
+from .views import KTPOCRUpload, KTPOCRBatchUpload, AsyncKTPOCRUpload
 
 urlpatterns = [
     # path('ktp_ocr/', KTPOCR.as_view(), name='KTPOCR'),
     path('ktp_ocr/', KTPOCRUpload.as_view(), name='KTPOCR'),
+    path('async/ktp_ocr/', AsyncKTPOCRUpload.as_view(), name='AsyncKTPOCR'),
+    path('ktp_ocr/batch/', KTPOCRBatchUpload.as_view(), name='KTPOCRBatch'),
 ]
@@ -3,11 +3,18 @@ Module: views.py
 
 This module contains views for handling KTP OCR uploads.
 """
+import itertools
+import json
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .serializers import KTPSerializer
+from image_project.libraries import executors, images
+from image_project.views import AsyncAPIView
+from .serializers import KTPSerializer, KTPBatchSerializer
 from .function import feature
+from .libraries.utils import iter_uploads
 
 class KTPOCRUpload(APIView):
     """
@@ -18,6 +25,8 @@ class KTPOCRUpload(APIView):
         """
         Handle the POST request for KTP OCR uploads.
 
+        The image is decoded from the uploaded bytes and never written to disk.
+
         Parameters:
         - request: The HTTP request object.
 
@@ -27,13 +36,129 @@ class KTPOCRUpload(APIView):
         try:
             serializer = KTPSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save()
-                result = feature.ktp_ocr(serializer.data['img_path'])
+                result = read_upload(serializer.validated_data)
                 return Response(build_result(result), status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
+class AsyncKTPOCRUpload(AsyncAPIView):
+    """
+    Native async variant of KTPOCRUpload.
+
+    The upload is decoded on the event loop and OCR runs in the 'ocr' inference executor.
+    """
+
+    async def post(self, request):
+        """
+        Handle the POST request for KTP OCR uploads.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - JsonResponse: The HTTP response object.
+        """
+        try:
+            serializer = KTPSerializer(data=self.request_data(request))
+            if serializer.is_valid():
+                # Decoding is CPU work too, so it runs in the executor with OCR
+                result = await executors.run('ocr', read_upload, serializer.validated_data)
+                return self.respond(build_result(result))
+            return self.respond(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.respond(str(e), status.HTTP_400_BAD_REQUEST)
+
+
+class KTPOCRBatchUpload(APIView):
+    """
+    API view for batch KTP OCR uploads.
+    """
+
+    def post(self, request):
+        """
+        Handle the POST request for batch KTP OCR uploads.
+
+        The cards are uploaded as several 'images' files or as a zip 'archive'. They are
+        processed in chunks of OCR_BATCH_SIZE cards and one NDJSON line is streamed per
+        card as soon as its chunk is done, in upload order.
+
+        Parameters:
+        - request: The HTTP request object.
+
+        Returns:
+        - StreamingHttpResponse: The application/x-ndjson stream of results.
+        """
+        serializer = KTPBatchSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        uploads = iter_uploads(data.get('images'), data.get('archive'))
+        lines = stream_results(uploads, data.get('profile'), sorted(data.get('fields', [])),
+                               data['bypass_cache'])
+        return StreamingHttpResponse(lines, content_type='application/x-ndjson')
+
+
+def read_upload(validated_data):
+    """
+    Decode an uploaded KTP in memory and run OCR on it.
+
+    Parameters:
+    - validated_data (dict): The validated data of a KTPSerializer.
+
+    Returns:
+    - dict: The extracted information, see feature.ktp_ocr.
+    """
+    image = images.decode_bgr(images.read_upload(validated_data['img']))
+    return feature.ktp_ocr(image,
+                           validated_data.get('profile'),
+                           sorted(validated_data.get('fields', [])),
+                           validated_data['bypass_cache'])
+
+
+def stream_results(uploads, profile, fields, bypass_cache):
+    """
+    Run batch OCR on uploaded cards chunk by chunk and yield one NDJSON line per card.
+
+    Parameters:
+    - uploads (iterable): The (name, bytes) of each card.
+    - profile (str): The OCR engine profile.
+    - fields (list): The fields to extract, or an empty list for the whole card.
+    - bypass_cache (bool): Whether to run OCR even if the results are cached.
+
+    Returns:
+    - generator: The lines, each a JSON object with the card index and name.
+    """
+    uploads = enumerate(uploads)
+    while True:
+        chunk = list(itertools.islice(uploads, settings.OCR_BATCH_SIZE))
+        if not chunk:
+            return
+
+        cards = []
+        results = {}
+        for index, (name, content) in chunk:
+            try:
+                cards.append((index, images.decode_bgr(content)))
+            except ValueError as e:
+                results[index] = e
+
+        try:
+            batch_results = feature.ktp_ocr_batch([image for _, image in cards], profile, fields, bypass_cache)
+        except Exception as e:
+            batch_results = [e] * len(cards)
+        results.update(zip([index for index, _ in cards], batch_results))
+
+        for index, name in ((index, name) for index, (name, _) in chunk):
+            line = {'index': index, 'name': name}
+            if isinstance(results[index], Exception):
+                line.update(status=400, message=str(results[index]), result=None)
+            else:
+                line.update(build_result(results[index]))
+            yield json.dumps(line) + '\n'
+
+
 def build_result(result):
     """
     Build the result dictionary.
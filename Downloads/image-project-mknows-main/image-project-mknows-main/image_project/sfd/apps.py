@@ -2,18 +2,86 @@
 
 from django.apps import AppConfig
 from django.conf import settings
-from tensorflow.keras.models import load_model
+from django.core.exceptions import ImproperlyConfigured
 import os
 
 class ImageSimilarityAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'sfd'
 
+    model_name = 'vgg16_model.h5'
+    # The conv base exported with `manage.py export_sfd_slim`, served when SFD_BACKEND is 'slim'
+    slim_model_name = 'vgg16_conv_avgpool-float16.npz'
+    # Reference embeddings of different backends are not mixed: the index is rebuilt on switch
+    model_version = os.path.splitext(model_name)[0]
+    if settings.SFD_BACKEND == 'slim':
+        model_version = os.path.splitext(slim_model_name)[0]
+    full_threshold = 0.8
+
+    @property
+    def threshold(self):
+        """
+        The similarity threshold of the served backend.
+
+        The slim threshold is SFD_SLIM['THRESHOLD'] when set, otherwise the one calibrated
+        by `manage.py export_sfd_slim` and stored next to the slim weights.
+        """
+        if settings.SFD_BACKEND != 'slim':
+            return self.full_threshold
+        if settings.SFD_SLIM['THRESHOLD'] is not None:
+            return settings.SFD_SLIM['THRESHOLD']
+
+        from .libraries.slim_model import read_slim_threshold
+
+        threshold = read_slim_threshold(self.slim_model_path())
+        if threshold is None:
+            raise ImproperlyConfigured(
+                'SFD_BACKEND is slim but no threshold is set: run `manage.py export_sfd_slim` with '
+                'sample signatures to calibrate one, or set SFD_SLIM_THRESHOLD.')
+        return threshold
+
+    def slim_model_path(self):
+        return os.path.join(settings.BASE_DIR, 'sfd', 'models', self.slim_model_name)
+
     def ready(self):
-        # Load the pre-trained VGG16 model when the app is ready
-        saved_model_path = os.path.join(settings.BASE_DIR, 'sfd', 'models', 'vgg16_model.h5')
-        self.model = load_model(saved_model_path)
+        from image_project.libraries.registry import registry
+        from image_project.libraries.warmup import warmup
+        from .libraries.embedding_index import ReferenceEmbeddingIndex
+
+        # The VGG16 model is loaded on first use, or at server start if preloaded
+        registry.register('sfd', self.load_model)
+        warmup.register('sfd', self.warm_up)
+
+        # Reference embeddings are computed once and kept next to main_signature
+        self.reference_index = ReferenceEmbeddingIndex(
+            reference_dir=os.path.join(settings.BASE_DIR, 'sfd', 'main_signature'),
+            index_dir=os.path.join(settings.BASE_DIR, 'sfd', 'cache', 'reference_embeddings'),
+            model_version=self.model_version,
+        )
+
+    def load_model(self):
+        if settings.SFD_BACKEND == 'slim':
+            from .libraries.slim_model import load_slim_model
+
+            # Fails at load, before any request is scored against the wrong threshold
+            self.threshold
+            return load_slim_model(self.slim_model_path())
+        return self.load_full_model()
+
+    def load_full_model(self):
+        from tensorflow.keras.models import load_model
+
+        # Load the pre-trained VGG16 model
+        saved_model_path = os.path.join(settings.BASE_DIR, 'sfd', 'models', self.model_name)
+        model = load_model(saved_model_path)
 
         # Disable training for all layers in the VGG16 model
-        for model_layer in self.model.layers:
-            model_layer.trainable = False
\ No newline at end of file
+        for model_layer in model.layers:
+            model_layer.trainable = False
+
+        return model
+
+    def warm_up(self):
+        from .function import features
+
+        features.warmup()
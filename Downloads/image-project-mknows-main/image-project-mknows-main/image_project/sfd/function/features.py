@@ -2,55 +2,71 @@
 
 from PIL import Image
 import numpy as np
-import os
-from tensorflow.keras.preprocessing import image
-from keras.applications.vgg16 import preprocess_input
 from sklearn.metrics.pairwise import cosine_similarity
 from django.apps import apps
-from django.conf import settings
+from image_project.libraries import batching, coalescing, embedding_cache, inference_service, timing
+from image_project.libraries.registry import registry
 
 def load_image(image_path):
-    input_image = Image.open(image_path)
+    with timing.stage('decode'):
+        input_image = Image.open(image_path)
 
-    # Convert image to RGB (if not already in RGB mode)
-    if input_image.mode != 'RGB':
-        input_image = input_image.convert('RGB')
+        # Convert image to RGB (if not already in RGB mode)
+        if input_image.mode != 'RGB':
+            input_image = input_image.convert('RGB')
 
-    resized_image = input_image.resize((224, 224))
+        resized_image = input_image.resize((224, 224))
     return resized_image
 
 def get_image_embeddings(object_image):
-    model = apps.get_app_config('sfd').model
-    image_array = np.expand_dims(image.img_to_array(object_image), axis=0)
-    # Preprocess the image array
-    image_array = preprocess_input(image_array)
-    image_embedding = model.predict(image_array)
+    if inference_service.is_remote('sfd'):
+        return inference_service.call('sfd', 'get_image_embeddings', np.asarray(object_image))
+
+    # Keras is imported here so that importing this module does not pull in TensorFlow
+    from tensorflow.keras.preprocessing import image
+    from keras.applications.vgg16 import preprocess_input
+
+    model = registry.get('sfd')
+    with timing.stage('preprocess'):
+        image_array = np.expand_dims(image.img_to_array(object_image), axis=0)
+        # Preprocess the image array
+        image_array = preprocess_input(image_array)
+    # Concurrent requests share one forward pass through the 'sfd' micro-batcher
+    with timing.stage('inference', model='sfd'):
+        image_embedding = batching.predict('sfd', model.predict_on_batch, image_array)
     return image_embedding
 
+def warmup():
+    # Builds the predict function of the model on an input of the production shape
+    get_image_embeddings(Image.new('RGB', (224, 224), 'white'))
+
 def get_similarity_score(first_image_vector, second_image_vector):
     similarity_score = cosine_similarity(first_image_vector, second_image_vector).reshape(1,)
     return similarity_score[0]
 
+def get_reference_embeddings(nik):
+    reference_index = apps.get_app_config('sfd').reference_index
+    with timing.stage('reference'):
+        return reference_index.get_embedding(nik, lambda path: get_image_embeddings(load_image(path)))
+
 def process_image_similarity(nik, user_image):
-    supported_extensions = ['.jpg', '.jpeg', '.png', '.gif']
-    signature_image_path = None
-
-    for ext in supported_extensions:
-        potential_path = os.path.join(settings.BASE_DIR, 'sfd', 'main_signature', f'{nik}{ext}')
-        if os.path.exists(potential_path):
-            signature_image_path = potential_path
-            break
-
-    if signature_image_path:
-        first_image = load_image(signature_image_path)
-        second_image = load_image(user_image)
-                
-        first_image_vector = get_image_embeddings(first_image)
-        second_image_vector = get_image_embeddings(second_image)
+    # Identical requests in flight (retries, double submits) share one run
+    key = coalescing.key('sfd:image_similarity', nik, apps.get_app_config('sfd').model_version, user_image)
+    return coalescing.run('sfd', key, lambda: compare_signature(nik, user_image))
+
+def compare_signature(nik, user_image):
+    # The reference embedding comes from the index, only the user's image is embedded here
+    first_image_vector = get_reference_embeddings(nik)
+
+    if first_image_vector is not None:
+        # Probe embeddings are cached by the hash of the uploaded bytes: a hit skips decoding too
+        cache = embedding_cache.get_cache('sfd')
+        key = cache.key(user_image, apps.get_app_config('sfd').model_version)
+        second_image_vector = cache.get_or_compute(key, lambda: get_image_embeddings(load_image(user_image)))
 
         similarity_score = get_similarity_score(first_image_vector, second_image_vector)
 
-        if similarity_score > 0.8:
+        if similarity_score > apps.get_app_config('sfd').threshold:
             result = {'message': 'Real signature detected', 'similarity_score': similarity_score}
         else:
             result = {'message': 'Potential forged image detected', 'similarity_score': similarity_score}
@@ -0,0 +1,163 @@
+# sfd/libraries/embedding_index.py
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+SUPPORTED_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif']
+
+# Number of locks the NIKs are spread over: NIKs come from the client, so a lock per
+# NIK would grow without bound
+LOCK_STRIPES = 64
+
+
+class ReferenceEmbeddingIndex:
+    """
+    Index of precomputed embeddings for the main_signature reference images.
+
+    Every reference gets a memory-mapped ``{nik}.npy`` sidecar holding its
+    embedding and a ``{nik}.json`` file recording the reference file, its
+    mtime, size and sha256, and the model version. An entry is recomputed
+    only when the model version or the file content changes; a touched file
+    whose hash is unchanged just gets its metadata refreshed.
+
+    Entries are computed under the lock stripe of their NIK, so a cache miss only
+    makes the requests for NIKs of the same stripe wait, not the hits of the others.
+    """
+
+    def __init__(self, reference_dir, index_dir, model_version):
+        self.reference_dir = reference_dir
+        self.index_dir = index_dir
+        self.model_version = model_version
+        self._entries = {}
+        self._nik_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+        self._lock = threading.Lock()
+
+    def find_reference(self, nik):
+        for ext in SUPPORTED_EXTENSIONS:
+            potential_path = os.path.join(self.reference_dir, f'{nik}{ext}')
+            if os.path.exists(potential_path):
+                return potential_path
+        return None
+
+    def get_embedding(self, nik, embed):
+        """
+        Return the reference embedding of ``nik``, or None if it has no reference image.
+
+        ``embed`` is called with the reference image path when the stored
+        embedding is missing or stale.
+        """
+        with self._nik_lock(nik):
+            entry = self._entries.get(nik) or self._read_entry(nik)
+            reference_path = entry['meta']['path'] if entry else None
+            stat = _stat(reference_path) if reference_path else None
+
+            if stat is None:
+                reference_path = self.find_reference(nik)
+                if reference_path is None:
+                    with self._lock:
+                        self._entries.pop(nik, None)
+                    return None
+                stat = _stat(reference_path)
+
+            if entry and self._is_fresh(entry['meta'], reference_path, stat):
+                self._publish(nik, entry)
+                return entry['embedding']
+
+            sha256 = _sha256(reference_path)
+            if entry and self._is_same_content(entry['meta'], reference_path, sha256):
+                entry['meta'].update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                self._write_meta(nik, entry['meta'])
+                self._publish(nik, entry)
+                return entry['embedding']
+
+            embedding = np.asarray(embed(reference_path), dtype=np.float32)
+            meta = {
+                'path': reference_path,
+                'mtime_ns': stat.st_mtime_ns,
+                'size': stat.st_size,
+                'sha256': sha256,
+                'model_version': self.model_version,
+            }
+            self._write_entry(nik, embedding, meta)
+            self._publish(nik, {'meta': meta, 'embedding': embedding})
+            return embedding
+
+    def build(self, embed):
+        """Compute the embeddings of every reference image, returning the number indexed."""
+        count = 0
+        if not os.path.isdir(self.reference_dir):
+            return count
+        for file_name in sorted(os.listdir(self.reference_dir)):
+            nik, ext = os.path.splitext(file_name)
+            if ext.lower() in SUPPORTED_EXTENSIONS and self.get_embedding(nik, embed) is not None:
+                count += 1
+        return count
+
+    def _nik_lock(self, nik):
+        # crc32 rather than hash(), so the stripe of a NIK is the same in every process
+        return self._nik_locks[zlib.crc32(nik.encode()) % LOCK_STRIPES]
+
+    def _publish(self, nik, entry):
+        with self._lock:
+            self._entries[nik] = entry
+
+    def _is_fresh(self, meta, reference_path, stat):
+        return (meta['model_version'] == self.model_version and
+                meta['path'] == reference_path and
+                meta['mtime_ns'] == stat.st_mtime_ns and
+                meta['size'] == stat.st_size)
+
+    def _is_same_content(self, meta, reference_path, sha256):
+        return (meta['model_version'] == self.model_version and
+                meta['path'] == reference_path and
+                meta['sha256'] == sha256)
+
+    def _paths(self, nik):
+        base = os.path.join(self.index_dir, nik)
+        return f'{base}.npy', f'{base}.json'
+
+    def _read_entry(self, nik):
+        embedding_path, meta_path = self._paths(nik)
+        try:
+            with open(meta_path) as meta_file:
+                meta = json.load(meta_file)
+            embedding = np.load(embedding_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        return {'meta': meta, 'embedding': embedding}
+
+    def _write_entry(self, nik, embedding, meta):
+        os.makedirs(self.index_dir, exist_ok=True)
+        embedding_path, _ = self._paths(nik)
+        tmp_path = f'{embedding_path}.tmp'
+        with open(tmp_path, 'wb') as embedding_file:
+            np.save(embedding_file, embedding)
+        os.replace(tmp_path, embedding_path)
+        self._write_meta(nik, meta)
+
+    def _write_meta(self, nik, meta):
+        _, meta_path = self._paths(nik)
+        tmp_path = f'{meta_path}.tmp'
+        with open(tmp_path, 'w') as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(tmp_path, meta_path)
+
+
+def _stat(path):
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as reference_file:
+        for chunk in iter(lambda: reference_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,143 @@
+# sfd/libraries/slim_model.py
+
+import json
+import os
+
+import numpy as np
+
+INPUT_SHAPE = (224, 224, 3)
+
+
+def build_slim_model():
+    """
+    VGG16 convolutional base with global average pooling, without the FC layers.
+
+    The FC layers hold about 90% of the VGG16 parameters (~124M of ~138M), so the
+    slim model weighs ~59 MB in float32 instead of ~528 MB.
+    """
+    from tensorflow.keras.applications import VGG16
+
+    model = VGG16(include_top=False, weights=None, pooling='avg', input_shape=INPUT_SHAPE)
+    model.trainable = False
+    return model
+
+
+def export_slim_weights(full_model, path):
+    """
+    Copy the convolutional weights of the full model into the slim model and save them as float16.
+
+    Layers are matched by name ('block1_conv1', ...), also inside a nested VGG16 model.
+    Returns the slim model, with the float16-rounded weights it will be served with.
+    """
+    slim_model = build_slim_model()
+    for layer in slim_model.layers:
+        if layer.weights:
+            layer.set_weights(_find_layer(full_model, layer.name).get_weights())
+
+    weights = [weight.astype(np.float16) for weight in slim_model.get_weights()]
+    with open(path, 'wb') as file:
+        np.savez(file, *weights)
+    slim_model.set_weights([weight.astype(np.float32) for weight in weights])
+    return slim_model
+
+
+def load_slim_model(path):
+    # Weights are stored as float16 and computed in float32: CPUs have no fast float16 kernels
+    slim_model = build_slim_model()
+    with np.load(path) as data:
+        slim_model.set_weights([data[f'arr_{i}'].astype(np.float32) for i in range(len(data.files))])
+    return slim_model
+
+
+def metadata_path(path):
+    """
+    Path of the JSON metadata exported next to the slim weights.
+    """
+    return os.path.splitext(path)[0] + '.json'
+
+
+def write_slim_metadata(path, threshold, report=None):
+    """
+    Store the calibrated threshold of the slim weights at path, with the report it comes from.
+
+    The slim scores are distributed differently from the full model's, so the threshold
+    belongs to the exported weights rather than to the settings.
+    """
+    with open(metadata_path(path), 'w', encoding='utf-8') as file:
+        json.dump({'threshold': threshold, 'report': report}, file, indent=2)
+
+
+def read_slim_threshold(path):
+    """
+    Return the calibrated threshold stored with the slim weights at path, or None.
+    """
+    try:
+        with open(metadata_path(path), encoding='utf-8') as file:
+            return json.load(file).get('threshold')
+    except (OSError, ValueError):
+        return None
+
+
+def _find_layer(model, name):
+    for layer in model.layers:
+        if layer.name == name:
+            return layer
+        if hasattr(layer, 'layers'):
+            try:
+                return _find_layer(layer, name)
+            except ValueError:
+                continue
+    raise ValueError(f'Layer {name} not found in {model.name}')
+
+
+def similarity_report(reference_embeddings, slim_embeddings, threshold=0.8, slim_threshold=None):
+    """
+    Compare the pairwise similarity scores of the full and the slim model on the same images.
+
+    Returns the score distribution of each model, the score correlation, the decisions
+    and flips at the threshold, and the slim threshold agreeing best with the full model.
+    """
+    slim_threshold = threshold if slim_threshold is None else slim_threshold
+    reference_scores = _pairwise_scores(reference_embeddings)
+    slim_scores = _pairwise_scores(slim_embeddings)
+    reference_accepts = reference_scores > threshold
+    flips = reference_accepts != (slim_scores > slim_threshold)
+
+    # Pooled conv features are non-negative, so their cosine scores sit higher than the
+    # full model's: pick the slim threshold reproducing most of its decisions
+    candidates = np.unique(np.round(slim_scores, 3))
+    agreements = [np.mean(reference_accepts == (slim_scores > candidate)) for candidate in candidates]
+    best = int(np.argmax(agreements))
+
+    return {
+        'images': len(reference_embeddings),
+        'pairs': len(reference_scores),
+        'reference_scores': _distribution(reference_scores),
+        'slim_scores': _distribution(slim_scores),
+        'score_correlation': float(np.corrcoef(reference_scores, slim_scores)[0, 1]),
+        'threshold': threshold,
+        'slim_threshold': slim_threshold,
+        'reference_accepts': int(reference_accepts.sum()),
+        'slim_accepts': int(np.sum(slim_scores > slim_threshold)),
+        'flips': int(flips.sum()),
+        'flip_rate': float(flips.mean()),
+        'suggested_slim_threshold': float(candidates[best]),
+        'suggested_threshold_agreement': float(agreements[best]),
+    }
+
+
+def _pairwise_scores(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float64).reshape(len(embeddings), -1)
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    rows, cols = np.triu_indices(len(embeddings), k=1)
+    return np.sum(embeddings[rows] * embeddings[cols], axis=1)
+
+
+def _distribution(scores):
+    return {
+        'mean': float(scores.mean()),
+        'std': float(scores.std()),
+        'p5': float(np.percentile(scores, 5)),
+        'p50': float(np.percentile(scores, 50)),
+        'p95': float(np.percentile(scores, 95)),
+    }
@@ -0,0 +1,19 @@
+# sfd/management/commands/build_reference_index.py
+
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from sfd.function import features
+
+
+class Command(BaseCommand):
+    help = 'Precompute the embeddings of every main_signature reference image.'
+
+    def handle(self, *args, **options):
+        reference_index = apps.get_app_config('sfd').reference_index
+        if not os.path.isdir(reference_index.reference_dir):
+            raise CommandError(f'Reference directory {reference_index.reference_dir} does not exist')
+        count = reference_index.build(lambda path: features.get_image_embeddings(features.load_image(path)))
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} reference signatures'))
@@ -0,0 +1,71 @@
+# sfd/management/commands/export_sfd_slim.py
+
+import json
+import os
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from sfd.function import features
+from sfd.libraries.embedding_index import SUPPORTED_EXTENSIONS
+from sfd.libraries.slim_model import export_slim_weights, similarity_report, write_slim_metadata
+
+
+class Command(BaseCommand):
+    help = 'Export the slim float16 VGG16 conv base of the sfd model and compare it with the full model.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample-dir', default=settings.SFD_SAMPLE_DIR,
+                            help='Signature images scored pairwise by both models for the report.')
+        parser.add_argument('--output', help='Path of the .npz file (defaults to the path the slim backend loads).')
+        parser.add_argument('--threshold', type=float, default=apps.get_app_config('sfd').full_threshold)
+        parser.add_argument('--slim-threshold', type=float,
+                            help='Threshold stored with the weights instead of the calibrated one.')
+
+    def handle(self, *args, **options):
+        from tensorflow.keras.applications.vgg16 import preprocess_input
+
+        config = apps.get_app_config('sfd')
+        output = options['output'] or config.slim_model_path()
+
+        # Always the full model, whatever SFD_BACKEND is
+        full_model = config.load_full_model()
+        slim_model = export_slim_weights(full_model, output)
+        self.stdout.write(
+            f'Wrote {output} ({os.path.getsize(output) / 2 ** 20:.1f} MiB, '
+            f'{slim_model.count_params():,} parameters instead of {full_model.count_params():,})')
+
+        image_paths = sample_paths(options['sample_dir'])
+        if len(image_paths) < 2:
+            write_slim_metadata(output, options['slim_threshold'])
+            self.stdout.write('Not enough sample signatures for the report.')
+            if options['slim_threshold'] is None:
+                self.stdout.write('No threshold was calibrated: set SFD_SLIM_THRESHOLD to serve the slim backend.')
+            return
+        inputs = preprocess_input(np.stack([np.asarray(features.load_image(path), dtype=np.float32)
+                                            for path in image_paths]))
+        report = similarity_report(
+            np.concatenate([full_model.predict_on_batch(batch[None]) for batch in inputs]),
+            np.concatenate([slim_model.predict_on_batch(batch[None]) for batch in inputs]),
+            threshold=options['threshold'],
+            slim_threshold=options['slim_threshold'],
+        )
+        self.stdout.write(json.dumps(report, indent=2))
+
+        threshold = options['slim_threshold']
+        if threshold is None:
+            threshold = report['suggested_slim_threshold']
+        write_slim_metadata(output, threshold, report)
+        self.stdout.write(f'Stored the slim threshold {threshold} with the weights.')
+
+
+def sample_paths(sample_dir):
+    if not os.path.isdir(sample_dir):
+        return []
+    return sorted(
+        os.path.join(sample_dir, file_name)
+        for file_name in os.listdir(sample_dir)
+        if os.path.splitext(file_name)[1].lower() in SUPPORTED_EXTENSIONS
+    )
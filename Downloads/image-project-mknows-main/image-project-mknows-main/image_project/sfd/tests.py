@@ -1,3 +1,109 @@
-from django.test import TestCase
+import os
+import tempfile
+import threading
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from .libraries import embedding_index, slim_model
+from .libraries.embedding_index import ReferenceEmbeddingIndex
+
+
+class ReferenceEmbeddingIndexTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.reference_dir = os.path.join(directory.name, 'main_signature')
+        os.makedirs(self.reference_dir)
+        self.index = ReferenceEmbeddingIndex(self.reference_dir, os.path.join(directory.name, 'index'), 'v1')
+        for nik in ('1', '2'):
+            with open(os.path.join(self.reference_dir, f'{nik}.png'), 'wb') as file:
+                file.write(nik.encode())
+
+    def test_miss_does_not_block_other_niks(self):
+        self.index.get_embedding('1', lambda path: np.ones((1, 4)))
+        started, release = threading.Event(), threading.Event()
+
+        def slow_embed(path):
+            started.set()
+            release.wait(5)
+            return np.zeros((1, 4))
+
+        miss = threading.Thread(target=self.index.get_embedding, args=('2', slow_embed))
+        miss.start()
+        self.assertTrue(started.wait(5))
+        # A hit of another NIK returns while the miss is still embedding
+        np.testing.assert_array_equal(self.index.get_embedding('1', None), np.ones((1, 4)))
+        release.set()
+        miss.join()
+        np.testing.assert_array_equal(self.index.get_embedding('2', None), np.zeros((1, 4)))
+
+    def test_locks_are_bounded(self):
+        for nik in range(1000):
+            self.index.get_embedding(f'missing-{nik}', None)
+        self.assertEqual(len(self.index._nik_locks), embedding_index.LOCK_STRIPES)
+        self.assertEqual(set(self.index._entries), set())
+
+    def test_build_without_reference_dir(self):
+        self.index.reference_dir = os.path.join(self.reference_dir, 'missing')
+        self.assertEqual(self.index.build(lambda path: np.ones((1, 4))), 0)
+
+
+class SimilarityReportTest(SimpleTestCase):
+    def test_pairwise_scores(self):
+        embeddings = np.array([[1, 0], [0, 2], [3, 3]])
+        scores = slim_model._pairwise_scores(embeddings)
+        # Pairs in upper triangle order: (0, 1), (0, 2), (1, 2)
+        np.testing.assert_allclose(scores, [0, np.sqrt(0.5), np.sqrt(0.5)])
+
+    def test_pairwise_scores_flatten_embeddings(self):
+        embeddings = np.random.default_rng(0).random((4, 1, 8))
+        self.assertEqual(slim_model._pairwise_scores(embeddings).shape, (6,))
+
+    def test_identical_embeddings_agree(self):
+        embeddings = np.random.default_rng(0).normal(size=(5, 8))
+        report = slim_model.similarity_report(embeddings, embeddings, threshold=0.2)
+        self.assertEqual((report['images'], report['pairs']), (5, 10))
+        self.assertEqual(report['flips'], 0)
+        self.assertAlmostEqual(report['score_correlation'], 1.0)
+        self.assertEqual(report['suggested_threshold_agreement'], 1.0)
+
+    def test_suggested_threshold_fits_shifted_scores(self):
+        rng = np.random.default_rng(0)
+        reference = rng.normal(size=(12, 16))
+        # Non-negative features score higher, like the pooled conv features of the slim model
+        slim = np.abs(reference)
+        report = slim_model.similarity_report(reference, slim, threshold=0.0, slim_threshold=0.0)
+        self.assertEqual(report['slim_accepts'], report['pairs'])
+        self.assertGreater(report['flips'], 0)
+        self.assertGreater(report['suggested_slim_threshold'], 0.0)
+        self.assertGreater(report['suggested_threshold_agreement'], 1 - report['flip_rate'])
+
+
+class SlimThresholdTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.config = apps.get_app_config('sfd')
+        path = os.path.join(directory.name, 'slim.npz')
+        self.config.slim_model_path = lambda: path
+        self.addCleanup(vars(self.config).pop, 'slim_model_path')
+        self.path = path
+
+    def test_full_backend(self):
+        with override_settings(SFD_BACKEND='full'):
+            self.assertEqual(self.config.threshold, 0.8)
+
+    @override_settings(SFD_BACKEND='slim', SFD_SLIM={'THRESHOLD': None})
+    def test_slim_threshold_stored_with_the_weights(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.config.threshold
+        slim_model.write_slim_metadata(self.path, 0.93, {'flips': 0})
+        self.assertEqual(self.config.threshold, 0.93)
+
+    @override_settings(SFD_BACKEND='slim', SFD_SLIM={'THRESHOLD': 0.9})
+    def test_explicit_slim_threshold(self):
+        slim_model.write_slim_metadata(self.path, 0.93)
+        self.assertEqual(self.config.threshold, 0.9)
@@ -1,8 +1,9 @@
 from django.urls import path
 from .views import Template
-from .views import ImageSimilarityAPIView
+from .views import ImageSimilarityAPIView, AsyncImageSimilarityAPIView
 
 urlpatterns = [
     path('template/', Template.as_view(), name='template_sfd'),
     path('image-similarity/', ImageSimilarityAPIView.as_view(), name='image_similarity'),
+    path('async/image-similarity/', AsyncImageSimilarityAPIView.as_view(), name='async_image_similarity'),
 ]
@@ -3,6 +3,8 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from image_project.libraries import executors
+from image_project.views import AsyncAPIView
 from .serializers import ImageUploadSerializer
 from .function import features
 
@@ -30,6 +32,23 @@ class ImageSimilarityAPIView(APIView):
             response_data = build_result(result)
             return Response(response_data, status=status.HTTP_400_BAD_REQUEST)
 
+class AsyncImageSimilarityAPIView(AsyncAPIView):
+    async def post(self, request, *args, **kwargs):
+        serializer = ImageUploadSerializer(data=self.request_data(request))
+        if serializer.is_valid():
+            nik = serializer.validated_data['nik']
+            user_image = serializer.validated_data['image_1']
+
+            try:
+                result = await executors.run('sfd', features.process_image_similarity, nik, user_image)
+                return self.respond(build_result(result), status.HTTP_200_OK)
+            except ValueError as e:
+                result = {'message': str(e)}
+                return self.respond(build_result(result), status.HTTP_404_NOT_FOUND)
+        else:
+            result = {'message': 'Invalid request data'}
+            return self.respond(build_result(result), status.HTTP_400_BAD_REQUEST)
+
 def build_result(result):
     result = {
         "status": 200,
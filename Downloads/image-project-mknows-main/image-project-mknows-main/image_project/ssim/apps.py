@@ -1,5 +1,5 @@
 from django.apps import AppConfig
-import tensorflow as tf
+from django.conf import settings
 import os
 
 class SsimConfig(AppConfig):
@@ -10,4 +10,36 @@ class SsimConfig(AppConfig):
     saved_model_path = os.path.join(os.path.dirname(__file__),
                                     'model',
                                     model_name)
-    loaded_model = tf.keras.models.load_model(saved_model_path)
+    # The converted model, served when SSIM_BACKEND is 'tflite'
+    tflite_model_path = os.path.join(os.path.dirname(__file__),
+                                     'model',
+                                     f"{os.path.splitext(model_name)[0]}-{settings.SSIM_TFLITE['QUANTIZATION']}.tflite")
+    # Embeddings of different backends are not mixed: stored anchors are recomputed on switch
+    model_version = os.path.splitext(model_name)[0]
+    if settings.SSIM_BACKEND == 'tflite':
+        model_version += f"-tflite-{settings.SSIM_TFLITE['QUANTIZATION']}"
+
+    def ready(self):
+        from image_project.libraries.registry import registry
+        from image_project.libraries.warmup import warmup
+
+        # The Keras model is loaded on first use, or at server start if preloaded
+        registry.register('ssim', self.load_model)
+        warmup.register('ssim', self.warm_up)
+
+    def load_model(self):
+        if settings.SSIM_BACKEND == 'tflite':
+            from .function.tflite_backend import TFLiteEmbedding
+
+            return TFLiteEmbedding(self.tflite_model_path, settings.SSIM_TFLITE['NUM_THREADS'])
+        return self.load_keras_model()
+
+    def load_keras_model(self):
+        import tensorflow as tf
+
+        return tf.keras.models.load_model(self.saved_model_path)
+
+    def warm_up(self):
+        from .function import feature
+
+        feature.warmup()
@@ -1,129 +1,207 @@
 """
 
-This module defines the SignatureClassifier class for predicting the authenticity of signatures.
+This module defines the functions for predicting the authenticity of signatures.
+
+TensorFlow is only imported through the predictor module, on first prediction.
 
 """
 
-from keras.models import Model
-from keras.applications import inception_v3
-from keras.metrics import CosineSimilarity
-import tensorflow as tf
+import os
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.db import transaction
+from image_project.libraries import embedding_cache, inference_service, timing
+from image_project.libraries.registry import registry
 from ..libraries import utils
+from ..libraries.embedding_store import EmbeddingStore
 from ..apps import SsimConfig
 
-class SignatureClassifier(Model):
+_embedding_store = None
+_predictor = None
+
+def predict_similarity(serializer):
     """
-    SignatureClassifier class extends Keras Model for signature authenticity prediction.
+    Predicts authenticity using serialized input data.
+
+    The test signature is decoded from the uploaded file and never written to disk.
+    Its embedding is looked up by the hash of the uploaded bytes first, and the
+    image is only decoded and embedded on a miss.
 
-    Attributes:
-    - embedding (tf.keras.Model): Siamese network embedding model.
-    - threshold (float): Similarity threshold for classifying signatures.
+    Parameters:
+    - serializer: Validated, unsaved serialized input data.
 
-    Methods:
-    - __init__(self, siamese_embedding, threshold): Constructor method.
-    - call(self, input_data): Abstract method for signature prediction.
-    - predict(self, data, threshold=0.86): Predicts signature authenticity.
-    - _compute_similarity(self, data): Computes cosine similarity between two signature images.
-    - predict_similarity(self, serializer): Predicts authenticity using serialized input data.
-    - preprocess_image(self, image_path): Preprocesses a signature image for model input.
+    Returns:
+    - Prediction result.
 
     """
+    nik = serializer.validated_data['nik']
+    with timing.stage('db'):
+        anchor_sign = utils.find_anchor_by_nik(nik)
+    test_upload = serializer.validated_data['img']
+    cache = embedding_cache.get_cache('ssim')
+    test_key = cache.key(test_upload, SsimConfig.model_version)
+    test_emb = cache.get(test_key)
+
+    predictor = get_predictor()
+    with timing.stage('db'):
+        anchor_emb = find_anchor_embedding(anchor_sign)
+    if anchor_emb is None:
+        if test_emb is None:
+            embeddings = predictor.embed_images([load_image(anchor_sign.img.path), load_image(test_upload)])
+            anchor_emb, test_emb = embeddings[:1], embeddings[1:]
+            cache.set(test_key, test_emb)
+        else:
+            anchor_emb = predictor.embed_images([load_image(anchor_sign.img.path)])
+        if anchor_sign.is_enrolled:
+            store_anchor_embedding(anchor_sign, anchor_emb)
+    elif test_emb is None:
+        test_emb = predictor.embed_images([load_image(test_upload)])
+        cache.set(test_key, test_emb)
+    result = predictor.predict_embeddings(anchor_emb, test_emb)
+
+    with timing.stage('delete'):
+        utils.delete_signature_data_by_nik(nik)
 
-    def __init__(self, siamese_embedding, threshold):
-        """
-        Initialize the SignatureClassifier.
+    return result
 
-        Parameters:
-        - siamese_embedding (tf.keras.Model): Siamese network embedding model.
-        - threshold (float): Similarity threshold for classifying signatures.
+def enroll_anchor(serializer):
+    """
+    Enrolls an anchor signature by precomputing and storing its embedding.
 
-        """
+    The embedding is computed from the upload before anything is saved. The anchor
+    is then saved, and any previous anchor of the same NIK is removed, in one
+    transaction, so a failed enrollment keeps the previous anchor. The embedding is
+    only appended to the store once that transaction commits.
+    The enrolled anchor is reused by every later prediction until it is replaced.
 
-        super().__init__()
-        self.embedding = siamese_embedding
-        self.threshold = threshold
+    Parameters:
+    - serializer: Validated, unsaved SignatureSerializer of the anchor.
 
-    def call(self, input_data):
-        """
-        Abstract method for signature prediction.
+    Returns:
+    - The enrolled Signature object.
 
-        Parameters:
-        - input_data: Input data for the model.
+    """
+    anchor_emb = get_predictor().embed_images([load_image(serializer.validated_data['img'])])
+    with timing.stage('save'), transaction.atomic():
+        anchor_sign = serializer.save()
+        utils.delete_previous_anchors_by_nik(anchor_sign.nik, keep_id=anchor_sign.id)
+        store_anchor_embedding(anchor_sign, anchor_emb)
 
-        Returns:
-        - Prediction result.
+    return anchor_sign
 
-        """
-        pass
+def find_anchor_embedding(anchor_sign):
+    """
+    Returns the stored anchor embedding of the current model version.
 
-    def predict(self, data, threshold=0.86):
-        """
-        Predicts signature authenticity.
+    Parameters:
+    - anchor_sign: Anchor Signature object.
 
-        Parameters:
-        - data: Tuple containing anchor and test signature images.
-        - threshold (float): Similarity threshold for classification.
+    Returns:
+    - Anchor embedding, or None if it has to be computed.
 
-        Returns:
-        - Dictionary containing 'is_fake' (boolean) and 'similarity_score' (float).
+    """
+    if anchor_sign.model_version != SsimConfig.model_version:
+        return None
+    if anchor_sign.embedding:
+        return utils.embedding_from_bytes(anchor_sign.embedding)
+    if anchor_sign.is_enrolled:
+        return get_embedding_store().get(str(anchor_sign.id))
 
-        """
-        similarity_score = self._compute_similarity(data)
-        is_fake = similarity_score < threshold
+    return None
 
-        return {'is_fake': is_fake.numpy(),
-                'similarity_score': similarity_score.numpy()}
+def store_anchor_embedding(anchor_sign, anchor_emb):
+    """
+    Stores an anchor embedding tagged with the current model version.
 
-    def _compute_similarity(self, data):
-        """
-        Computes cosine similarity between anchor and test signature images.
+    The embedding is appended to the quantized embedding store rather than
+    kept as a float32 blob on the Signature row. Store rows are keyed by the
+    anchor id and appended once the row is committed, so the embedding of a
+    rolled-back enrollment is never scored against the anchor that survives it.
+    An anchor committed without its store row is embedded again on its next prediction.
 
-        Parameters:
-        - data: Tuple containing anchor and test signature images.
+    Parameters:
+    - anchor_sign: Anchor Signature object.
+    - anchor_emb: Embedding of the anchor signature.
 
-        Returns:
-        - Cosine similarity score.
+    """
+    anchor_sign.embedding = None
+    anchor_sign.model_version = SsimConfig.model_version
+    anchor_sign.save(update_fields=['embedding', 'model_version'])
+    transaction.on_commit(lambda: get_embedding_store().append(str(anchor_sign.id), anchor_emb))
 
-        """
-        img_ori = data[0]
-        img_test = data[1]
+def get_predictor():
+    """
+    Returns the process-wide SignaturePredictor, creating it on first use.
 
-        img_ori_emb = self.embedding(inception_v3.preprocess_input(img_ori))
-        img_test_emb = self.embedding(inception_v3.preprocess_input(img_test))
+    When the ssim engine runs in the inference server, a proxy with the same
+    methods is returned instead.
 
-        cos_similarity = CosineSimilarity()
-        similarity_score = cos_similarity(img_ori_emb, img_test_emb)
+    Returns:
+    - SignaturePredictor instance, or its inference service proxy.
 
-        return similarity_score
+    """
+    global _predictor
+    if inference_service.is_remote('ssim'):
+        return inference_service.RemoteEngine('ssim')
+    if _predictor is None:
+        from .predictor import SignaturePredictor
 
-def predict_similarity(serializer):
+        _predictor = SignaturePredictor(registry.get('ssim'), 0.86)
+    return _predictor
+
+def warmup():
     """
-    Predicts authenticity using serialized input data.
+    Runs the predictor on synthetic signatures, so the first request does not pay
+    for tracing the graphs and allocating the buffers.
 
-    Parameters:
-    - serializer: Serialized input data.
+    Both request shapes are used: a test signature alone, and an anchor with its test.
+
+    """
+    rng = np.random.default_rng(0)
+    signature = np.full((300, 600, 3), 255, dtype=np.uint8)
+    signature[rng.integers(0, 300, 2000), rng.integers(0, 600, 2000)] = 0
+
+    predictor = get_predictor()
+    anchor_emb = predictor.embed_images([signature])
+    test_emb = predictor.embed_images([signature, signature])[1:]
+    predictor.predict_embeddings(anchor_emb, test_emb)
+
+def get_embedding_store():
+    """
+    Returns the embedding store of the current model version, opening it on first use.
 
     Returns:
-    - Prediction result.
+    - EmbeddingStore instance.
 
     """
-    nik = serializer.data.get('nik')
-    anchor_path, test_path = utils.find_saved_signatures_by_nik(nik)
-    anchor_image = preprocess_image(anchor_path)
-    test_image = preprocess_image(test_path)
+    global _embedding_store
+    if _embedding_store is None:
+        _embedding_store = EmbeddingStore(
+            os.path.join(settings.SSIM_EMBEDDING_STORE_DIR, SsimConfig.model_version),
+            dim=get_predictor().embedding_dim(),
+            dtype=settings.SSIM_EMBEDDING_STORE_DTYPE,
+            model_version=SsimConfig.model_version,
+        )
+    return _embedding_store
+
+def load_image(image_path):
+    """
+    Reads and decodes a signature image.
 
-    data = (anchor_image, test_image)
-    emb_model = SsimConfig.loaded_model
-    model = SignatureClassifier(emb_model, 0.86)
-    result = model.predict(data)
+    Parameters:
+    - image_path: Path to the signature image, or an uploaded file.
 
-    utils.delete_signature_data_by_nik(nik)
+    Returns:
+    - Decoded uint8 RGB image of shape (height, width, 3).
 
-    return result
+    """
+    with timing.stage('decode'), Image.open(image_path) as image:
+        return np.asarray(image.convert('RGB'))
 
 def preprocess_image(image_path):
     """
-    Preprocesses a signature image for model input.
+    Preprocesses a signature image for model input, in this process.
 
     Parameters:
     - image_path: Path to the signature image.
@@ -132,11 +210,4 @@ def preprocess_image(image_path):
     - Preprocessed image.
 
     """
-    target_shape = (200, 200)
-    image = tf.io.read_file(image_path)
-    image = tf.image.decode_png(image, channels=3)
-    image = tf.image.convert_image_dtype(image, tf.float32)
-    image = tf.image.resize(image, target_shape)
-    image = tf.expand_dims(image, axis=0)
-
-    return image
+    return get_predictor().preprocess(load_image(image_path))
@@ -0,0 +1,156 @@
+"""
+
+This module defines the SignaturePredictor class for predicting the authenticity of signatures.
+
+It imports TensorFlow, so it is only imported once the ssim model is actually needed.
+
+"""
+
+from keras.applications import inception_v3
+import numpy as np
+import tensorflow as tf
+from image_project.libraries import batching, timing
+
+class SignaturePredictor:
+    """
+    SignaturePredictor class runs compiled signature authenticity prediction.
+
+    It is created once per process. Preprocessing, embedding and cosine similarity
+    are tf.function graphs with fixed input signatures, so no Keras object is built
+    and no eager op runs per request.
+
+    Attributes:
+    - embedding (tf.keras.Model or TFLiteEmbedding): Siamese network embedding model,
+      or its converted TFLite model.
+    - threshold (float): Similarity threshold for classifying signatures.
+    - target_shape (tuple): Input size of the embedding model.
+
+    Methods:
+    - __init__(self, siamese_embedding, threshold, target_shape): Constructor method.
+    - preprocess(self, image): Resizes and preprocesses a uint8 image in-graph.
+    - embed(self, images): Computes the embeddings of preprocessed images.
+    - embed_images(self, images): Embeds uint8 images in one forward pass.
+    - embedding_dim(self): Returns the size of the embeddings.
+    - predict_embeddings(self, anchor_emb, test_emb): Predicts authenticity from embeddings.
+
+    """
+
+    def __init__(self, siamese_embedding, threshold=0.86, target_shape=(200, 200)):
+        """
+        Initialize the SignaturePredictor and trace its graphs.
+
+        Parameters:
+        - siamese_embedding (tf.keras.Model or TFLiteEmbedding): Siamese network embedding model.
+        - threshold (float): Similarity threshold for classifying signatures.
+        - target_shape (tuple): Input size of the embedding model.
+
+        """
+        self.embedding = siamese_embedding
+        self.threshold = threshold
+        self.target_shape = target_shape
+
+        self._preprocess = tf.function(
+            self._preprocess_graph,
+            input_signature=[tf.TensorSpec([None, None, 3], tf.uint8)])
+        if isinstance(siamese_embedding, tf.keras.Model):
+            self._embed = tf.function(
+                self._embed_graph,
+                input_signature=[tf.TensorSpec([None, *target_shape, 3], tf.float32)])
+        else:
+            # The TFLite interpreter runs its own compiled graph on NumPy batches
+            self._embed = siamese_embedding
+        self._similarity = tf.function(
+            self._similarity_graph,
+            input_signature=[tf.TensorSpec([None, None], tf.float32)] * 2)
+
+    def preprocess(self, image):
+        """
+        Resizes and preprocesses a decoded signature image for model input.
+
+        Parameters:
+        - image: Decoded uint8 image of shape (height, width, 3).
+
+        Returns:
+        - Model input of shape (1, *target_shape, 3).
+
+        """
+        return self._preprocess(image)
+
+    def embed(self, images):
+        """
+        Computes the embeddings of preprocessed signature images.
+
+        Concurrent calls are batched into one forward pass by the 'ssim' micro-batcher.
+
+        Parameters:
+        - images: Model inputs of shape (n, *target_shape, 3).
+
+        Returns:
+        - Embedding array of shape (n, dim).
+
+        """
+        with timing.stage('inference', model='ssim'):
+            return batching.predict('ssim', self._embed_batch, images)
+
+    def _embed_batch(self, batch):
+        # A bound method, so the batches of this predictor are stacked together
+        return np.asarray(self._embed(batch))
+
+    def embed_images(self, images):
+        """
+        Embeds decoded images stacked into a single batch.
+
+        Parameters:
+        - images: List of decoded uint8 images of shape (height, width, 3).
+
+        Returns:
+        - Embedding array of shape (len(images), dim).
+
+        """
+        with timing.stage('preprocess'):
+            batch = tf.concat([self.preprocess(image) for image in images], axis=0)
+        return self.embed(batch)
+
+    def embedding_dim(self):
+        """
+        Returns the size of the embeddings.
+
+        Returns:
+        - Embedding dimension.
+
+        """
+        return self.embedding.output_shape[-1]
+
+    def predict_embeddings(self, anchor_emb, test_emb):
+        """
+        Predicts signature authenticity from embeddings.
+
+        Parameters:
+        - anchor_emb: Embedding of the anchor signature.
+        - test_emb: Embedding of the test signature.
+
+        Returns:
+        - Dictionary containing 'is_fake' (boolean) and 'similarity_score' (float).
+
+        """
+        similarity_score = self._similarity(tf.cast(anchor_emb, tf.float32),
+                                            tf.cast(test_emb, tf.float32))[0]
+        is_fake = similarity_score < self.threshold
+
+        return {'is_fake': is_fake.numpy(),
+                'similarity_score': similarity_score.numpy()}
+
+    def _preprocess_graph(self, image):
+        image = tf.image.convert_image_dtype(image, tf.float32)
+        image = tf.image.resize(image, self.target_shape)
+        image = tf.expand_dims(image, axis=0)
+
+        return inception_v3.preprocess_input(image)
+
+    def _embed_graph(self, images):
+        return self.embedding(images, training=False)
+
+    def _similarity_graph(self, anchor_emb, test_emb):
+        # Same score as keras.metrics.CosineSimilarity for a single pair
+        return tf.reduce_sum(tf.nn.l2_normalize(anchor_emb, axis=-1) *
+                             tf.nn.l2_normalize(test_emb, axis=-1), axis=-1)
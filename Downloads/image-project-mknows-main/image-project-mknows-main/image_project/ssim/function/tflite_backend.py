@@ -0,0 +1,143 @@
+"""
+
+This module defines the TFLite backend of the ssim embedding model.
+
+The Keras model is converted offline (``manage.py convert_ssim_tflite``) with
+dynamic-range or int8 quantization, and served with the TFLite interpreter when
+SSIM_BACKEND is 'tflite'. TensorFlow is only imported when a model is converted
+or loaded, so the parity report can be computed without it.
+
+"""
+
+import threading
+
+import numpy as np
+
+QUANTIZATIONS = ('dynamic', 'int8')
+
+class TFLiteEmbedding:
+    """
+    TFLiteEmbedding runs a converted embedding model with the TFLite interpreter.
+
+    It is called on NumPy batches like the Keras model, and exposes the same
+    output_shape. The interpreter is not thread-safe, so calls are serialized;
+    concurrent requests are already merged into batches by the 'ssim' micro-batcher.
+
+    Attributes:
+    - output_shape (tuple): Output shape of the model, the last axis being the embedding size.
+
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        """
+        Load a converted model.
+
+        Parameters:
+        - model_path (str): Path of the .tflite file.
+        - num_threads (int): Number of interpreter threads, None for the TFLite default.
+
+        """
+        import tensorflow as tf
+
+        self._interpreter = tf.lite.Interpreter(model_path=model_path, num_threads=num_threads)
+        self._input = self._interpreter.get_input_details()[0]['index']
+        self._output = self._interpreter.get_output_details()[0]['index']
+        self.output_shape = tuple(self._interpreter.get_output_details()[0]['shape'])
+        self._batch_size = None
+        self._lock = threading.Lock()
+
+    def __call__(self, images):
+        """
+        Compute the embeddings of preprocessed images.
+
+        Parameters:
+        - images: Model inputs of shape (n, height, width, 3).
+
+        Returns:
+        - Embedding array of shape (n, dim).
+
+        """
+        images = np.asarray(images, dtype=np.float32)
+        with self._lock:
+            # Tensors are reallocated only when the batch size changes
+            if images.shape[0] != self._batch_size:
+                self._interpreter.resize_tensor_input(self._input, images.shape)
+                self._interpreter.allocate_tensors()
+                self._batch_size = images.shape[0]
+            self._interpreter.set_tensor(self._input, images)
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output).copy()
+
+def convert(keras_model, quantization='dynamic', representative_inputs=None):
+    """
+    Converts the Keras embedding model to a quantized TFLite model.
+
+    Parameters:
+    - keras_model (tf.keras.Model): The embedding model.
+    - quantization (str): 'dynamic' for int8 weights with float activations, or 'int8'
+      for int8 weights and activations calibrated on representative_inputs.
+    - representative_inputs (list): Preprocessed model inputs of shape (1, height, width, 3),
+      required for 'int8'.
+
+    Returns:
+    - The serialized TFLite model (bytes).
+
+    """
+    import tensorflow as tf
+
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f'Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}')
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if quantization == 'int8':
+        if not representative_inputs:
+            raise ValueError('int8 quantization needs representative inputs for calibration')
+        converter.representative_dataset = lambda: ([np.asarray(inputs, np.float32)] for inputs in representative_inputs)
+        # Inputs and outputs stay float32, so the backend is a drop-in replacement
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+def parity_report(reference_embeddings, candidate_embeddings, threshold=0.86):
+    """
+    Compares the similarity scores of two backends on the same images.
+
+    Every pair of images is scored with the embeddings of each backend.
+
+    Parameters:
+    - reference_embeddings: Embeddings of the reference (Keras) backend, shape (n, dim).
+    - candidate_embeddings: Embeddings of the candidate backend for the same images.
+    - threshold (float): Threshold of the accept/reject decision.
+
+    Returns:
+    - Dictionary with the score drift statistics, the cosine between the two embeddings
+      of each image, and the number and rate of decisions that flip at the threshold.
+
+    """
+    reference = _normalize(reference_embeddings)
+    candidate = _normalize(candidate_embeddings)
+    rows, cols = np.triu_indices(len(reference), k=1)
+    reference_scores = np.sum(reference[rows] * reference[cols], axis=1)
+    candidate_scores = np.sum(candidate[rows] * candidate[cols], axis=1)
+    drift = np.abs(candidate_scores - reference_scores)
+    flips = (reference_scores >= threshold) != (candidate_scores >= threshold)
+    self_cosine = np.sum(reference * candidate, axis=1)
+
+    return {
+        'images': len(reference),
+        'pairs': len(drift),
+        'threshold': threshold,
+        'score_drift_mean': float(drift.mean()) if len(drift) else 0.0,
+        'score_drift_p95': float(np.percentile(drift, 95)) if len(drift) else 0.0,
+        'score_drift_max': float(drift.max()) if len(drift) else 0.0,
+        'embedding_cosine_min': float(self_cosine.min()),
+        'embedding_cosine_mean': float(self_cosine.mean()),
+        'reference_accepts': int(np.sum(reference_scores >= threshold)),
+        'candidate_accepts': int(np.sum(candidate_scores >= threshold)),
+        'flips': int(flips.sum()),
+        'flip_rate': float(flips.mean()) if len(flips) else 0.0,
+    }
+
+def _normalize(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float64)
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
@@ -0,0 +1,317 @@
+"""
+
+This module provides a compact, memory-mapped, append-only store for signature embeddings.
+
+Vectors are L2-normalized and quantized to int8 with a per-vector scale, or to float16,
+and appended to flat files that are memory-mapped for reading:
+
+- vectors.bin: one row of `dim` int8/float16 values per vector.
+- scales.bin: one float32 scale per vector (int8 only).
+- niks.bin: one fixed-width 16-byte key per vector, written last, so its size is the row count.
+  The ssim app keys rows by anchor id rather than by NIK, despite the file name.
+- meta.json: dim, dtype and model version.
+
+The key to row lookup uses a sorted view of niks.bin instead of a Python dict,
+and bulk cosine scoring runs straight off the memory map in chunks.
+
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+KEY_DTYPE = np.dtype('S16')
+SUPPORTED_DTYPES = ('int8', 'float16')
+
+class EmbeddingStore:
+    """
+    Append-only quantized embedding store keyed by a string of at most 16 bytes.
+
+    Methods:
+    - append(self, key, embedding): Appends the embedding of a key.
+    - get(self, key): Returns the dequantized latest embedding of a key.
+    - score(self, key, query): Cosine similarity between a key's embedding and a query.
+    - score_all(self, query): Cosine similarity between a query and every stored vector.
+
+    """
+
+    def __init__(self, directory, dim, dtype='int8', model_version=''):
+        """
+        Opens or creates a store.
+
+        Parameters:
+        - directory (str): Directory holding the store files.
+        - dim (int): Embedding dimension.
+        - dtype (str): Storage dtype, 'int8' or 'float16'.
+        - model_version (str): Version of the model the embeddings come from.
+
+        """
+        if dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f'Unsupported embedding store dtype: {dtype}')
+
+        self.directory = directory
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.model_version = model_version
+        self._lock = threading.Lock()
+        self._view = _StoreView.empty()
+
+        os.makedirs(directory, exist_ok=True)
+        meta = {'dim': dim, 'dtype': dtype, 'model_version': model_version}
+        meta_path = self._path('meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as meta_file:
+                stored_meta = json.load(meta_file)
+            if stored_meta != meta:
+                raise ValueError(f'Embedding store {directory} holds {stored_meta}, not {meta}')
+        else:
+            with open(meta_path, 'w') as meta_file:
+                json.dump(meta, meta_file)
+
+    def __len__(self):
+        return self._refresh().rows
+
+    def append(self, key, embedding):
+        """
+        Appends the embedding of a key; a later append replaces earlier ones on lookup.
+
+        Parameters:
+        - key (str): Key of the embedding, at most 16 bytes.
+        - embedding: Embedding vector of size `dim`.
+
+        """
+        vector, scale = self.quantize(embedding)
+        with self._lock, _FileLock(self._path('append.lock')):
+            self._truncate_partial_rows()
+            with open(self._path('vectors.bin'), 'ab') as vectors_file:
+                vectors_file.write(vector.tobytes())
+            if self.dtype == np.int8:
+                with open(self._path('scales.bin'), 'ab') as scales_file:
+                    scales_file.write(np.float32(scale).tobytes())
+            with open(self._path('niks.bin'), 'ab') as keys_file:
+                keys_file.write(np.array([key], dtype=KEY_DTYPE).tobytes())
+
+    def get(self, key):
+        """
+        Returns the dequantized latest embedding of a key.
+
+        Parameters:
+        - key (str): Key of the embedding, at most 16 bytes.
+
+        Returns:
+        - Normalized float32 embedding of shape (1, dim), or None if the key is not stored.
+
+        """
+        view = self._refresh()
+        row = view.find_row(key)
+        if row is None:
+            return None
+
+        vector = view.vectors[row:row + 1].astype(np.float32)
+        if self.dtype == np.int8:
+            vector *= view.scales[row]
+        return vector
+
+    def score(self, key, query):
+        """
+        Computes the cosine similarity between the stored embedding of a key and a query.
+
+        Parameters:
+        - key (str): Key of the embedding, at most 16 bytes.
+        - query: Query embedding.
+
+        Returns:
+        - Cosine similarity score, or None if the key is not stored.
+
+        """
+        embedding = self.get(key)
+        if embedding is None:
+            return None
+        return float(embedding[0] @ _normalize(query))
+
+    def score_all(self, query, chunk_size=65536):
+        """
+        Computes the cosine similarity between a query and every stored vector.
+
+        Parameters:
+        - query: Query embedding.
+        - chunk_size (int): Number of rows dequantized at once.
+
+        Returns:
+        - Tuple of the float32 scores and the keys (as bytes) of every row.
+
+        """
+        view = self._refresh()
+        query = _normalize(query)
+        scores = np.empty(view.rows, dtype=np.float32)
+        for start in range(0, view.rows, chunk_size):
+            stop = min(start + chunk_size, view.rows)
+            scores[start:stop] = view.vectors[start:stop].astype(np.float32) @ query
+            if self.dtype == np.int8:
+                scores[start:stop] *= view.scales[start:stop]
+        return scores, view.keys
+
+    def quantize(self, embedding):
+        """
+        Normalizes and quantizes an embedding to the storage dtype.
+
+        Parameters:
+        - embedding: Embedding vector of size `dim`.
+
+        Returns:
+        - Tuple of the quantized vector and its scale (1.0 for float16).
+
+        """
+        vector = _normalize(embedding)
+        if vector.shape[0] != self.dim:
+            raise ValueError(f'Expected an embedding of size {self.dim}, got {vector.shape[0]}')
+        if self.dtype == np.float16:
+            return vector.astype(np.float16), 1.0
+
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype(np.int8), scale
+
+    def _refresh(self):
+        keys_path = self._path('niks.bin')
+        rows = os.path.getsize(keys_path) // KEY_DTYPE.itemsize if os.path.exists(keys_path) else 0
+        view = self._view
+        if rows == view.rows:
+            return view
+
+        with self._lock:
+            if rows == self._view.rows:
+                return self._view
+            keys = np.memmap(keys_path, dtype=KEY_DTYPE, mode='r', shape=(rows,))
+            vectors = np.memmap(self._path('vectors.bin'), dtype=self.dtype,
+                                mode='r', shape=(rows, self.dim))
+            scales = None
+            if self.dtype == np.int8:
+                scales = np.memmap(self._path('scales.bin'), dtype=np.float32,
+                                   mode='r', shape=(rows,))
+            self._view = _StoreView(rows, keys, vectors, scales)
+            return self._view
+
+    def _truncate_partial_rows(self):
+        # Drops vectors and scales written by an append that died before writing its key
+        keys_path = self._path('niks.bin')
+        rows = os.path.getsize(keys_path) // KEY_DTYPE.itemsize if os.path.exists(keys_path) else 0
+        sizes = {'vectors.bin': rows * self.dim * self.dtype.itemsize,
+                 'scales.bin': rows * np.dtype(np.float32).itemsize}
+        for file_name, size in sizes.items():
+            path = self._path(file_name)
+            if os.path.exists(path) and os.path.getsize(path) > size:
+                os.truncate(path, size)
+
+    def _path(self, file_name):
+        return os.path.join(self.directory, file_name)
+
+def accuracy_report(references, queries, dtype='int8', threshold=0.86, top_k=10):
+    """
+    Compares quantized store scores with float32 cosine similarity scores.
+
+    Parameters:
+    - references: Float32 reference embeddings of shape (n, dim).
+    - queries: Float32 query embeddings of shape (m, dim).
+    - dtype (str): Storage dtype to evaluate.
+    - threshold (float): Similarity threshold used for accept/reject decisions.
+    - top_k (int): Cut-off used for the recall of the quantized ranking.
+
+    Returns:
+    - Dictionary with the score error, recall@k, decision flip rate and bytes per vector.
+
+    """
+    import tempfile
+
+    references = np.asarray(references, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    dim = references.shape[1]
+    top_k = min(top_k, len(references))
+    # Same per-pair computation as keras.metrics.CosineSimilarity, in float32
+    normalized_references = references / np.linalg.norm(references, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = EmbeddingStore(directory, dim, dtype=dtype)
+        for row, reference in enumerate(references):
+            store.append(str(row), reference)
+
+        errors, recalls, flips = [], [], 0
+        for query in queries:
+            quantized, _ = store.score_all(query)
+            exact = normalized_references @ _normalize(query)
+            errors.append(np.abs(quantized - exact))
+            exact_top = set(np.argsort(-exact)[:top_k])
+            quantized_top = set(np.argsort(-quantized)[:top_k])
+            recalls.append(len(exact_top & quantized_top) / top_k)
+            flips += int(np.sum((quantized >= threshold) != (exact >= threshold)))
+
+        errors = np.concatenate(errors)
+        bytes_per_vector = store.dtype.itemsize * dim + KEY_DTYPE.itemsize
+        if store.dtype == np.int8:
+            bytes_per_vector += np.dtype(np.float32).itemsize
+
+    return {
+        'dtype': dtype,
+        'references': len(references),
+        'queries': len(queries),
+        'mean_abs_error': float(errors.mean()),
+        'max_abs_error': float(errors.max()),
+        f'recall_at_{top_k}': float(np.mean(recalls)),
+        'threshold': threshold,
+        'decision_flip_rate': flips / errors.size,
+        'bytes_per_vector': bytes_per_vector,
+        'float32_bytes_per_vector': 4 * dim,
+    }
+
+class _StoreView:
+    """Immutable snapshot of the memory-mapped rows, swapped atomically on growth."""
+
+    def __init__(self, rows, keys, vectors, scales):
+        self.rows = rows
+        self.keys = keys
+        self.vectors = vectors
+        self.scales = scales
+        # Stable sort keeps rows of the same key in append order, so the last one wins
+        self.order = np.argsort(keys, kind='stable') if rows else None
+        self.sorted_keys = keys[self.order] if rows else None
+
+    @classmethod
+    def empty(cls):
+        return cls(0, np.empty(0, dtype=KEY_DTYPE), None, None)
+
+    def find_row(self, key):
+        if not self.rows:
+            return None
+        key = np.array(key, dtype=KEY_DTYPE)
+        stop = np.searchsorted(self.sorted_keys, key, side='right')
+        if stop == 0 or self.sorted_keys[stop - 1] != key:
+            return None
+        return int(self.order[stop - 1])
+
+def _normalize(embedding):
+    vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+    return vector / np.linalg.norm(vector)
+
+class _FileLock:
+    """Advisory lock serializing appends across worker processes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, 'a')
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
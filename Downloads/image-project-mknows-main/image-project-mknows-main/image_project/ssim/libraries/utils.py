@@ -4,32 +4,69 @@ This module provides utility functions for working with signature data.
 
 """
 
+import numpy as np
 from ..models import Signature
 
-def find_saved_signatures_by_nik(nik):
+def find_anchor_by_nik(nik):
     """
-    Finds saved anchor and test signature paths by the given National Identification Number (NIK).
+    Finds the latest anchor signature record by the given National Identification Number (NIK).
+
+    Test signatures are decoded from the request and never saved, so only anchors are stored.
 
     Parameters:
     - nik (str): National Identification Number.
 
     Returns:
-    - Tuple containing the file paths of the anchor and test signatures.
+    - The anchor Signature object.
 
     """
-    anchor_sign = Signature.objects.get(nik=nik, is_anchor=True)
-    test_sign = Signature.objects.get(nik=nik, is_anchor=False)
-    anchor_path = anchor_sign.img.path
-    test_path = test_sign.img.path
-
-    return anchor_path, test_path
+    return Signature.objects.filter(nik=nik, is_anchor=True).latest('id')
 
 def delete_signature_data_by_nik(nik):
     """
     Deletes signature data associated with the given National Identification Number (NIK).
 
+    Enrolled anchors are kept, so they can be reused by later predictions.
+
     Parameters:
     - nik (str): National Identification Number.
 
     """
-    Signature.objects.filter(nik=nik).delete()
+    Signature.objects.filter(nik=nik, is_enrolled=False).delete()
+
+def delete_previous_anchors_by_nik(nik, keep_id=None):
+    """
+    Deletes all anchors except keep_id for the given National Identification Number (NIK).
+
+    Parameters:
+    - nik (str): National Identification Number.
+    - keep_id (int): Primary key of the anchor that must be kept.
+
+    """
+    Signature.objects.filter(nik=nik, is_anchor=True).exclude(id=keep_id).delete()
+
+def embedding_to_bytes(embedding):
+    """
+    Serializes an embedding into bytes for storage in a BinaryField.
+
+    Parameters:
+    - embedding: Embedding vector (tensor or array).
+
+    Returns:
+    - Bytes of the flattened float32 embedding.
+
+    """
+    return np.asarray(embedding, dtype=np.float32).reshape(-1).tobytes()
+
+def embedding_from_bytes(data):
+    """
+    Deserializes an embedding stored by embedding_to_bytes.
+
+    Parameters:
+    - data: Bytes (or memoryview) read from a BinaryField.
+
+    Returns:
+    - Embedding as a float32 array of shape (1, dim).
+
+    """
+    return np.frombuffer(bytes(data), dtype=np.float32).reshape(1, -1)
@@ -0,0 +1,85 @@
+"""
+
+Management command converting the ssim embedding model to a quantized TFLite model.
+
+The converted model is written where the 'tflite' backend loads it from, then scored
+against the Keras model on the sample signatures: the similarity-score drift and the
+accept/reject flips at the threshold are reported before the backend is switched.
+
+"""
+
+import json
+import os
+
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from ...function import feature
+from ...function.tflite_backend import QUANTIZATIONS, TFLiteEmbedding, convert, parity_report
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+class Command(BaseCommand):
+    help = 'Convert the ssim embedding model to a quantized TFLite model and report its parity.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quantization', choices=QUANTIZATIONS, default=settings.SSIM_TFLITE['QUANTIZATION'])
+        parser.add_argument('--sample-dir', default=settings.SSIM_SAMPLE_DIR,
+                            help='Signature images used for int8 calibration and the parity report.')
+        parser.add_argument('--calibration-samples', type=int, default=200)
+        parser.add_argument('--output', help='Path of the .tflite file (defaults to the path the backend loads).')
+        parser.add_argument('--threshold', type=float, default=0.86)
+
+    def handle(self, *args, **options):
+        from ...function.predictor import SignaturePredictor
+
+        config = apps.get_app_config('ssim')
+        output = options['output'] or os.path.join(
+            os.path.dirname(config.tflite_model_path),
+            f"{os.path.splitext(config.model_name)[0]}-{options['quantization']}.tflite")
+
+        image_paths = sample_paths(options['sample_dir'])
+        if options['quantization'] == 'int8' and not image_paths:
+            raise CommandError(f"int8 calibration needs signature images in {options['sample_dir']}")
+
+        # Always the Keras model, whatever SSIM_BACKEND is
+        keras_predictor = SignaturePredictor(config.load_keras_model(), options['threshold'])
+        inputs = [keras_predictor.preprocess(feature.load_image(path)).numpy() for path in image_paths]
+
+        tflite_model = convert(keras_predictor.embedding, options['quantization'],
+                               inputs[:options['calibration_samples']])
+        with open(output, 'wb') as file:
+            file.write(tflite_model)
+        self.stdout.write(f'Wrote {output} ({len(tflite_model) / 2 ** 20:.1f} MiB)')
+
+        if len(inputs) < 2:
+            self.stdout.write('Not enough sample signatures for the parity report.')
+            return
+        tflite_embedding = TFLiteEmbedding(output, settings.SSIM_TFLITE['NUM_THREADS'])
+        report = parity_report(
+            np.concatenate([keras_predictor.embedding(batch, training=False).numpy() for batch in inputs]),
+            np.concatenate([tflite_embedding(batch) for batch in inputs]),
+            threshold=options['threshold'],
+        )
+        self.stdout.write(json.dumps(report, indent=2))
+
+def sample_paths(sample_dir):
+    """
+    Lists the signature images of a sample directory.
+
+    Parameters:
+    - sample_dir (str): The directory, which may not exist.
+
+    Returns:
+    - Sorted list of image paths.
+
+    """
+    if not os.path.isdir(sample_dir):
+        return []
+    return sorted(
+        os.path.join(sample_dir, file_name)
+        for file_name in os.listdir(sample_dir)
+        if file_name.lower().endswith(IMAGE_EXTENSIONS)
+    )
@@ -0,0 +1,68 @@
+"""
+
+Management command reporting the accuracy of the quantized embedding store.
+
+Embeddings are computed with the Keras model from a directory of signature images,
+or from the images of the saved anchors, and the quantized store scores are compared
+with float32 cosine similarity scores.
+
+The queries are held out: the last images are only used as queries and never stored,
+so no query finds itself at rank 1.
+
+"""
+
+import json
+import os
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from ...function import feature
+from ...libraries.embedding_store import SUPPORTED_DTYPES, accuracy_report
+from ...models import Signature
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+class Command(BaseCommand):
+    help = 'Compare quantized embedding store scores with float32 cosine similarity scores.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image-dir', help='Directory of signature images (defaults to saved anchors).')
+        parser.add_argument('--dtype', choices=SUPPORTED_DTYPES, nargs='+', default=list(SUPPORTED_DTYPES))
+        parser.add_argument('--queries', type=int, default=100,
+                            help='Number of images held out as queries, at most half of them.')
+        parser.add_argument('--threshold', type=float, default=0.86)
+        parser.add_argument('--top-k', type=int, default=10)
+
+    def handle(self, *args, **options):
+        image_paths = self._image_paths(options['image_dir'])
+        if len(image_paths) < 2:
+            raise CommandError('At least two signature images are needed for the report.')
+
+        predictor = feature.get_predictor()
+        embeddings = np.concatenate([
+            np.asarray(predictor.embed_images([feature.load_image(path)]), dtype=np.float32)
+            for path in image_paths
+        ])
+        held_out = max(1, min(options['queries'], len(embeddings) // 2))
+        references, queries = embeddings[:-held_out], embeddings[-held_out:]
+
+        reports = [
+            accuracy_report(references, queries, dtype=dtype,
+                            threshold=options['threshold'], top_k=options['top_k'])
+            for dtype in options['dtype']
+        ]
+        self.stdout.write(json.dumps(reports, indent=2))
+
+    def _image_paths(self, image_dir):
+        if image_dir:
+            return sorted(
+                os.path.join(image_dir, file_name)
+                for file_name in os.listdir(image_dir)
+                if file_name.lower().endswith(IMAGE_EXTENSIONS)
+            )
+        return [
+            signature.img.path
+            for signature in Signature.objects.filter(is_anchor=True)
+            if os.path.isfile(signature.img.path)
+        ]
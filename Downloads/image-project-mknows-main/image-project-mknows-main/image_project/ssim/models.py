@@ -7,6 +7,9 @@ class Signature(models.Model):
     nik = models.CharField(max_length=16, default=None)
     img = models.ImageField(upload_to='images/', default=None)
     is_anchor = models.BooleanField(default=True)
+    is_enrolled = models.BooleanField(default=False)
+    embedding = models.BinaryField(null=True, blank=True, default=None)
+    model_version = models.CharField(max_length=64, blank=True, default='')
 
     def __str__(self):
         return self.nik
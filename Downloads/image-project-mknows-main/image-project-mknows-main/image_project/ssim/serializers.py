@@ -4,4 +4,4 @@ from .models import Signature
 class SignatureSerializer(serializers.ModelSerializer):
     class Meta:
         model = Signature
-        fields = ('id', 'nik', 'img', 'is_anchor')
+        fields = ('id', 'nik', 'img', 'is_anchor', 'is_enrolled')
@@ -1,3 +1,160 @@
-from django.test import TestCase
+import importlib.util
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase
+
+from .function import feature
+from .function.tflite_backend import parity_report
+from .libraries.embedding_store import EmbeddingStore, accuracy_report
+from .management.commands.convert_ssim_tflite import sample_paths
+from .models import Signature
+
+# Drift allowed between the Keras and the TFLite backends on the sample signatures
+MAX_FLIP_RATE = 0.02
+MAX_MEAN_SCORE_DRIFT = 0.01
+
+
+class ParityReportTest(SimpleTestCase):
+    def test_identical_embeddings(self):
+        embeddings = np.random.default_rng(0).normal(size=(6, 8))
+        report = parity_report(embeddings, embeddings.copy())
+        self.assertEqual(report['pairs'], 15)
+        self.assertAlmostEqual(report['score_drift_max'], 0.0)
+        self.assertEqual(report['flips'], 0)
+
+    def test_flip_at_threshold(self):
+        reference = np.array([[1.0, 0.0], [0.9, 0.5]])
+        candidate = np.array([[1.0, 0.0], [0.8, 0.6]])
+        report = parity_report(reference, candidate, threshold=0.86)
+        # 0.874 accepted by the reference, 0.8 rejected by the candidate
+        self.assertEqual(report['flips'], 1)
+        self.assertEqual(report['flip_rate'], 1.0)
+
+
+def _tflite_parity_available():
+    config = apps.get_app_config('ssim')
+    return (importlib.util.find_spec('tensorflow') is not None and
+            os.path.exists(config.saved_model_path) and
+            os.path.exists(config.tflite_model_path) and
+            len(sample_paths(settings.SSIM_SAMPLE_DIR)) >= 2)
+
+
+@unittest.skipUnless(_tflite_parity_available(),
+                     'needs TensorFlow, both ssim models and sample signatures in SSIM_SAMPLE_DIR')
+class TFLiteParityTest(SimpleTestCase):
+    def test_parity_with_keras(self):
+        from .function import feature
+        from .function.predictor import SignaturePredictor
+        from .function.tflite_backend import TFLiteEmbedding
+
+        config = apps.get_app_config('ssim')
+        keras_predictor = SignaturePredictor(config.load_keras_model())
+        tflite_embedding = TFLiteEmbedding(config.tflite_model_path, settings.SSIM_TFLITE['NUM_THREADS'])
+        inputs = [keras_predictor.preprocess(feature.load_image(path)).numpy()
+                  for path in sample_paths(settings.SSIM_SAMPLE_DIR)]
+
+        report = parity_report(
+            np.concatenate([keras_predictor.embedding(batch, training=False).numpy() for batch in inputs]),
+            np.concatenate([tflite_embedding(batch) for batch in inputs]),
+            threshold=keras_predictor.threshold,
+        )
+        message = json.dumps(report, indent=2)
+        self.assertLessEqual(report['flip_rate'], MAX_FLIP_RATE, msg=message)
+        self.assertLessEqual(report['score_drift_mean'], MAX_MEAN_SCORE_DRIFT, msg=message)
+
+
+class EmbeddingStoreTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.embeddings = np.random.default_rng(0).normal(size=(5, 64)).astype(np.float32)
+
+    def test_round_trip(self):
+        for dtype, tolerance in (('int8', 1e-2), ('float16', 1e-3)):
+            with self.subTest(dtype=dtype):
+                store = EmbeddingStore(os.path.join(self.directory, dtype), 64, dtype=dtype)
+                for nik, embedding in enumerate(self.embeddings):
+                    store.append(str(nik), embedding)
+
+                # A reopened store reads the same rows from its files
+                reopened = EmbeddingStore(os.path.join(self.directory, dtype), 64, dtype=dtype)
+                self.assertEqual(len(reopened), 5)
+                for nik, embedding in enumerate(self.embeddings):
+                    expected = embedding / np.linalg.norm(embedding)
+                    np.testing.assert_allclose(reopened.get(str(nik))[0], expected, atol=tolerance)
+                    self.assertAlmostEqual(reopened.score(str(nik), embedding), 1.0, delta=tolerance)
+                self.assertIsNone(reopened.get('missing'))
+
+    def test_latest_append_wins(self):
+        store = EmbeddingStore(self.directory, 64, dtype='float16')
+        store.append('1', self.embeddings[0])
+        store.append('2', self.embeddings[1])
+        store.append('1', self.embeddings[2])
+        expected = self.embeddings[2] / np.linalg.norm(self.embeddings[2])
+        np.testing.assert_allclose(store.get('1')[0], expected, atol=1e-3)
+
+    def test_rejects_other_meta(self):
+        EmbeddingStore(self.directory, 64, dtype='int8')
+        with self.assertRaises(ValueError):
+            EmbeddingStore(self.directory, 64, dtype='float16')
+
+    def test_accuracy_report_of_held_out_queries(self):
+        report = accuracy_report(self.embeddings[:4], self.embeddings[4:], dtype='int8', top_k=2)
+        self.assertEqual(report['references'], 4)
+        self.assertEqual(report['queries'], 1)
+        self.assertLess(report['max_abs_error'], 1e-2)
+
+
+class EnrollAnchorTest(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.store = EmbeddingStore(directory.name, 4, dtype='float16')
+        for target, value in (('get_embedding_store', lambda: self.store),
+                              ('get_predictor', lambda: self.predictor),
+                              ('load_image', lambda image: image)):
+            patcher = mock.patch.object(feature, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def enroll(self, embedding):
+        self.predictor = SimpleNamespace(embed_images=lambda images: np.array([embedding], dtype=np.float32))
+        serializer = SimpleNamespace(
+            validated_data={'img': 'anchor.png'},
+            save=lambda: Signature.objects.create(nik='1', img='images/1.png', is_enrolled=True),
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            return feature.enroll_anchor(serializer)
+
+    def test_failed_save_keeps_the_previous_embedding(self):
+        anchor = self.enroll([1, 0, 0, 0])
+
+        save = Signature.save
+
+        def failing_save(signature, *args, **kwargs):
+            # The new row is created, then storing its embedding fails
+            if kwargs.get('update_fields'):
+                raise OSError('disk full')
+            return save(signature, *args, **kwargs)
+
+        with mock.patch.object(Signature, 'save', failing_save), self.assertRaises(OSError):
+            self.enroll([0, 1, 0, 0])
+
+        # The rejected upload is never appended, so the surviving anchor keeps its own embedding
+        self.assertEqual(len(self.store), 1)
+        survivor = Signature.objects.get(nik='1')
+        self.assertEqual(survivor.id, anchor.id)
+        np.testing.assert_allclose(feature.find_anchor_embedding(survivor)[0], [1, 0, 0, 0], atol=1e-3)
+
+        # A later enrollment replaces the anchor and its embedding
+        anchor = self.enroll([0, 0, 1, 0])
+        np.testing.assert_allclose(feature.find_anchor_embedding(anchor)[0], [0, 0, 1, 0], atol=1e-3)
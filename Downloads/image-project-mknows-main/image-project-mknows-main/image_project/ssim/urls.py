@@ -1,9 +1,12 @@
 from django.urls import path
 
-from .views import Template, AnchorSignatureUpload, PredictSignatureSimilarity
+from .views import Template, AnchorSignatureUpload, EnrollSignatureUpload, PredictSignatureSimilarity
+from .views import AsyncPredictSignatureSimilarity
 
 urlpatterns = [
     path('template/', Template.as_view(), name='template_ssim'),
     path('upload-anchor/', AnchorSignatureUpload.as_view(), name='upload_anchor'),
-    path('predict-similarity/', PredictSignatureSimilarity.as_view(), name='predict_similarity')
+    path('enroll-anchor/', EnrollSignatureUpload.as_view(), name='enroll_anchor'),
+    path('predict-similarity/', PredictSignatureSimilarity.as_view(), name='predict_similarity'),
+    path('async/predict-similarity/', AsyncPredictSignatureSimilarity.as_view(), name='async_predict_similarity'),
 ]
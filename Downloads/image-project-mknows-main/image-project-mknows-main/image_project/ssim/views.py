@@ -9,6 +9,8 @@ This module defines Django REST framework views for handling signature-related f
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from image_project.libraries import executors, timing
+from image_project.views import AsyncAPIView
 from .serializers import SignatureSerializer
 from .function import feature
 
@@ -56,9 +58,45 @@ class AnchorSignatureUpload(APIView):
         """
         try:
             request.data['is_anchor'] = True
+            request.data['is_enrolled'] = False
             serializer = SignatureSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save()
+                with timing.stage('save'):
+                    serializer.save()
+                return Response(build_result(serializer.data), status=status.HTTP_200_OK)
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
+
+class EnrollSignatureUpload(APIView):
+    """
+    APIView class for enrolling a persistent anchor signature.
+
+    Methods:
+    - post(self, request): Handles POST requests for enrolling anchor signature images.
+
+    """
+
+    def post(self, request):
+        """
+        Handles POST requests for enrolling anchor signature images.
+
+        The anchor embedding is computed once and stored, so later predictions
+        for the same NIK only need the test signature.
+
+        Parameters:
+        - request: Django REST framework request object.
+
+        Returns:
+        - Response: A Response object with the result of the anchor signature enrollment.
+
+        """
+        try:
+            request.data['is_anchor'] = True
+            request.data['is_enrolled'] = True
+            serializer = SignatureSerializer(data=request.data)
+            if serializer.is_valid():
+                feature.enroll_anchor(serializer)
                 return Response(build_result(serializer.data), status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
@@ -86,15 +124,50 @@ class PredictSignatureSimilarity(APIView):
         """
         try:
             request.data['is_anchor'] = False
+            request.data['is_enrolled'] = False
             serializer = SignatureSerializer(data=request.data)
             if serializer.is_valid():
-                serializer.save()
                 result = feature.predict_similarity(serializer)
                 return Response(build_result(result), status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response(str(e), status=status.HTTP_400_BAD_REQUEST)
 
+class AsyncPredictSignatureSimilarity(AsyncAPIView):
+    """
+    Native async variant of PredictSignatureSimilarity.
+
+    The upload is validated on the event loop and the prediction runs in the
+    'ssim' inference executor.
+
+    Methods:
+    - post(self, request): Handles POST requests for predicting signature similarity.
+
+    """
+
+    async def post(self, request):
+        """
+        Handles POST requests for predicting signature similarity.
+
+        Parameters:
+        - request: Django request object.
+
+        Returns:
+        - JsonResponse: The result of the signature similarity prediction.
+
+        """
+        try:
+            data = self.request_data(request)
+            data['is_anchor'] = False
+            data['is_enrolled'] = False
+            serializer = SignatureSerializer(data=data)
+            if serializer.is_valid():
+                result = await executors.run('ssim', feature.predict_similarity, serializer)
+                return self.respond(build_result(result))
+            return self.respond(serializer.errors, status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            return self.respond(str(e), status.HTTP_400_BAD_REQUEST)
+
 def build_result(result):
     """
     Builds a standardized result dictionary.